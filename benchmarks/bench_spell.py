@@ -0,0 +1,135 @@
+"""
+Spell correction benchmark: indexed SpellCorrector vs the old per-word difflib scan.
+
+Grows the vocabulary with synthetic food-like words up to 50k terms and measures
+index build time, per-token lookup latency (cold and memoized) and how often the
+two approaches pick the same correction.
+
+    python benchmarks/bench_spell.py
+    python benchmarks/bench_spell.py --sizes 1000 10000 50000 --json spell_results.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from difflib import get_close_matches
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "nutrition_bot"))
+
+from dataset import load_dataset  # noqa: E402
+from spell_index import SpellCorrector, dataset_vocabulary  # noqa: E402
+
+SYLLABLES = ["ba", "ke", "ri", "so", "mu", "ta", "lo", "ne", "pi", "cha", "gra", "sto",
+             "ber", "lin", "qua", "zu", "fe", "dri", "mon", "sel", "tor", "vi", "yam", "ol"]
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def synthetic_vocabulary(size: int, base: list[str], rng: random.Random) -> list[str]:
+    words = list(dict.fromkeys(base))
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def make_typo(word: str, rng: random.Random) -> str:
+    chars = list(word)
+    for _ in range(rng.choice([1, 1, 2])):
+        op = rng.choice(["delete", "insert", "replace", "swap"])
+        i = rng.randrange(len(chars))
+        if op == "delete" and len(chars) > 4:
+            del chars[i]
+        elif op == "insert":
+            chars.insert(i, rng.choice(LETTERS))
+        elif op == "replace":
+            chars[i] = rng.choice(LETTERS)
+        elif i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    return "".join(chars)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def timed_ms(fn, tokens):
+    timings = []
+    results = []
+    for token in tokens:
+        began = time.perf_counter()
+        results.append(fn(token))
+        timings.append((time.perf_counter() - began) * 1000)
+    return results, timings
+
+
+def run(size: int, queries: int, difflib_queries: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    base = sorted(dataset_vocabulary(load_dataset()))
+    vocab = synthetic_vocabulary(size, base, rng)
+    tokens = [make_typo(rng.choice(vocab), rng) for _ in range(queries)]
+
+    began = time.perf_counter()
+    corrector = SpellCorrector(vocab)
+    build_seconds = time.perf_counter() - began
+
+    indexed, cold = timed_ms(corrector.lookup, tokens)
+    _, warm = timed_ms(corrector.lookup, tokens)
+
+    def difflib_lookup(token):
+        matches = get_close_matches(token, vocab, n=1, cutoff=0.7)
+        return matches[0] if matches and matches[0] != token else None
+
+    sample = tokens[:difflib_queries]
+    scanned, scan = timed_ms(difflib_lookup, sample)
+    agreement = sum(a == b for a, b in zip(indexed, scanned)) / len(sample)
+
+    return {
+        "vocabulary": len(vocab),
+        "index_keys": len(corrector.index),
+        "build_seconds": round(build_seconds, 3),
+        "indexed_cold_ms_p50": round(statistics.median(cold), 4),
+        "indexed_cold_ms_p99": round(percentile(cold, 99), 4),
+        "indexed_memo_ms_p50": round(statistics.median(warm), 5),
+        "difflib_ms_p50": round(statistics.median(scan), 3),
+        "difflib_ms_p99": round(percentile(scan, 99), 3),
+        "speedup_p50": round(statistics.median(scan) / max(statistics.median(cold), 1e-9), 1),
+        "same_answer_as_difflib": round(agreement, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--difflib-queries", type=int, default=50,
+                        help="difflib is slow on big vocabularies, so it gets a smaller sample")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = run(size, args.queries, args.difflib_queries, args.seed)
+        results.append(result)
+        print(
+            f"vocab={result['vocabulary']:>6}  build={result['build_seconds']:>6.2f}s  "
+            f"indexed p50={result['indexed_cold_ms_p50']:.3f}ms p99={result['indexed_cold_ms_p99']:.3f}ms  "
+            f"memo p50={result['indexed_memo_ms_p50']:.4f}ms  "
+            f"difflib p50={result['difflib_ms_p50']:.2f}ms  "
+            f"speedup={result['speedup_p50']}x  agree={result['same_answer_as_difflib']:.0%}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Local stand-ins for Pinecone and Groq / DeepSeek, so the backends can be load
+tested without API keys, network or per-token bills.
+
+One HTTP server answers:
+    POST /query                                   Pinecone data-plane query
+    POST /openai/v1/chat/completions              Groq (OpenAI-compatible, incl. stream=true)
+    POST /v1/chat/completions, /chat/completions  DeepSeek / any OpenAI client
+
+Pinecone returns records from the real dataset (picked deterministically from the
+query vector, metadata filters applied), so the apps do their normal work on the
+results. Chat completions return canned text of a realistic length.
+
+Latency is drawn from a distribution per upstream:
+    "0" or "const:50"      always 50 ms
+    "uniform:20:80"        uniform between 20 and 80 ms
+    "lognormal:800:0.5"    median 800 ms, sigma 0.5 - the long tail real APIs have
+
+    python benchmarks/fake_upstreams.py --port 8900 --groq-latency lognormal:800:0.5
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "nutrition_bot"))
+
+from dataset import load_dataset, record_metadata  # noqa: E402
+from retrieval import _matches_filter  # noqa: E402
+
+ANSWER_TEXT = (
+    "❌ Myth Alert! This one gets repeated a lot, but the evidence doesn't back it up.\n\n"
+    "**The Truth:** According to nutrition research, what matters most is your overall eating "
+    "pattern and total energy intake, not a single food or the time of day you eat it. 🥦\n\n"
+    "**The Science:** Studies show that portion sizes, fibre, protein and how processed a food "
+    "is shape how full you feel and how your blood sugar responds far more than the myth suggests.\n\n"
+    "**Bottom Line:** Enjoy it in sensible portions as part of a balanced plate - you don't need "
+    "to cut it out to reach your goals! 💪"
+)
+MY_TAKE_TEXT = '"Balance beats banning foods every single time!"'
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    A latency spec -> a function returning a delay in seconds
+    """
+    kind, *params = spec.split(":")
+    values = [float(p) for p in params]
+    if kind in ("0", "none"):
+        return lambda: 0.0
+    if kind == "const":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma) / 1000
+    raise ValueError(f"Unknown latency spec {spec!r} (use const:MS, uniform:LO:HI or lognormal:MEDIAN:SIGMA)")
+
+
+class FakeUpstreams:
+    def __init__(self, pinecone_latency: str = "uniform:20:60", groq_latency: str = "lognormal:700:0.5",
+                 deepseek_latency: str = "lognormal:900:0.5", error_rate: float = 0.0, seed: int = 7):
+        self.latency = {
+            "pinecone": parse_latency(pinecone_latency),
+            "groq": parse_latency(groq_latency),
+            "deepseek": parse_latency(deepseek_latency),
+        }
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        random.seed(seed)
+
+        records = load_dataset()
+        self.records = [(item["id"], record_metadata(item)) for item in records]
+        self.server = None
+
+    def count(self, name: str):
+        with self._lock:
+            self.calls[name] += 1
+
+    # -------------------------
+    # PINECONE
+    # -------------------------
+    def query(self, body: dict) -> dict:
+        vector = body.get("vector") or []
+        top_k = int(body.get("topK", body.get("top_k", 5)))
+        # The same question always gets the same records, in the same order
+        digest = hashlib.sha256(json.dumps([round(v, 3) for v in vector[:32]]).encode()).digest()
+        rng = random.Random(digest)
+        candidates = [(rid, meta) for rid, meta in self.records if _matches_filter(meta, body.get("filter"))]
+        picked = rng.sample(candidates, min(top_k, len(candidates)))
+        matches = [
+            {"id": rid, "score": round(0.9 - 0.04 * rank, 4), "values": [],
+             "metadata": meta if body.get("includeMetadata", True) else None}
+            for rank, (rid, meta) in enumerate(picked)
+        ]
+        return {"matches": matches, "namespace": body.get("namespace", ""), "usage": {"readUnits": 5}}
+
+    # -------------------------
+    # CHAT COMPLETIONS
+    # -------------------------
+    @staticmethod
+    def completion_text(body: dict) -> str:
+        model = body.get("model", "")
+        if "deepseek" in model:
+            return json.dumps({"intent": "myth_check", "keywords": ["rice"], "diet_topic": "carbs"})
+        if "70b" in model:
+            return ANSWER_TEXT
+        if 0 < (body.get("max_tokens") or 0) <= 60:
+            return MY_TAKE_TEXT
+        return "myth"  # the myth/fact check
+
+    @staticmethod
+    def usage(body: dict, text: str) -> dict:
+        prompt = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        completion = max(1, len(text) // 4)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def completion(self, body: dict) -> dict:
+        text = self.completion_text(body)
+        return {
+            "id": f"chatcmpl-{random.getrandbits(48):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": self.usage(body, text),
+        }
+
+    def stream_chunks(self, body: dict):
+        text = self.completion_text(body)
+        words = text.split(" ")
+        chunk_id = f"chatcmpl-{random.getrandbits(48):x}"
+        for i, word in enumerate(words):
+            yield {
+                "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", ""),
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+        yield {
+            "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "x_groq": {"id": chunk_id, "usage": self.usage(body, text)},
+        }
+
+    # -------------------------
+    # SERVING
+    # -------------------------
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        fakes = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                try:
+                    self.answer()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (deadline, losing hedge) - that's expected
+
+            def answer(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+
+                if self.path.rstrip("/").endswith("/query"):
+                    upstream = "pinecone"
+                elif self.path.rstrip("/").endswith("/chat/completions"):
+                    upstream = "deepseek" if "deepseek" in body.get("model", "") else "groq"
+                else:
+                    self.send_json(404, {"error": f"no fake for {self.path}"})
+                    return
+                fakes.count(upstream)
+
+                delay = fakes.latency[upstream]()
+                if fakes.error_rate and random.random() < fakes.error_rate:
+                    time.sleep(delay / 2)
+                    fakes.count(f"{upstream}_errors")
+                    self.send_json(503, {"error": {"message": "fake upstream overloaded"}})
+                    return
+
+                if upstream == "pinecone":
+                    time.sleep(delay)
+                    self.send_json(200, fakes.query(body))
+                elif body.get("stream"):
+                    self.stream(body, delay)
+                else:
+                    time.sleep(delay)
+                    self.send_json(200, fakes.completion(body))
+
+            def stream(self, body: dict, delay: float):
+                chunks = list(fakes.stream_chunks(body))
+                # A third of the time before the first token, the rest spread over the tokens
+                time.sleep(delay / 3)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                per_chunk = (delay * 2 / 3) / max(len(chunks), 1)
+                for chunk in chunks:
+                    self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    time.sleep(per_chunk)
+                self.write_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-upstreams", daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--pinecone-latency", default="uniform:20:60")
+    parser.add_argument("--groq-latency", default="lognormal:700:0.5")
+    parser.add_argument("--deepseek-latency", default="lognormal:900:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with a 503")
+    args = parser.parse_args()
+
+    fakes = FakeUpstreams(args.pinecone_latency, args.groq_latency, args.deepseek_latency, args.error_rate)
+    url = fakes.start(args.host, args.port)
+    print(f"Fake upstreams on {url} - point the apps at them with:")
+    print(f"  GROQ_BASE_URL={url} PINECONE_INDEX_HOST={url} DEEPSEEK_BASE_URL={url} RETRIEVAL_BACKEND=pinecone")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"calls so far: {dict(fakes.calls)}")
+    except KeyboardInterrupt:
+        fakes.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""
+End-to-end load test for the chat backends, fully offline.
+
+Starts the fake Pinecone / Groq / DeepSeek server from fake_upstreams.py, launches
+each backend as a subprocess pointed at it, replays the conversations in
+chat_corpus.json against POST /api/chat at each concurrency level and reports:
+
+- end-to-end latency percentiles, throughput and error rate
+- per-stage latency percentiles, from the backends' Server-Timing header
+  (spell / context / embed / cache / search / classify / llm / my_take / serialize)
+- how responses were served (answer, clarifying buttons, cache, fallback)
+- the server's RSS before, during (peak) and after the run
+- how many calls reached each fake upstream
+
+The embedding model still runs for real, so numbers include the CPU cost of encoding.
+
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --targets vrm vrm-asgi --concurrency 1 8 32 --requests 400
+    python benchmarks/loadtest.py --groq-latency lognormal:1200:0.8 --error-rate 0.02
+    python benchmarks/loadtest.py --no-response-cache --env RETRIEVAL_BACKEND=local
+    python benchmarks/loadtest.py --json after.json --compare before.json --max-regression 10
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from fake_upstreams import FakeUpstreams
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_corpus.json")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# How to start each backend; {port} is filled in
+TARGETS = {
+    "nutrition_bot": {
+        "cwd": os.path.join(ROOT, "nutrition_bot"),
+        "command": ["-m", "flask", "--app", "app", "run", "--host", "127.0.0.1", "--port", "{port}",
+                    "--with-threads", "--no-reload", "--no-debugger"],
+        "ready_path": "/",
+    },
+    "vrm": {
+        "cwd": os.path.join(ROOT, "vrm-next-app", "backend"),
+        "command": ["-m", "flask", "--app", "app", "run", "--host", "127.0.0.1", "--port", "{port}",
+                    "--with-threads", "--no-reload", "--no-debugger"],
+        "ready_path": "/readyz",
+    },
+    "vrm-asgi": {
+        "cwd": os.path.join(ROOT, "vrm-next-app", "backend"),
+        "command": ["-m", "hypercorn", "asgi_app:app", "--bind", "127.0.0.1:{port}"],
+        "ready_path": "/readyz",
+    },
+}
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(statistics.fmean(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p90": round(percentile(values, 90), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def parse_server_timing(header: Optional[str]) -> dict:
+    """
+    "embed;dur=21.7, search;dur=3.1" -> {"embed": 21.7, "search": 3.1}
+    """
+    stages = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur" and name:
+                stages[name] = float(value)
+    return stages
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_rss_mb(pid: int) -> float:
+    """
+    Resident memory of pid and its children (e.g. server workers), from /proc
+    """
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return round(total_kb / 1024, 1)
+
+
+class RssSampler:
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process_rss_mb(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# -------------------------
+# THE SERVER UNDER TEST
+# -------------------------
+class Backend:
+    def __init__(self, name: str, upstream_url: str, log_dir: str, extra_env: dict):
+        spec = TARGETS[name]
+        self.name = name
+        self.port = free_port()
+        self.ready_path = spec["ready_path"]
+        env = {
+            **os.environ,
+            "GROQ_API_KEY": "fake", "GROQ_BASE_URL": upstream_url,
+            "PINECONE_API_KEY": "fake", "PINECONE_INDEX_HOST": upstream_url,
+            "PINECONE_INDEX_NAME": "nutrition-myths",
+            "DEEPSEEK_API_KEY": "fake", "DEEPSEEK_BASE_URL": upstream_url,
+            "MODEL_LOADING": "eager",
+            "PYTHONUNBUFFERED": "1",
+            **extra_env,
+        }
+        self.log_path = os.path.join(log_dir, f"{name}.log")
+        self._log = open(self.log_path, "w")
+        command = [sys.executable] + [part.format(port=self.port) for part in spec["command"]]
+        self.process = subprocess.Popen(command, cwd=spec["cwd"], env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.process.returncode} - see {self.log_path}")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=2)
+                conn.request("GET", self.ready_path)
+                if conn.getresponse().status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"{self.name} wasn't ready after {timeout:.0f}s - see {self.log_path}")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+
+# -------------------------
+# REPLAYING THE CORPUS
+# -------------------------
+def response_kind(status: int, body: bytes) -> str:
+    if status != 200:
+        return "error"
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return "error"
+    if data.get("buttons"):
+        return "buttons"
+    return data.get("source") or "answer"
+
+
+def run_level(port: int, conversations: list, concurrency: int, total_requests: int, timeout: float) -> dict:
+    next_conversation = itertools.cycle(conversations).__next__
+    lock = threading.Lock()
+    budget = [total_requests]
+    samples = []  # (latency ms, kind, stages)
+
+    def take_one() -> bool:
+        with lock:
+            if budget[0] <= 0:
+                return False
+            budget[0] -= 1
+            return True
+
+    def worker():
+        # One keep-alive connection per simulated user, like a browser tab
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        while True:
+            with lock:
+                conversation = next_conversation()
+            for step in conversation["steps"]:
+                if not take_one():
+                    conn.close()
+                    return
+                payload = json.dumps(step).encode("utf-8")
+                began = time.perf_counter()
+                try:
+                    conn.request("POST", "/api/chat", body=payload, headers={"Content-Type": "application/json"})
+                    response = conn.getresponse()
+                    body = response.read()
+                    kind = response_kind(response.status, body)
+                    stages = parse_server_timing(response.getheader("Server-Timing"))
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+                    kind, stages = "error", {}
+                elapsed_ms = (time.perf_counter() - began) * 1000
+                with lock:
+                    samples.append((elapsed_ms, kind, stages))
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    duration = time.perf_counter() - began
+
+    latencies = [ms for ms, kind, _ in samples]
+    ok = [ms for ms, kind, _ in samples if kind != "error"]
+    answered = [ms for ms, kind, _ in samples if kind not in ("error", "buttons", "cache")]
+    stage_values: dict[str, list[float]] = {}
+    for _, _, stages in samples:
+        for name, ms in stages.items():
+            stage_values.setdefault(name, []).append(ms)
+
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, kind, _ in samples if kind == "error"),
+        "duration_s": round(duration, 2),
+        "throughput_rps": round(len(ok) / duration, 2) if duration else 0.0,
+        "latency_ms": summarize(latencies),
+        # Only requests that went all the way to the LLM (no buttons / cache hits)
+        "full_answer_latency_ms": summarize(answered),
+        "stages_ms": {name: summarize(values) for name, values in sorted(stage_values.items())},
+        "responses": dict(Counter(kind for _, kind, _ in samples)),
+    }
+
+
+def benchmark_target(name: str, fakes: FakeUpstreams, upstream_url: str, conversations: list, args,
+                     log_dir: str) -> list[dict]:
+    extra_env = dict(pair.split("=", 1) for pair in args.env)
+    if args.no_response_cache:
+        extra_env["RESPONSE_CACHE_SIZE"] = "0"
+    backend = Backend(name, upstream_url, log_dir, extra_env)
+    results = []
+    try:
+        started = time.perf_counter()
+        backend.wait_ready(args.startup_timeout)
+        startup_seconds = time.perf_counter() - started
+        print(f"▶ {name} ready on :{backend.port} after {startup_seconds:.1f}s "
+              f"({process_rss_mb(backend.process.pid)} MB RSS)")
+
+        warmup_steps = sum(len(c["steps"]) for c in conversations)
+        run_level(backend.port, conversations, 1, args.warmup or warmup_steps, args.request_timeout)
+
+        for concurrency in args.concurrency:
+            calls_before = Counter(fakes.calls)
+            rss_before = process_rss_mb(backend.process.pid)
+            with RssSampler(backend.process.pid) as sampler:
+                result = run_level(backend.port, conversations, concurrency, args.requests, args.request_timeout)
+            result = {
+                "target": name,
+                "concurrency": concurrency,
+                "startup_s": round(startup_seconds, 2),
+                **result,
+                "rss_mb": {"before": rss_before, "peak": sampler.peak,
+                           "after": process_rss_mb(backend.process.pid)},
+                "upstream_calls": dict(Counter(fakes.calls) - calls_before),
+            }
+            results.append(result)
+            latency = result["latency_ms"]
+            print(f"  c={concurrency:<3} {result['throughput_rps']:>7.1f} req/s  "
+                  f"p50={latency.get('p50', 0):>7.1f}ms p90={latency.get('p90', 0):>7.1f}ms "
+                  f"p95={latency.get('p95', 0):>7.1f}ms p99={latency.get('p99', 0):>7.1f}ms  errors={result['errors']}  "
+                  f"peak RSS={sampler.peak} MB  {result['responses']}")
+    finally:
+        backend.stop()
+    return results
+
+
+# -------------------------
+# REGRESSION COMPARISON
+# -------------------------
+def compare(results: list[dict], baseline_path: str, max_regression: Optional[float]) -> bool:
+    """
+    Prints the change against a previous results file. Returns False if p99 or
+    throughput got worse by more than max_regression percent anywhere.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["target"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    def change(new, old):
+        return (new - old) / old * 100 if old else 0.0
+
+    ok = True
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["target"], result["concurrency"]))
+        if old is None:
+            continue
+        p50 = change(result["latency_ms"]["p50"], old["latency_ms"]["p50"])
+        p99 = change(result["latency_ms"]["p99"], old["latency_ms"]["p99"])
+        rps = change(result["throughput_rps"], old["throughput_rps"])
+        flag = ""
+        if max_regression is not None and (p99 > max_regression or rps < -max_regression):
+            ok = False
+            flag = "  ❌ regression"
+        print(f"  {result['target']:<14} c={result['concurrency']:<3} p50 {p50:+6.1f}%  p99 {p99:+6.1f}%  "
+              f"throughput {rps:+6.1f}%{flag}")
+    return ok
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", choices=sorted(TARGETS), default=["nutrition_bot", "vrm"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=0, help="warmup requests (default: one pass over the corpus)")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--pinecone-latency", default="uniform:20:60")
+    parser.add_argument("--groq-latency", default="lognormal:700:0.5")
+    parser.add_argument("--deepseek-latency", default="lognormal:900:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls that get a 503")
+    parser.add_argument("--no-response-cache", action="store_true",
+                        help="turn off the vrm backend's answer cache, so every answer reaches the LLM")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="extra settings for the servers, e.g. RETRIEVAL_BACKEND=local")
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--request-timeout", type=float, default=60)
+    parser.add_argument("--json", help="results file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", help="a previous results file to compare against")
+    parser.add_argument("--max-regression", type=float,
+                        help="with --compare, exit 1 if p99 or throughput is this many percent worse")
+    args = parser.parse_args()
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        conversations = json.load(f)["conversations"]
+
+    fakes = FakeUpstreams(args.pinecone_latency, args.groq_latency, args.deepseek_latency, args.error_rate)
+    upstream_url = fakes.start()
+    print(f"Fake upstreams on {upstream_url}")
+
+    log_dir = tempfile.mkdtemp(prefix="loadtest-")
+    results = []
+    try:
+        for name in args.targets:
+            results.extend(benchmark_target(name, fakes, upstream_url, conversations, args, log_dir))
+    finally:
+        fakes.stop()
+    print(f"Server logs in {log_dir}")
+
+    output = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    json_path = args.json
+    if not json_path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        json_path = os.path.join(RESULTS_DIR, time.strftime("loadtest-%Y%m%d-%H%M%S.json"))
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"📄 Results written to {json_path}")
+
+    if args.compare and not compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
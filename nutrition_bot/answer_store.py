@@ -0,0 +1,171 @@
+"""
+Answers written ahead of time, one per dataset record and user context, so the
+questions people ask most (the dataset's own myths) cost no Groq call at all.
+Built by vrm-next-app/backend/compile_answers.py.
+
+A store is a directory with:
+    answers.json.gz  the answers (type, answer, myTake), the record and user context
+                     each was written for, and which answer each question row belongs to
+    questions.npy    one L2-normalised float16 row per compiled question: a record's
+                     myth as asked by each persona, embedded like a live query
+    manifest.json    model, dataset version, answer prompt version and counts
+
+An answer is only served when the live question is close enough (cosine, see
+ANSWER_STORE_MIN_SIMILARITY) to one it was compiled for. The retrieval score
+can't tell us that: hybrid search reports RRF ranks, not similarities.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from config import ANSWER_STORE_DIR, ANSWER_STORE_MIN_SIMILARITY, DATASET_PATH, EMBEDDING_MODEL_NAME
+from dataset import dataset_version
+from embedding_artifact import _write_atomic
+from telemetry import get_logger
+from vector_index import normalize_rows
+
+log = get_logger("answer_store")
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+ANSWERS_NAME = "answers.json.gz"
+QUESTIONS_NAME = "questions.npy"
+
+
+class AnswerStore:
+    def __init__(self, manifest: dict, contexts: list[str], answers: list[dict],
+                 question_answers: list[int], questions: np.ndarray,
+                 min_similarity: float = ANSWER_STORE_MIN_SIMILARITY):
+        self.manifest = manifest
+        self.answers = answers
+        self.questions = np.asarray(questions, dtype=np.float32)
+        self.min_similarity = min_similarity
+        # (record id, user context) -> the question rows compiled for it
+        self._rows: dict[tuple[str, str], list[int]] = {}
+        for row, answer_index in enumerate(question_answers):
+            answer = answers[answer_index]
+            self._rows.setdefault((answer["record"], contexts[answer["context"]]), []).append(row)
+        self._question_answers = question_answers
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.too_far = 0  # a compiled answer existed, but for a different enough question
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def lookup(self, record_id: str, context: str, query_vec) -> Optional[dict]:
+        """
+        {"type", "answer", "myTake", "similarity"} compiled for this record and user
+        context, if the question is close enough to one it was written for
+        """
+        rows = self._rows.get((record_id, context))
+        if not rows:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        scores = self.questions[rows] @ normalize_rows(query_vec)[0]
+        best = int(np.argmax(scores))
+        similarity = float(scores[best])
+        with self._lock:
+            if similarity < self.min_similarity:
+                self.misses += 1
+                self.too_far += 1
+                return None
+            self.hits += 1
+        answer = self.answers[self._question_answers[rows[best]]]
+        return {"type": answer["type"], "answer": answer["answer"], "myTake": answer["myTake"],
+                "similarity": similarity}
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.answers),
+            "questions": len(self.questions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "too_far": self.too_far,
+            "evictions": 0,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "dataset_version": self.manifest["dataset_version"],
+            "prompt_version": self.manifest["prompt_version"],
+        }
+
+
+def write_answer_store(out_dir: str, contexts: list[str], answers: list[dict], question_answers: list[int],
+                       questions: np.ndarray, prompt_version: str, model_name: str = EMBEDDING_MODEL_NAME,
+                       data_path: str = DATASET_PATH, **extra) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    payload = {"contexts": contexts, "answers": answers, "question_answers": question_answers}
+    _write_atomic(os.path.join(out_dir, ANSWERS_NAME),
+                  lambda f: f.write(gzip.compress(json.dumps(payload, ensure_ascii=False,
+                                                             separators=(",", ":")).encode("utf-8"))))
+    _write_atomic(os.path.join(out_dir, QUESTIONS_NAME),
+                  lambda f: np.save(f, normalize_rows(questions).astype(np.float16)))
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "model_name": model_name,
+        "prompt_version": prompt_version,
+        # The file the answers were written from, so the app can tell if its dataset differs
+        "dataset_version": dataset_version(data_path),
+        "answers": len(answers),
+        "questions": len(question_answers),
+        "contexts": len(contexts),
+        **extra,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    # The manifest goes last, so a half-written store is never picked up
+    _write_atomic(os.path.join(out_dir, MANIFEST_NAME),
+                  lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+    return manifest
+
+
+def read_manifest(directory: str = ANSWER_STORE_DIR) -> Optional[dict]:
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_answer_store(prompt_version: str, directory: str = ANSWER_STORE_DIR,
+                      model_name: str = EMBEDDING_MODEL_NAME,
+                      expected_dataset_version: Optional[str] = None) -> Optional[AnswerStore]:
+    """
+    The store in directory, or None if there isn't a usable one. Answers compiled
+    from another dataset version or with another prompt would differ from what a
+    live request writes, so those are skipped; another model's vectors don't compare.
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    expected_dataset_version = expected_dataset_version or dataset_version()
+    problem = None
+    if manifest.get("format") != FORMAT_VERSION:
+        problem = f"format {manifest.get('format')}, expected {FORMAT_VERSION}"
+    elif manifest["model_name"] != model_name:
+        problem = f"built with {manifest['model_name']}, but the model is {model_name}"
+    elif manifest["dataset_version"] != expected_dataset_version:
+        problem = f"dataset {manifest['dataset_version']}, current is {expected_dataset_version}"
+    elif manifest["prompt_version"] != prompt_version:
+        problem = f"answer prompt {manifest['prompt_version']}, current is {prompt_version}"
+    if problem:
+        log.warning("⚠️ Ignoring compiled answers in %s: %s - rebuild with `python compile_answers.py`",
+                    directory, problem)
+        return None
+
+    with open(os.path.join(directory, ANSWERS_NAME), "rb") as f:
+        payload = json.loads(gzip.decompress(f.read()))
+    questions = np.load(os.path.join(directory, QUESTIONS_NAME))
+    if len(questions) != len(payload["question_answers"]):
+        log.warning("⚠️ Ignoring compiled answers in %s: files don't match each other", directory)
+        return None
+    log.info("Serving %d compiled answers from %s", len(payload["answers"]), directory)
+    return AnswerStore(manifest, payload["contexts"], payload["answers"], payload["question_answers"], questions)
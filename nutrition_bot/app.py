@@ -1,49 +1,95 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
 from groq import Groq
 import os
 from dotenv import load_dotenv
+from config import EMBED_BATCHING, EMBEDDING_MODEL_NAME, HYBRID_SEARCH, UPSTREAM_TIMEOUTS
+from batch_embedder import BatchingEmbedder
+from encoders import load_encoder
+from embedding_cache import get_embedding_cache
+from lexical_index import LexicalIndex
+from retrieval import PineconeRetriever, hybrid_query, make_retriever, open_pinecone_index
+from stage_timing import begin, stage
+from telemetry import (CHAT_ANSWERS, CONTENT_TYPE, cache_families, get_logger, observe_request,
+                       register_collector, render_metrics, start_request)
+from upstream import UpstreamError, get_upstream, pooled_http_client, upstream_stats
 
 load_dotenv()
+log = get_logger("nutrition_bot")
 
 app = Flask(__name__)
 CORS(app)  # Allow all origins for development
 
+# Where each request's time goes, as a Server-Timing header (see stage_timing.py)
+# and in the /metrics histograms
+@app.before_request
+def start_timing():
+    g.timings = begin()
+    start_request()
+
+@app.after_request
+def add_server_timing(response):
+    if "timings" in g:
+        response.headers["Server-Timing"] = g.timings.header()
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        observe_request(endpoint, response.status_code, g.timings.elapsed())
+    return response
+
 # Initialize Pinecone
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index("nutrition-myths")
 
-# Initialize Groq client
-groq_client = Groq(api_key=GROQ_API_KEY)
+# Initialize Groq client (keep-alive pool; deadlines and retries come from the upstream)
+def make_groq_client():
+    return Groq(api_key=GROQ_API_KEY, http_client=pooled_http_client(UPSTREAM_TIMEOUTS["groq"]), max_retries=0)
+
+groq_client = make_groq_client()
+groq_upstream = get_upstream("groq")
 
 # Initialize embedding model - use 1024 dimensions to match Pinecone index
-_model = SentenceTransformer("BAAI/bge-large-en-v1.5")  # 1024 dimensions
+_model = load_encoder()  # 1024 dimensions (torch or ONNX, see EMBEDDING_ENGINE)
+_embedding_cache = get_embedding_cache(EMBEDDING_MODEL_NAME)
+# Concurrent requests share one batched encode() instead of each running their own
+_batcher = BatchingEmbedder(lambda texts: _model.encode(texts, batch_size=len(texts)))
+_encode_one = _batcher.encode if EMBED_BATCHING else _model.encode
 
 def embed_text(text):
-    """Generate embeddings for text"""
-    emb = _model.encode(text)
+    """Generate embeddings for text (repeat questions come from the cache)"""
+    with stage("embed"):
+        emb = _embedding_cache.get_or_compute(text, _encode_one)
     return emb.tolist()
 
+# Retrieval backend (Pinecone or a local in-memory index) - see RETRIEVAL_BACKEND in config.py
+retriever = make_retriever(
+    encode=lambda texts: _model.encode(texts, batch_size=32),
+    pinecone_index_factory=lambda: open_pinecone_index(PINECONE_API_KEY, "nutrition-myths"),
+    namespace="default",  # the namespace where data is stored
+    index_name="nutrition-myths",
+)
+# BM25 keyword index over the same records, fused with the vector results
+lexical_index = LexicalIndex.from_dataset() if HYBRID_SEARCH else None
+
+def after_fork():
+    """Prefork workers (serve.py) share the model but get their own network clients"""
+    global groq_client
+    groq_client = make_groq_client()
+    if isinstance(retriever, PineconeRetriever):
+        retriever.reopen()
+
 def pinecone_search(query, top_k=5):
     """Search Pinecone for relevant nutrition information"""
     try:
-        query_vec = embed_text(query)
-        
-        result = index.query(
-            vector=query_vec,
-            top_k=top_k,
-            include_metadata=True,
-            namespace="default"  # Add the namespace where data is stored
-        )
+        if lexical_index is not None:
+            # Clear keyword hits come back without running the embedding model at all
+            matches, path = hybrid_query(query, retriever, lexical_index, embed=embed_text, top_k=top_k)
+            log.debug("Retrieval path: %s", path)
+        else:
+            matches = retriever.query(embed_text(query), top_k=top_k)
         
-        print(f"Pinecone search results: {len(result.matches)} matches found")
+        log.debug("Pinecone search results: %d matches found", len(matches))
         
         chunks = []
-        for m in result.matches:
+        for m in matches:
             # Extract myth, fact, and explanation from metadata
             myth = m.metadata.get("myth", "")
             fact = m.metadata.get("fact", "")
@@ -60,7 +106,6 @@ def pinecone_search(query, top_k=5):
                        m.metadata.get("chunk_text", "") or 
                        m.metadata.get("raw_text", ""))
             
-            print(f"Match score: {m.score}, has content: {bool(text)}")
             if text and len(text) > 10:
                 chunks.append({
                     "id": m.id,
@@ -72,9 +117,7 @@ def pinecone_search(query, top_k=5):
         
         return chunks
     except Exception as e:
-        print(f"Error in pinecone_search: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error in pinecone_search: %s", e)
         return []
 
 @app.route("/", methods=["GET"])
@@ -83,10 +126,29 @@ def home():
         "status": "running",
         "message": "Nutrition Bot Backend API",
         "endpoints": {
-            "POST /api/chat": "Send nutrition questions"
-        }
+            "POST /api/chat": "Send nutrition questions",
+            "GET /metrics": "Prometheus metrics"
+        },
+        "embedding_cache": _embedding_cache.stats(),
+        "embedding_batcher": _batcher.stats(),
+        "upstreams": upstream_stats()
     })
 
+# Fallback responses for common topics
+fallback_responses = {
+    "rice": "Rice is a nutritious grain that provides energy through carbohydrates. Eating rice at night won't directly cause weight gain - total calorie intake matters most. Brown rice has more fiber and nutrients than white rice.",
+    "chicken": "Chicken is an excellent source of lean protein. A 100g serving of chicken breast contains about 165 calories and 31g of protein. It's great for muscle building and weight management.",
+    "carb": "Carbohydrates are not inherently bad! They're your body's primary energy source. The key is choosing complex carbs (whole grains, vegetables) over refined carbs (white bread, sugary foods).",
+    "protein": "Protein is essential for building and repairing tissues. Adults need about 0.8g per kg of body weight daily. Good sources include chicken, fish, eggs, legumes, and dairy.",
+}
+
+def fallback_answer(user_msg):
+    """Canned answer for when we found nothing or Groq is unavailable"""
+    for keyword, response in fallback_responses.items():
+        if keyword in user_msg:
+            return response
+    return "I'd be happy to help with nutrition questions! Try asking about specific foods (rice, chicken), macronutrients (carbs, protein, fats), or nutrition myths."
+
 @app.route("/api/chat", methods=["POST"])
 def chat():
     data = request.get_json() or {}
@@ -97,7 +159,8 @@ def chat():
 
     try:
         # Search Pinecone for relevant nutrition data
-        chunks = pinecone_search(user_msg)
+        with stage("search"):
+            chunks = pinecone_search(user_msg)
         
         if chunks and len(chunks) > 0:
             # Use Groq to generate a natural response based on the retrieved data
@@ -112,49 +175,50 @@ User Question: {user_msg}
 
 Provide a clear, concise answer based on the information above. If the information clearly states something is a myth, explain why. Keep your response under 3 paragraphs."""
 
-            completion = groq_client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[
-                    {"role": "system", "content": "You are a helpful nutrition expert who provides evidence-based answers."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=500
-            )
-            
-            answer = completion.choices[0].message.content
+            try:
+                with stage("llm"):
+                    completion = groq_upstream.call(
+                        groq_client.chat.completions.create,
+                        model="llama-3.3-70b-versatile",
+                        messages=[
+                            {"role": "system", "content": "You are a helpful nutrition expert who provides evidence-based answers."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=0.3,
+                        max_tokens=500
+                    )
+                answer = completion.choices[0].message.content
+            except UpstreamError as e:
+                # Groq is slow or down - the canned answers beat making the user wait
+                log.warning("!! Groq unavailable, using a fallback answer: %s", e)
+                answer = fallback_answer(user_msg)
+                chunks = []  # so the response says "fallback"
         else:
-            # Fallback responses for common topics
-            fallback_responses = {
-                "rice": "Rice is a nutritious grain that provides energy through carbohydrates. Eating rice at night won't directly cause weight gain - total calorie intake matters most. Brown rice has more fiber and nutrients than white rice.",
-                "chicken": "Chicken is an excellent source of lean protein. A 100g serving of chicken breast contains about 165 calories and 31g of protein. It's great for muscle building and weight management.",
-                "carb": "Carbohydrates are not inherently bad! They're your body's primary energy source. The key is choosing complex carbs (whole grains, vegetables) over refined carbs (white bread, sugary foods).",
-                "protein": "Protein is essential for building and repairing tissues. Adults need about 0.8g per kg of body weight daily. Good sources include chicken, fish, eggs, legumes, and dairy.",
-            }
-            
-            answer = None
-            for keyword, response in fallback_responses.items():
-                if keyword in user_msg:
-                    answer = response
-                    break
-            
-            if not answer:
-                answer = "I'd be happy to help with nutrition questions! Try asking about specific foods (rice, chicken), macronutrients (carbs, protein, fats), or nutrition myths."
+            answer = fallback_answer(user_msg)
         
-        return jsonify({
-            "answer": answer,
-            "type": "info",
-            "source": "groq_enhanced" if chunks else "fallback"
-        })
+        source = "groq_enhanced" if chunks else "fallback"
+        CHAT_ANSWERS.inc(source=source)
+        with stage("serialize"):
+            return jsonify({
+                "answer": answer,
+                "type": "info",
+                "source": source
+            })
             
     except Exception as e:
-        print(f"!! ERROR in /api/chat: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("!! ERROR in /api/chat: %s", e)
         return jsonify({
             "answer": "I'm here to help with nutrition questions! Try asking about common foods, macronutrients, or nutrition myths.",
             "type": "info"
         }), 200
 
+# Cache counters, read when /metrics is scraped (latencies and upstreams are built in)
+register_collector(lambda: cache_families("embedding", _embedding_cache.stats()))
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=5001, debug=True)
+    # Development server - in production use `python serve.py nutrition_bot`
+    app.run(host="127.0.0.1", port=5001, debug=os.getenv("FLASK_DEBUG", "1") == "1")
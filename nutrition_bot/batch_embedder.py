@@ -0,0 +1,121 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable
+
+import numpy as np
+
+from config import EMBED_BATCH_SIZE, EMBED_BATCH_WAIT_MS, EMBED_TORCH_THREADS
+
+
+def configure_torch_threads(num_threads: int = EMBED_TORCH_THREADS):
+    """
+    Pin torch's intra-op thread pool. With batching, one big encode() at a time
+    beats many request threads fighting over every core. 0 keeps torch's default.
+    """
+    if num_threads > 0:
+        import torch
+        torch.set_num_threads(num_threads)
+
+
+class BatchingEmbedder:
+    """
+    Coalesces concurrent single-text encode() calls into one batched encode.
+
+    Request threads call encode(text) and block; a background thread collects
+    whatever arrives within max_wait_ms (or up to max_batch_size texts), runs
+    encode_batch once and hands each caller its own row back.
+    """
+
+    def __init__(self, encode_batch: Callable, max_batch_size: int = EMBED_BATCH_SIZE,
+                 max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+        self.batch_sizes: Counter = Counter()
+        self.items = 0
+        self.max_queue_depth = 0
+        self.encode_seconds = 0.0
+
+    def encode(self, text: str) -> np.ndarray:
+        """
+        Embed one text, sharing the model call with whoever else is waiting.
+        """
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, future))
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return future.result()
+
+    def _ensure_worker(self):
+        # Threads don't survive fork(), so prefork workers each start their own
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            if self._worker_pid != os.getpid():
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+
+            # The same question often arrives from several users at once
+            unique_texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                started = time.perf_counter()
+                vectors = np.asarray(self.encode_batch(unique_texts), dtype=np.float32)
+                self.encode_seconds += time.perf_counter() - started
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            rows = {text: vectors[i] for i, text in enumerate(unique_texts)}
+            for text, future in batch:
+                future.set_result(rows[text])
+
+            self.batch_sizes[len(batch)] += 1
+            self.items += len(batch)
+
+    def stats(self) -> dict:
+        batches = sum(self.batch_sizes.values())
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / batches, 2) if batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "encode_seconds": round(self.encode_seconds, 3),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
@@ -1,9 +1,215 @@
 from dotenv import load_dotenv
 import os
+import tempfile
 
 load_dotenv()  # load from .env
 
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
 PINECONE_ENVIRONMENT = os.getenv("PINECONE_ENVIRONMENT")
+# Connect to this index host directly instead of looking the index up by name
+# (skips a control-plane call; also how benchmarks/ points the apps at a fake)
+PINECONE_INDEX_HOST = os.getenv("PINECONE_INDEX_HOST")
+
+# Local copy of the myths we upload to Pinecone
+DATASET_PATH = os.getenv(
+    "DATASET_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrition_myths_dataset.json"),
+)
+
+# Keyword tables for context extraction and the clarifying buttons (vrm-next-app backend)
+CONTEXT_RULES_PATH = os.getenv(
+    "CONTEXT_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 "vrm-next-app", "backend", "context_rules.json"),
+)
+
+# Where pinecone_search() gets its matches from:
+#   "pinecone" - the remote "nutrition-myths" index (default)
+#   "local"    - exact cosine top-k over an in-memory NumPy matrix
+#   "hnsw"     - approximate HNSW graph, for when the dataset gets big
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "pinecone").lower()
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "100"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+# Query embedding model used by both Flask backends (1024-d, matches the Pinecone index)
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "BAAI/bge-large-en-v1.5")
+
+# Query embedding cache - most traffic is the same few dozen questions
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "3600"))  # seconds
+
+# Semantic answer cache for /api/chat (paraphrases of answered questions skip Groq)
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))  # seconds
+# If set, POST /api/cache/invalidate needs a matching X-Admin-Token header
+CACHE_ADMIN_TOKEN = os.getenv("CACHE_ADMIN_TOKEN")
+
+# Async (ASGI) serving mode: thread pools for blocking work off the event loop
+# encode() calls are coalesced by the batcher below, so these threads mostly wait
+ASYNC_EMBED_THREADS = int(os.getenv("ASYNC_EMBED_THREADS", "16"))
+ASYNC_IO_THREADS = int(os.getenv("ASYNC_IO_THREADS", "64"))  # blocking Pinecone queries
+
+# Micro-batching for query embeddings: concurrent encode() calls are collected for
+# up to EMBED_BATCH_WAIT_MS (or EMBED_BATCH_SIZE texts) and run as one batch
+EMBED_BATCHING = os.getenv("EMBED_BATCHING", "1") == "1"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "16"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+EMBED_TORCH_THREADS = int(os.getenv("EMBED_TORCH_THREADS", "0"))  # 0 = torch default
+
+# How the chat backend loads its model, retriever and Groq client:
+#   "background" - start loading right after import, serve /healthz meanwhile (default)
+#   "eager"      - load everything before the module finishes importing
+#   "lazy"       - load on the first request that needs it
+MODEL_LOADING = os.getenv("MODEL_LOADING", "background").lower()
+
+# Embedding engine for queries: "torch" (SentenceTransformer) or "onnx"
+# (an int8-quantized export made with `python onnx_embedder.py export`)
+EMBEDDING_ENGINE = os.getenv("EMBEDDING_ENGINE", "torch").lower()
+ONNX_MODEL_DIR = os.getenv(
+    "ONNX_MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "bge-large-en-v1.5-onnx"),
+)
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))  # 0 = onnxruntime default
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS", "1"))
+ONNX_MIN_AGREEMENT = float(os.getenv("ONNX_MIN_AGREEMENT", "0.99"))  # min cosine vs the torch model
+
+# Local myth/fact classifier for the avatar's answer type: similarity-weighted
+# kNN vote over the dataset's myth and fact statements. Below the confidence
+# threshold the chat backend asks Groq instead.
+MYTH_CLASSIFIER_K = int(os.getenv("MYTH_CLASSIFIER_K", "7"))
+MYTH_CLASSIFIER_TEMPERATURE = float(os.getenv("MYTH_CLASSIFIER_TEMPERATURE", "0.05"))
+MYTH_CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("MYTH_CLASSIFIER_MIN_CONFIDENCE", "0.7"))
+# Questions less similar than this to every statement aren't about a myth or fact we know
+MYTH_CLASSIFIER_MIN_SIMILARITY = float(os.getenv("MYTH_CLASSIFIER_MIN_SIMILARITY", "0.5"))
+
+# nutrition_bot's query analysis (intent / keywords / diet_topic) runs locally.
+# Intent matches weaker than this go to the DeepSeek analyzer if the fallback is on.
+QUERY_ANALYZER_MIN_INTENT_SIMILARITY = float(os.getenv("QUERY_ANALYZER_MIN_INTENT_SIMILARITY", "0.4"))
+QUERY_ANALYZER_REMOTE_FALLBACK = os.getenv("QUERY_ANALYZER_REMOTE_FALLBACK", "0") == "1"
+QUERY_ANALYZER_CACHE_SIZE = int(os.getenv("QUERY_ANALYZER_CACHE_SIZE", "1024"))  # remote answers kept
+
+# Precomputed dataset embeddings (`python embedding_artifact.py build`). When an
+# artifact for the current model and dataset exists here, the local retriever and
+# the myth classifier memory-map it instead of embedding the dataset at startup.
+EMBEDDING_ARTIFACT_DIR = os.getenv(
+    "EMBEDDING_ARTIFACT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts", "embeddings"),
+)
+
+# Hybrid retrieval: BM25 over myth/fact/explanation/tags fused with the vector
+# results by reciprocal-rank fusion. A query whose top BM25 hit contains at least
+# LEXICAL_FAST_PATH_MIN_COVERAGE of its terms and beats the runner-up by
+# LEXICAL_FAST_PATH_MIN_MARGIN is answered lexically, without an embedding.
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEXICAL_FAST_PATH = os.getenv("LEXICAL_FAST_PATH", "1") == "1"
+LEXICAL_FAST_PATH_MIN_COVERAGE = float(os.getenv("LEXICAL_FAST_PATH_MIN_COVERAGE", "1.0"))
+LEXICAL_FAST_PATH_MIN_MARGIN = float(os.getenv("LEXICAL_FAST_PATH_MIN_MARGIN", "1.5"))
+
+# Answer prompt size: the retrieved sources are deduplicated, chunks scoring below
+# CONTEXT_MIN_RELATIVE_SCORE x the best one are dropped (plain vector search only -
+# hybrid search's RRF scores aren't relevance), explanations are cut to
+# the CONTEXT_EXPLANATION_SENTENCES sentences closest to the question, and sources
+# are added until the Retrieved Information block reaches CONTEXT_TOKEN_BUDGET.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "300"))
+CONTEXT_MAX_SOURCES = int(os.getenv("CONTEXT_MAX_SOURCES", "3"))
+CONTEXT_MIN_RELATIVE_SCORE = float(os.getenv("CONTEXT_MIN_RELATIVE_SCORE", "0.5"))
+CONTEXT_EXPLANATION_SENTENCES = int(os.getenv("CONTEXT_EXPLANATION_SENTENCES", "2"))
+CONTEXT_DEDUPE_OVERLAP = float(os.getenv("CONTEXT_DEDUPE_OVERLAP", "0.8"))  # Jaccard of myth+fact terms
+
+# Calls to Groq, Pinecone and DeepSeek (see upstream.py): a deadline per call that
+# covers every retry, jittered retries for timeouts / 429 / 5xx, a hedged duplicate
+# after the upstream's recent p95 latency, and a circuit breaker that fails fast
+# after UPSTREAM_BREAKER_FAILURES failed calls in a row.
+UPSTREAM_TIMEOUTS = {
+    "groq": float(os.getenv("GROQ_TIMEOUT_SECONDS", "20")),
+    "pinecone": float(os.getenv("PINECONE_TIMEOUT_SECONDS", "3")),
+    "deepseek": float(os.getenv("DEEPSEEK_TIMEOUT_SECONDS", "8")),
+}
+# Short Groq calls (myTake, myth/fact check) get a tighter deadline than the answer
+GROQ_FAST_TIMEOUT_SECONDS = float(os.getenv("GROQ_FAST_TIMEOUT_SECONDS", "5"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "1") == "1"
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95"))
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+UPSTREAM_HEDGE_MAX_RATIO = float(os.getenv("UPSTREAM_HEDGE_MAX_RATIO", "0.1"))  # hedges per call, at most
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_RESET_SECONDS = float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+UPSTREAM_THREADS = int(os.getenv("UPSTREAM_THREADS", "64"))
+# Keep-alive HTTP connection pool shared by each SDK client
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_KEEPALIVE_CONNECTIONS", "20"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "2"))
+PINECONE_POOL_THREADS = int(os.getenv("PINECONE_POOL_THREADS", "8"))
+
+# Logging (see telemetry.py): records go through a queue to one writer thread.
+# Below WARNING only LOG_SAMPLE_RATE of requests log anything (all of a kept
+# request's lines are kept); warnings and errors are always written.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records beyond this are dropped, not waited on
+
+# Production serving (`python serve.py vrm` / `python serve.py nutrition_bot`, see
+# serve.py): the master loads the model and indexes once and forks SERVE_WORKERS
+# workers that share them copy-on-write, each answering with SERVE_THREADS threads.
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1)))
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", "8"))  # requests mostly wait on Groq
+SERVE_TIMEOUT = int(os.getenv("SERVE_TIMEOUT", "60"))  # a worker silent this long is restarted
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))  # to finish requests on restart
+SERVE_KEEPALIVE = int(os.getenv("SERVE_KEEPALIVE", "5"))
+# Recycle a worker after this many requests (0 = never); a fresh fork is cheap
+SERVE_MAX_REQUESTS = int(os.getenv("SERVE_MAX_REQUESTS", "0"))
+SERVE_MAX_REQUESTS_JITTER = int(os.getenv("SERVE_MAX_REQUESTS_JITTER", "0"))
+SERVE_BIND = os.getenv("SERVE_BIND")  # default: each app's usual port
+SERVE_PIDFILE = os.getenv("SERVE_PIDFILE")  # default: serve-<app>.pid in the temp dir
+
+# Conversation sessions (see session_store.py): the chat UI sends a sessionId and the
+# preferences it picked are remembered here instead of being resent every turn, so
+# every process answering the same users has to see the same sessions:
+#   "auto"   - "sqlite" when serve.py forks more than one worker, "memory" otherwise (default)
+#   "memory" - per process: only for a single worker (serve.py refuses it with more)
+#   "sqlite" - one file shared by every worker on the machine
+# Several machines, or several hypercorn workers, need "sqlite" on shared storage at least.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "auto").lower()
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "86400"))  # since the session's last turn
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "50000"))
+SESSION_DB_PATH = os.getenv(
+    "SESSION_DB_PATH",
+    os.path.join(tempfile.gettempdir(), "nutrition_sessions.sqlite3"),
+)
+
+# POST /api/chat/batch: up to BATCH_MAX_ITEMS questions per request. They're prepared
+# BATCH_PREPARE_SIZE at a time (one encode, one search for the lot) and at most
+# BATCH_CONCURRENCY of them wait on Groq at once, per batch.
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_PREPARE_SIZE = int(os.getenv("BATCH_PREPARE_SIZE", "64"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Answers compiled ahead of time for every dataset record and persona
+# (`python compile_answers.py` in vrm-next-app/backend). /api/chat serves one when
+# the question is at least ANSWER_STORE_MIN_SIMILARITY (cosine) to a question it
+# was compiled for, and asks Groq otherwise.
+ANSWER_STORE_ENABLED = os.getenv("ANSWER_STORE_ENABLED", "1") == "1"
+ANSWER_STORE_DIR = os.getenv(
+    "ANSWER_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts", "answers"),
+)
+ANSWER_STORE_MIN_SIMILARITY = float(os.getenv("ANSWER_STORE_MIN_SIMILARITY", "0.85"))
+ANSWER_COMPILE_CONCURRENCY = int(os.getenv("ANSWER_COMPILE_CONCURRENCY", "4"))  # Groq calls in flight
+
+# Retrieval sidecar (`python retrieval_sidecar.py serve`): one process on the box owns
+# the embedding models and the retrievers, and both Flask backends embed and search
+# through it over a Unix socket instead of each loading their own copies. Unset (the
+# default) means every app loads its own, as before.
+RETRIEVAL_SIDECAR_SOCKET = os.getenv("RETRIEVAL_SIDECAR_SOCKET", "")
+# The models the sidecar serves (and loads at startup): ours, and embeddings.py's
+RETRIEVAL_SIDECAR_MODELS = [
+    name.strip() for name in
+    os.getenv("RETRIEVAL_SIDECAR_MODELS", f"{EMBEDDING_MODEL_NAME},all-MiniLM-L6-v2").split(",") if name.strip()
+]
+RETRIEVAL_SIDECAR_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_SIDECAR_TIMEOUT_SECONDS", "10"))
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import re
+from typing import Iterator
+
+from config import DATASET_PATH
+
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def load_dataset(path: str = DATASET_PATH) -> list[dict]:
+    """
+    Load the nutrition myths dataset (a JSON list of myth/fact records).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_records(path: str = DATASET_PATH, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """
+    Stream records one at a time, without reading the whole file into memory.
+    Handles JSON Lines (one record per line) and a top-level JSON array.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} should be a JSON array of records (or use .jsonl)")
+        pos, at_eof = 1, False
+
+        while True:
+            # Skip separators between records
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if buffer.startswith("]", pos):
+                return
+            try:
+                item, pos_after = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Record is cut off at the end of the buffer - read more and retry
+                if at_eof:
+                    raise
+                more = f.read(chunk_size)
+                at_eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield item
+            pos = pos_after
+
+
+def dataset_version(path: str = DATASET_PATH) -> str:
+    """
+    Short content hash of the dataset file, so anything derived from it
+    (cached answers, embeddings) can tell when it changed.
+    """
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def record_text(item: dict) -> str:
+    """
+    The text we embed for a record.
+    IMPORTANT: keep this in sync with what upload_to_pinecone.py sends as chunk_text.
+    """
+    return (
+        f"Myth: {item['myth']}\n"
+        f"Fact: {item['fact']}\n"
+        f"Explanation: {item['explanation']}"
+    )
+
+
+def record_metadata(item: dict) -> dict:
+    """
+    Metadata stored next to each vector, same fields we upload to Pinecone.
+    """
+    return {
+        "chunk_text": record_text(item),
+        "myth": item["myth"],
+        "fact": item["fact"],
+        "explanation": item["explanation"],
+        "category": item.get("category"),
+        "tags": item.get("tags"),
+        "source_title": item.get("source_title"),
+        "source_url": item.get("source_url"),
+        "source_type": item.get("source_type"),
+        "year": item.get("year"),
+    }
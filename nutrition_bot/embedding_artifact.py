@@ -0,0 +1,234 @@
+"""
+Precomputed embeddings for the myths dataset, so nothing has to re-embed the
+dataset at startup.
+
+An artifact is a directory with:
+    records.npy     one L2-normalised row per record (record_text), float32 or float16
+    statements.npy  one row per myth / fact statement (for the myth classifier)
+    records.json    ids, metadata and statement labels, in row order
+    manifest.json   model name, engine, dimension, dtype, counts and the dataset hash
+
+Loading memory-maps the .npy files, so it takes milliseconds and every worker
+process shares the same page-cache pages instead of holding its own copy.
+float32 is used in place; float16 halves the files but is converted on load.
+
+Build it after changing the dataset or the model:
+    python embedding_artifact.py build
+    python embedding_artifact.py build --dtype float16 --out /srv/artifacts/embeddings
+    python embedding_artifact.py build --model all-MiniLM-L6-v2   # for embeddings.py
+    python embedding_artifact.py info
+
+Our main model's artifact lives in EMBEDDING_ARTIFACT_DIR, any other model's in a
+directory of its own next to it (see artifact_dir()).
+"""
+import argparse
+import json
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+from config import DATASET_PATH, EMBEDDING_ARTIFACT_DIR, EMBEDDING_ENGINE, EMBEDDING_MODEL_NAME
+from dataset import dataset_version, load_dataset, record_metadata, record_text
+from myth_classifier import myth_fact_statements
+from telemetry import get_logger
+from vector_index import normalize_rows
+
+log = get_logger("embedding_artifact")
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+RECORDS_NAME = "records.npy"
+STATEMENTS_NAME = "statements.npy"
+SIDECAR_NAME = "records.json"
+
+
+class EmbeddingArtifact:
+    """
+    A loaded artifact: memory-mapped vectors plus the ids and metadata for each row
+    """
+
+    def __init__(self, directory: str, manifest: dict, vectors: np.ndarray,
+                 statement_vectors: np.ndarray, sidecar: dict):
+        self.directory = directory
+        self.manifest = manifest
+        self.vectors = vectors
+        self.statement_vectors = statement_vectors
+        self.ids: list[str] = sidecar["ids"]
+        self.metadata: list[dict] = sidecar["metadata"]
+        self.statement_labels: list[str] = sidecar["statement_labels"]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def model_name(self) -> str:
+        return self.manifest["model_name"]
+
+    @property
+    def dataset_version(self) -> str:
+        return self.manifest["dataset_version"]
+
+
+def _write_atomic(path: str, write):
+    # Never overwrite a file in place: a worker may have the old one memory-mapped,
+    # and truncating it under the mapping crashes that worker. Rename swaps inodes.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def build_artifact(out_dir: str = EMBEDDING_ARTIFACT_DIR, model_name: str = EMBEDDING_MODEL_NAME,
+                   engine: str = EMBEDDING_ENGINE, dtype: str = "float32",
+                   path: str = DATASET_PATH, batch_size: int = 32) -> dict:
+    from encoders import load_encoder
+
+    records = load_dataset(path)
+    statements, labels = myth_fact_statements(records)
+    model = load_encoder(model_name, engine)
+
+    started = time.perf_counter()
+    vectors = normalize_rows(model.encode([record_text(item) for item in records], batch_size=batch_size))
+    statement_vectors = normalize_rows(model.encode(statements, batch_size=batch_size))
+    encode_seconds = time.perf_counter() - started
+
+    os.makedirs(out_dir, exist_ok=True)
+    _write_atomic(os.path.join(out_dir, RECORDS_NAME), lambda f: np.save(f, vectors.astype(dtype)))
+    _write_atomic(os.path.join(out_dir, STATEMENTS_NAME), lambda f: np.save(f, statement_vectors.astype(dtype)))
+    sidecar = {
+        "ids": [item["id"] for item in records],
+        "metadata": [record_metadata(item) for item in records],
+        "statement_labels": labels,
+    }
+    _write_atomic(os.path.join(out_dir, SIDECAR_NAME),
+                  lambda f: f.write(json.dumps(sidecar, ensure_ascii=False).encode("utf-8")))
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "model_name": model_name,
+        "engine": engine,
+        "dimension": int(vectors.shape[1]),
+        "dtype": dtype,
+        "records": len(records),
+        "statements": len(statements),
+        "dataset_version": dataset_version(path),
+        "normalized": True,
+        "encode_seconds": round(encode_seconds, 2),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    # The manifest goes last, so a half-built artifact is never picked up
+    _write_atomic(os.path.join(out_dir, MANIFEST_NAME),
+                  lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+    return manifest
+
+
+def artifact_dir(model_name: str = EMBEDDING_MODEL_NAME) -> str:
+    """
+    Where the artifact for model_name lives: EMBEDDING_ARTIFACT_DIR for our main
+    model, "<EMBEDDING_ARTIFACT_DIR>-<model>" for others, so they never overwrite it
+    """
+    if model_name == EMBEDDING_MODEL_NAME:
+        return EMBEDDING_ARTIFACT_DIR
+    slug = re.sub(r"[^A-Za-z0-9.]+", "-", model_name).strip("-").lower()
+    return f"{EMBEDDING_ARTIFACT_DIR.rstrip(os.sep)}-{slug}"
+
+
+def read_manifest(directory: str = EMBEDDING_ARTIFACT_DIR) -> Optional[dict]:
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_artifact(directory: str = EMBEDDING_ARTIFACT_DIR, model_name: str = EMBEDDING_MODEL_NAME,
+                  expected_dataset_version: Optional[str] = None) -> Optional[EmbeddingArtifact]:
+    """
+    The artifact in directory, or None if there isn't a usable one.
+
+    An artifact built with another model is never usable (its vectors live in a
+    different space); one built from another version of the dataset is skipped
+    so the caller re-embeds the current data instead of serving stale rows.
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    if manifest.get("format") != FORMAT_VERSION:
+        log.warning("⚠️ Ignoring embedding artifact in %s: format %s, expected %s",
+                    directory, manifest.get("format"), FORMAT_VERSION)
+        return None
+    if manifest["model_name"] != model_name:
+        log.warning("⚠️ Ignoring embedding artifact in %s: built with %s, but the model is %s",
+                    directory, manifest["model_name"], model_name)
+        return None
+    expected_dataset_version = expected_dataset_version or dataset_version()
+    if manifest["dataset_version"] != expected_dataset_version:
+        log.warning("⚠️ Ignoring stale embedding artifact in %s: dataset %s, current is %s"
+                    " - rebuild it with `python embedding_artifact.py build`",
+                    directory, manifest["dataset_version"], expected_dataset_version)
+        return None
+
+    # mmap_mode="r" maps the file read-only: nothing is read until a page is used,
+    # and every process mapping it shares the same physical memory
+    vectors = np.load(os.path.join(directory, RECORDS_NAME), mmap_mode="r")
+    statement_vectors = np.load(os.path.join(directory, STATEMENTS_NAME), mmap_mode="r")
+    with open(os.path.join(directory, SIDECAR_NAME), "r", encoding="utf-8") as f:
+        sidecar = json.load(f)
+
+    if vectors.shape != (manifest["records"], manifest["dimension"]) or len(sidecar["ids"]) != len(vectors):
+        log.warning("⚠️ Ignoring embedding artifact in %s: files don't match its manifest", directory)
+        return None
+    return EmbeddingArtifact(directory, manifest, vectors, statement_vectors, sidecar)
+
+
+def shared_artifact(directory: str = EMBEDDING_ARTIFACT_DIR,
+                    model_name: str = EMBEDDING_MODEL_NAME) -> Optional[EmbeddingArtifact]:
+    """
+    load_artifact(), once per process - the retriever and the classifier share it
+    """
+    return _load_once(directory, model_name)
+
+
+@lru_cache(maxsize=None)
+def _load_once(directory: str, model_name: str) -> Optional[EmbeddingArtifact]:
+    return load_artifact(directory, model_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build / inspect the precomputed dataset embeddings")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="embed the dataset and write the artifact")
+    build.add_argument("--out", default=None, help="default: the model's artifact directory")
+    build.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    build.add_argument("--engine", choices=["torch", "onnx"], default=EMBEDDING_ENGINE)
+    build.add_argument("--dtype", choices=["float32", "float16"], default="float32",
+                       help="float32 is shared zero-copy between workers; float16 halves the files")
+    build.add_argument("--data", default=DATASET_PATH)
+
+    info = sub.add_parser("info", help="show the manifest and whether it's current")
+    info.add_argument("--dir", default=EMBEDDING_ARTIFACT_DIR)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        args.out = args.out or artifact_dir(args.model)
+        manifest = build_artifact(args.out, args.model, args.engine, args.dtype, args.data)
+        print(json.dumps(manifest, indent=2))
+        print(f"✅ Wrote {manifest['records']} record vectors to {args.out}")
+        return
+
+    manifest = read_manifest(args.dir)
+    if manifest is None:
+        print(f"No embedding artifact in {args.dir}")
+        return
+    print(json.dumps(manifest, indent=2))
+    current = manifest["dataset_version"] == dataset_version()
+    print("✅ Matches the current dataset" if current else "⚠️ Stale - the dataset changed since this was built")
+
+
+if __name__ == "__main__":
+    main()
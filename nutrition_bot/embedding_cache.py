@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+from config import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL
+
+
+def normalize_text(text: str) -> str:
+    """
+    Cache key for a query: casefolded with whitespace collapsed,
+    so "Is rice  at night BAD" and "is rice at night bad" share an entry.
+    """
+    return " ".join(text.casefold().split())
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU + TTL cache of query embeddings.
+    Vectors are stored as read-only float32 arrays (4 KB for a 1024-d vector).
+    """
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_SIZE,
+                 ttl_seconds: float = EMBEDDING_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = normalize_text(text)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                # Expired - drop it and treat as a miss
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector) -> np.ndarray:
+        vec = np.array(vector, dtype=np.float32)
+        vec.setflags(write=False)  # shared between requests, so nobody gets to mutate it
+        key = normalize_text(text)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vec)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return vec
+
+    def get_or_compute(self, text: str, compute: Callable) -> np.ndarray:
+        """
+        Return the cached vector for text, or run compute(text) and remember it.
+        """
+        vec = self.get(text)
+        if vec is None:
+            vec = self.put(text, compute(text))
+        return vec
+
+    def get_or_compute_many(self, texts: list[str], compute_batch: Callable) -> list[np.ndarray]:
+        """
+        get_or_compute for many texts: the ones we don't have go to compute_batch
+        (list[str] -> matrix) in one call, each distinct question once.
+        """
+        vectors = [self.get(text) for text in texts]
+        missing = {normalize_text(text): text for text, vec in zip(texts, vectors) if vec is None}
+        if missing:
+            computed = compute_batch(list(missing.values()))
+            fresh = {key: self.put(text, vec) for (key, text), vec in zip(missing.items(), computed)}
+            vectors = [fresh[normalize_text(text)] if vec is None else vec for text, vec in zip(texts, vectors)]
+        return vectors
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# One cache per embedding model per process, shared by every chat path
+_caches: dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str) -> EmbeddingCache:
+    with _caches_lock:
+        if model_name not in _caches:
+            _caches[model_name] = EmbeddingCache()
+        return _caches[model_name]
@@ -1,12 +1,23 @@
-from sentence_transformers import SentenceTransformer
+from embedding_cache import get_embedding_cache
+from encoders import load_encoder
 
-# Load embedding model once at startup
-_model = SentenceTransformer("all-MiniLM-L6-v2")
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Load embedding model once at startup (or use the retrieval sidecar's, if there is one)
+_model = load_encoder(MODEL_NAME, engine="torch")
+_cache = get_embedding_cache(MODEL_NAME)
 
 def embed_text(text: str) -> list[float]:
     """
     Returns a list[float] embedding for the given text.
     IMPORTANT: use the same model you used when indexing into Pinecone.
     """
-    emb = _model.encode(text)
+    emb = _cache.get_or_compute(text, _model.encode)
     return emb.tolist()
+
+
+def embed_texts(texts: list[str]):
+    """
+    Batch version for building lookup tables (returns a NumPy matrix, uncached).
+    """
+    return _model.encode(texts, batch_size=32)
@@ -0,0 +1,40 @@
+from batch_embedder import configure_torch_threads
+from config import EMBEDDING_ENGINE, EMBEDDING_MODEL_NAME, ONNX_MODEL_DIR, RETRIEVAL_SIDECAR_SOCKET
+
+
+def import_engine(engine: str = EMBEDDING_ENGINE, sidecar: str = RETRIEVAL_SIDECAR_SOCKET):
+    """
+    Import what load_encoder() will need for this engine, so startup can time the
+    (slow) library import apart from reading the model weights
+    """
+    if sidecar:
+        import retrieval_sidecar  # noqa: F401
+        return
+    if engine == "onnx":
+        import onnxruntime  # noqa: F401
+        import tokenizers  # noqa: F401
+        return
+    if engine != "torch":
+        raise ValueError(f"Unknown EMBEDDING_ENGINE: {engine!r}")
+    import sentence_transformers  # noqa: F401
+
+
+def load_encoder(model_name: str = EMBEDDING_MODEL_NAME, engine: str = EMBEDDING_ENGINE,
+                 sidecar: str = RETRIEVAL_SIDECAR_SOCKET):
+    """
+    Load the query embedding model with the configured engine, or use the
+    retrieval sidecar's copy when there's a sidecar socket.
+    Either way you get SentenceTransformer's encode() API back.
+    """
+    if sidecar:
+        from retrieval_sidecar import SidecarEncoder, get_client
+        return SidecarEncoder(model_name, client=get_client(sidecar))
+    if engine == "onnx":
+        from onnx_embedder import OnnxEmbedder
+        return OnnxEmbedder(ONNX_MODEL_DIR, expected_model=model_name)
+    if engine != "torch":
+        raise ValueError(f"Unknown EMBEDDING_ENGINE: {engine!r}")
+
+    from sentence_transformers import SentenceTransformer
+    configure_torch_threads()
+    return SentenceTransformer(model_name)
@@ -0,0 +1,198 @@
+"""
+Keyword rules for "what is this user telling us about themselves" and "what topic
+is this" - compiled into one Aho-Corasick automaton, so a message is scanned once
+no matter how many keywords the rules grow to.
+
+The tables live in a JSON file (see vrm-next-app/backend/context_rules.json).
+Keywords match as substrings of the lowercased text, exactly like the old
+`any(word in text for word in [...])` checks did.
+"""
+import json
+from collections import deque
+from typing import NamedTuple, Optional
+
+from config import CONTEXT_RULES_PATH
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher: finds every pattern occurring in a text
+    (overlapping ones included) in a single pass over its characters.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(p for p in patterns if p))
+        self._goto: list[dict] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[tuple[int, ...]] = [()]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (pattern_id,)
+
+        # Breadth-first so every state's fail link is ready before its children need it
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> set[str]:
+        """
+        The set of patterns that occur somewhere in text
+        """
+        found, _ = self.scan(text)
+        return {self.patterns[i] for i in found}
+
+    def scan(self, text: str, state: int = 0) -> tuple[set[int], int]:
+        """
+        Pattern ids found in text and the state we ended in. Scanning b from the
+        state a ended in finds exactly what scanning a + b would, past a's end.
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found, state
+
+
+class ScanState(NamedTuple):
+    """
+    Where a scan over some text left off, so text appended to it can be scanned alone
+    """
+    hits: frozenset  # pattern ids
+    state: int
+
+
+class TextAnalysis(NamedTuple):
+    goals: tuple[str, ...]
+    diets: tuple[str, ...]
+    conditions: tuple[str, ...]
+    context: str  # "User wants to lose weight. User is vegan." or ""
+    topic: Optional[str]
+    buttons: list[dict]
+    has_general_term: bool
+    is_vague: bool
+
+    @property
+    def is_general(self) -> bool:
+        """
+        Broad question without enough detail to give a useful answer
+        """
+        return (self.has_general_term and not self.context) or self.is_vague
+
+
+class KeywordRules:
+    """
+    Everything extract_user_context, is_general_question and
+    get_context_specific_buttons need, from one pass over the text.
+
+    Rules format:
+      context_groups  - [{"field": "goals", "rules": [{"label": ..., "keywords": [...]}]}]
+                        the first matching rule of each group wins; labels are joined
+                        in group order into the context string
+      general_terms   - broad nutrition words ("protein", "should i", ...)
+      vague_patterns  - phrases that are always too vague ("is protein good", ...)
+      topics          - [{"topic": ..., "keywords": [...], "buttons": [...]}], first match wins
+      default_buttons - buttons when no topic matches
+    """
+
+    FIELDS = ("goals", "diets", "conditions")
+
+    def __init__(self, rules: dict):
+        self.context_groups = [
+            (group["field"], [(rule["label"], frozenset(map(str.lower, rule["keywords"])))
+                              for rule in group["rules"]])
+            for group in rules.get("context_groups", [])
+        ]
+        for field, _ in self.context_groups:
+            if field not in self.FIELDS:
+                raise ValueError(f"Unknown context field {field!r} (expected one of {self.FIELDS})")
+
+        self.general_terms = frozenset(map(str.lower, rules.get("general_terms", [])))
+        self.vague_patterns = frozenset(map(str.lower, rules.get("vague_patterns", [])))
+        self.topics = [
+            (topic["topic"], frozenset(map(str.lower, topic["keywords"])), topic["buttons"])
+            for topic in rules.get("topics", [])
+        ]
+        self.default_buttons = rules.get("default_buttons", [])
+
+        keywords = set(self.general_terms) | self.vague_patterns
+        for _, group_rules in self.context_groups:
+            for _, rule_keywords in group_rules:
+                keywords |= rule_keywords
+        for _, topic_keywords, _ in self.topics:
+            keywords |= topic_keywords
+        self.automaton = AhoCorasick(sorted(keywords))
+
+    def button_values(self) -> list[str]:
+        """
+        Every distinct button value (the personas a user can pick), in rule order
+        """
+        buttons = [button for _, _, topic_buttons in self.topics for button in topic_buttons] + self.default_buttons
+        return list(dict.fromkeys(button["value"] for button in buttons))
+
+    @classmethod
+    def from_file(cls, path: str = CONTEXT_RULES_PATH) -> "KeywordRules":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def scan(self, text: str, resume: Optional[ScanState] = None) -> ScanState:
+        """
+        Scan text, or continue a scan as if text were appended to what it covered
+        """
+        found, state = self.automaton.scan(text.lower(), resume.state if resume else 0)
+        if resume:
+            found |= resume.hits
+        return ScanState(frozenset(found), state)
+
+    def analyze(self, text: str, resume: Optional[ScanState] = None) -> TextAnalysis:
+        """
+        With resume, the analysis of (the text resume scanned) + text, scanning only text
+        """
+        patterns = self.automaton.patterns
+        hits = {patterns[i] for i in self.scan(text, resume).hits}
+
+        found = {field: [] for field in self.FIELDS}
+        labels = []
+        for field, group_rules in self.context_groups:
+            for label, keywords in group_rules:
+                if not hits.isdisjoint(keywords):
+                    found[field].append(label)
+                    labels.append(label)
+                    break
+
+        topic, buttons = None, self.default_buttons
+        for name, keywords, topic_buttons in self.topics:
+            if not hits.isdisjoint(keywords):
+                topic, buttons = name, topic_buttons
+                break
+
+        return TextAnalysis(
+            goals=tuple(found["goals"]),
+            diets=tuple(found["diets"]),
+            conditions=tuple(found["conditions"]),
+            context=". ".join(labels) + "." if labels else "",
+            topic=topic,
+            buttons=buttons,
+            has_general_term=not hits.isdisjoint(self.general_terms),
+            is_vague=not hits.isdisjoint(self.vague_patterns),
+        )
@@ -0,0 +1,153 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+from config import DATASET_PATH
+from dataset import load_dataset, record_metadata
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Question filler that would otherwise match every record
+STOPWORDS = frozenset("""
+a an and are as at be been being but by can could did do does doing for from had has have
+how i i'm if in into is it its just me my of on or really should so than that the their them
+then there these they this to too very was we were what when where which who why will with
+would you your yes no not true false myth fact eat eating
+""".split())
+
+
+def stem(token: str) -> str:
+    """
+    Just enough stemming to make "eggs"/"egg" and "calories"/"calorie" meet
+    """
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    # Single letters are mostly the tails of contractions ("I'm" -> "i", "m")
+    return [
+        stem(t) for t in _TOKEN.findall(text.lower())
+        if t not in STOPWORDS and (len(t) > 1 or t.isdigit())
+    ]
+
+
+def record_tokens(item: dict) -> list[str]:
+    """
+    What a record is searchable by. Myths and tags count double: they're
+    phrased the way people ask.
+    """
+    tags = " ".join(t.replace("_", " ") for t in item.get("tags") or [])
+    category = (item.get("category") or "").replace("_", " ")
+    return (
+        tokenize(item.get("myth", "")) * 2
+        + tokenize(item.get("fact", ""))
+        + tokenize(item.get("explanation", ""))
+        + tokenize(tags) * 2
+        + tokenize(category)
+    )
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index: a query only touches the postings of its
+    own terms, so it stays cheap as the dataset grows.
+    """
+
+    def __init__(self, documents: list[list[str]], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(documents)
+        lengths = np.array([len(doc) for doc in documents], dtype=np.float32)
+        avg_length = float(lengths.mean()) if self.size else 0.0
+
+        # term -> (doc rows, term frequencies)
+        postings: dict[str, list[tuple[int, int]]] = {}
+        for row, doc in enumerate(documents):
+            for term, tf in Counter(doc).items():
+                postings.setdefault(term, []).append((row, tf))
+
+        # Length normalisation doesn't depend on the query - precompute it
+        self._norm = self.k1 * (1 - self.b + self.b * lengths / max(avg_length, 1e-9))
+        self.postings: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self.idf: dict[str, float] = {}
+        for term, entries in postings.items():
+            rows = np.array([r for r, _ in entries], dtype=np.int64)
+            tfs = np.array([tf for _, tf in entries], dtype=np.float32)
+            self.postings[term] = (rows, tfs)
+            df = len(entries)
+            self.idf[term] = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def search(self, query_terms: list[str], top_k: int = 5) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns (row indices, BM25 scores, share of the query terms each row contains),
+        best match first. Rows that share no term with the query are never returned.
+        """
+        terms = [t for t in dict.fromkeys(query_terms) if t in self.postings]
+        if not terms:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+
+        scores = np.zeros(self.size, dtype=np.float32)
+        matched = np.zeros(self.size, dtype=np.float32)
+        for term in terms:
+            rows, tfs = self.postings[term]
+            scores[rows] += self.idf[term] * tfs * (self.k1 + 1) / (tfs + self._norm[rows])
+            matched[rows] += 1
+
+        candidates = np.flatnonzero(scores)
+        top_k = min(top_k, len(candidates))
+        best = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        best = best[np.argsort(-scores[best])]
+        coverage = matched[best] / len(dict.fromkeys(query_terms))
+        return best, scores[best], coverage
+
+
+class LexicalIndex:
+    """
+    BM25 over the myths dataset, with the same ids and metadata as the vector side
+    """
+
+    def __init__(self, ids: list[str], metadata: list[dict], index: BM25Index):
+        self.ids = ids
+        self.metadata = metadata
+        self.index = index
+
+    @classmethod
+    def from_dataset(cls, path: str = DATASET_PATH) -> "LexicalIndex":
+        records = load_dataset(path)
+        return cls(
+            ids=[item["id"] for item in records],
+            metadata=[record_metadata(item) for item in records],
+            index=BM25Index([record_tokens(item) for item in records]),
+        )
+
+    def search(self, text: str, top_k: int = 5) -> list[tuple[str, float, float, dict]]:
+        """
+        [(id, bm25 score, query term coverage, metadata)], best first
+        """
+        rows, scores, coverage = self.index.search(tokenize(text), top_k=top_k)
+        return [
+            (self.ids[row], float(score), float(cov), self.metadata[row])
+            for row, score, cov in zip(rows, scores, coverage)
+        ]
+
+    def confident_hit(self, text: str, hits: list, min_coverage: float, min_margin: float,
+                      min_terms: int = 2) -> bool:
+        """
+        Is the top hit clearly *the* answer? The query needs a couple of real terms,
+        the hit has to contain (nearly) all of them and beat the runner-up by min_margin.
+        """
+        if not hits or len(set(tokenize(text))) < min_terms:
+            return False
+        _, top_score, top_coverage, _ = hits[0]
+        runner_up = hits[1][1] if len(hits) > 1 else 0.0
+        return top_coverage >= min_coverage and top_score >= min_margin * runner_up
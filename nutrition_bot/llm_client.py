@@ -1,11 +1,16 @@
 from openai import OpenAI
-from config import DEEPSEEK_API_KEY
+from config import DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, UPSTREAM_TIMEOUTS
+from upstream import get_upstream, pooled_http_client
 import json
 
+# Keep-alive connections; retries and deadlines are handled by the upstream below
 client = OpenAI(
     api_key=DEEPSEEK_API_KEY,
-    base_url="https://api.deepseek.com"
+    base_url=DEEPSEEK_BASE_URL,
+    http_client=pooled_http_client(UPSTREAM_TIMEOUTS["deepseek"]),
+    max_retries=0,
 )
+deepseek = get_upstream("deepseek")
 
 def llm_understand_query(user_msg: str) -> dict:
     """
@@ -23,7 +28,8 @@ def llm_understand_query(user_msg: str) -> dict:
         "VERY IMPORTANT: Respond with ONLY valid JSON. No text before or after."
     )
 
-    response = client.chat.completions.create(
+    response = deepseek.call(
+        client.chat.completions.create,
         model="deepseek-chat",
         messages=[
             {"role": "system", "content": system_prompt},
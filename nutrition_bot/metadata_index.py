@@ -0,0 +1,241 @@
+"""
+Local inverted index over the records' metadata, so a filtered search knows which
+records it can return before it asks the vector index anything.
+
+Every (field, value) pair has a bitmap of the records that have it (a Python int,
+bit i = row i). A filter is an AND of fields, each an OR of values, so its
+candidates are a few big-int ORs and ANDs and its selectivity is a popcount.
+
+Facets per record (values are normalised, so "Eggs", "egg" and "EGG" meet):
+    category    the record's category
+    tags        its tags
+    food        tags plus the words of its category ("dairy_and_bones" -> dairy, bones)
+                - what the query analyzer reports as keywords
+    chunk_type  myth / fact (records with both have both) or info
+
+Pinecone only stores category and tags - food and chunk_type are derived here.
+So a filter on them used to match nothing remotely, and the user got the
+"couldn't find anything" answer after a full round trip.
+
+When a filter leaves no candidates, plan() relaxes it step by step:
+    1. values we don't have exactly match by their words ("white rice" -> rice)
+    2. fields are dropped, least important first (RELAX_ORDER)
+    3. no filter at all
+"""
+import re
+from collections import Counter
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from config import DATASET_PATH
+from dataset import load_dataset
+from lexical_index import stem
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+# Dropped first when a filter matches nothing - the intent guess is the weakest signal
+RELAX_ORDER = ("chunk_type", "category", "tags", "food")
+
+# Fields Pinecone actually stores; the others only exist in this index
+STORED_FIELDS = ("category", "tags")
+
+
+def normalize_value(value) -> str:
+    words = _NON_WORD.sub(" ", str(value).lower()).split()
+    return "_".join(stem(word) for word in words)
+
+
+def record_facets(item: dict) -> dict[str, dict]:
+    """
+    {field: {normalised value: (stored field, raw value) or None}} for one record
+    (a dataset record or the metadata stored with it - they have the same fields)
+    """
+    category = item.get("category") or ""
+    tags = item.get("tags") or []
+    facets: dict[str, dict] = {"category": {}, "tags": {}, "food": {}, "chunk_type": {}}
+
+    if category:
+        facets["category"][normalize_value(category)] = ("category", category)
+        for term in category.split("_and_"):
+            if term:
+                facets["food"].setdefault(normalize_value(term), ("category", category))
+    for tag in tags:
+        facets["tags"][normalize_value(tag)] = ("tags", tag)
+        facets["food"][normalize_value(tag)] = ("tags", tag)
+
+    if item.get("chunk_type"):
+        facets["chunk_type"][normalize_value(item["chunk_type"])] = ("chunk_type", item["chunk_type"])
+    else:
+        kinds = [kind for kind in ("myth", "fact") if item.get(kind)] or ["info"]
+        facets["chunk_type"] = dict.fromkeys(kinds)
+    return {field: values for field, values in facets.items() if values}
+
+
+class FilterPlan(NamedTuple):
+    filter: dict  # what was actually applied: {field: [normalised values]}, {} = everything
+    bitmap: int  # the candidates
+    count: int
+    selectivity: float  # count / records - known before anything is queried
+    relaxed: tuple  # the steps that were needed, e.g. ("partial_values", "drop:chunk_type")
+
+    @property
+    def unrestricted(self) -> bool:
+        return not self.filter
+
+
+class MetadataIndex:
+    def __init__(self, ids: list[str], metadata: list[dict]):
+        self.ids = ids
+        self.row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+        self.all = (1 << len(ids)) - 1
+        self.postings: dict[tuple[str, str], int] = {}
+        # (field, value) -> what Pinecone stores for it, to translate filters back
+        self.stored: dict[tuple[str, str], set] = {}
+        # (field, word) -> values containing that word, for partial matches
+        self.words: dict[tuple[str, str], set] = {}
+        self.stats = Counter()
+
+        for row, meta in enumerate(metadata):
+            for field, values in record_facets(meta).items():
+                for value, stored in values.items():
+                    key = (field, value)
+                    self.postings[key] = self.postings.get(key, 0) | (1 << row)
+                    if stored is not None and stored[0] in STORED_FIELDS:
+                        self.stored.setdefault(key, set()).add(stored)
+                    for word in value.split("_"):
+                        self.words.setdefault((field, word), set()).add(value)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_dataset(cls, path: str = DATASET_PATH) -> "MetadataIndex":
+        records = load_dataset(path)
+        return cls([item["id"] for item in records], records)
+
+    # -------------------------
+    # BITMAPS
+    # -------------------------
+    def bitmap(self, clauses: dict) -> int:
+        """
+        Records matching every field, each field matching any of its values
+        """
+        result = self.all
+        # Most selective field first, so the AND can stop as soon as it's empty
+        for field, values in sorted(clauses.items(), key=lambda c: self.count(self._union(*c))):
+            result &= self._union(field, values)
+            if not result:
+                break
+        return result
+
+    def _union(self, field: str, values) -> int:
+        bits = 0
+        for value in values:
+            bits |= self.postings.get((field, value), 0)
+        return bits
+
+    @staticmethod
+    def count(bitmap: int) -> int:
+        return bitmap.bit_count()
+
+    def rows(self, bitmap: int) -> np.ndarray:
+        raw = np.frombuffer(bitmap.to_bytes((len(self.ids) + 7) // 8 or 1, "little"), dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(raw, bitorder="little"))[:len(self.ids)]
+
+    def allows(self, plan: FilterPlan, doc_id: str) -> bool:
+        row = self.row_of.get(doc_id)
+        if row is None:
+            # Not in our copy of the dataset (the index is ahead of us) - don't hide it
+            return True
+        return bool(plan.bitmap >> row & 1)
+
+    # -------------------------
+    # PLANNING
+    # -------------------------
+    @staticmethod
+    def clauses(pine_filter: Optional[dict]) -> dict:
+        """
+        {"food": {"$in": ["Eggs"]}, "chunk_type": "myth"} -> {"food": ["egg"], "chunk_type": ["myth"]}
+        """
+        clauses = {}
+        for field, cond in (pine_filter or {}).items():
+            if isinstance(cond, dict):
+                values = cond.get("$in", [cond.get("$eq")] if "$eq" in cond else [])
+            else:
+                values = cond if isinstance(cond, list) else [cond]
+            normalized = sorted({normalize_value(v) for v in values if v is not None} - {""})
+            if normalized:
+                clauses[field] = normalized
+        return clauses
+
+    def _partial(self, field: str, values: list[str]) -> list[str]:
+        # Each value we don't have becomes the values that share a word with it
+        found = set()
+        for value in values:
+            if (field, value) in self.postings:
+                found.add(value)
+                continue
+            for word in value.split("_"):
+                found |= self.words.get((field, word), set())
+        return sorted(found)
+
+    def plan(self, pine_filter: Optional[dict]) -> FilterPlan:
+        """
+        The candidates for a Pinecone-style filter, relaxed until there are some
+        """
+        clauses = self.clauses(pine_filter)
+        relaxed = []
+
+        bitmap = self.bitmap(clauses)
+        if clauses and not bitmap:
+            partial = {field: self._partial(field, values) for field, values in clauses.items()}
+            if any(values and values != clauses[field] for field, values in partial.items()):
+                relaxed.append("partial_values")
+            # A field none of whose values we know can only ever match nothing
+            for field in [field for field, values in partial.items() if not values]:
+                relaxed.append(f"drop:{field}")
+                del partial[field]
+            clauses = partial
+            bitmap = self.bitmap(clauses)
+
+        for field in sorted(clauses, key=lambda f: RELAX_ORDER.index(f) if f in RELAX_ORDER else -1):
+            if bitmap:
+                break
+            relaxed.append(f"drop:{field}")
+            del clauses[field]
+            bitmap = self.bitmap(clauses)
+
+        count = self.count(bitmap)
+        if count == len(self.ids):
+            clauses = {}  # keeps everything - no point filtering
+        self.stats["unfiltered" if not clauses else "relaxed" if relaxed else "exact"] += 1
+        return FilterPlan(clauses, bitmap, count, count / len(self.ids) if self.ids else 0.0, tuple(relaxed))
+
+    # -------------------------
+    # PINECONE
+    # -------------------------
+    def pinecone_query(self, plan: FilterPlan, top_k: int) -> tuple[Optional[dict], int]:
+        """
+        (filter, top_k) for Pinecone. The filter is the plan in terms of the fields
+        Pinecone stores; derived ones it can't express (chunk_type) are left to the
+        caller's allows() check, so top_k grows to leave room for what that drops.
+        """
+        parts, remote = [], {}
+        for field, values in plan.filter.items():
+            stored: dict[str, set] = {}
+            for value in values:
+                for stored_field, raw in self.stored.get((field, value), ()):
+                    stored.setdefault(stored_field, set()).add(raw)
+            if not stored:
+                continue
+            remote[field] = values
+            options = [{stored_field: {"$in": sorted(raw)}} for stored_field, raw in sorted(stored.items())]
+            parts.append(options[0] if len(options) == 1 else {"$or": options})
+
+        remote_count = self.count(self.bitmap(remote))
+        if plan.count and remote_count > plan.count:
+            top_k = min(remote_count, top_k * -(-remote_count // plan.count))
+        if not parts:
+            return None, top_k
+        return (parts[0] if len(parts) == 1 else {"$and": parts}), top_k
@@ -1,27 +1,63 @@
-from pinecone import Pinecone
+from concurrent.futures import ThreadPoolExecutor
+
 from config import (
     PINECONE_API_KEY,
     PINECONE_INDEX_NAME,
+    QUERY_ANALYZER_REMOTE_FALLBACK,
 )
-from embeddings import embed_text
-from llm_client import llm_understand_query
+from embeddings import MODEL_NAME as EMBEDDING_MODEL, embed_text, embed_texts
+from metadata_index import MetadataIndex
+from query_analyzer import QueryAnalyzer
+from retrieval import make_retriever, open_pinecone_index
+from telemetry import get_logger
+
+
+log = get_logger("pinecone_client")
+
+# --- Initialise Pinecone client (v3 style, no .init), or the in-process index ---
+# (RETRIEVAL_BACKEND). Pinecone queries get the shared upstream's deadline,
+# retries, hedging and circuit breaker.
+# Queries here are embedded with embeddings.py's model, so the index must be too
+retriever = make_retriever(embed_texts, lambda: open_pinecone_index(PINECONE_API_KEY, PINECONE_INDEX_NAME),
+                           model_name=EMBEDDING_MODEL, index_name=PINECONE_INDEX_NAME)
 
 
-# --- Initialise Pinecone client (v3 style, no .init) ---
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(PINECONE_INDEX_NAME)
+def _remote_analyzer():
+    # DeepSeek only gets asked about queries the local analyzer isn't sure of
+    if not QUERY_ANALYZER_REMOTE_FALLBACK:
+        return None
+    from llm_client import llm_understand_query
+    return llm_understand_query
+
+
+# --- Local query analysis (replaces a DeepSeek call per question) ---
+analyzer = QueryAnalyzer.from_dataset(embed_texts, remote=_remote_analyzer())
+# --- Which records a filter can match, known before we query ---
+# (built over the local retriever's own rows, so candidates can be passed straight to it)
+if retriever.searches_rows:
+    metadata_index = MetadataIndex(retriever.ids, retriever.metadata)
+else:
+    metadata_index = MetadataIndex.from_dataset()
+# Query embeddings run in this pool so the lexicon scan can overlap them
+_embed_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="embed")
 
 
 def search_pinecone_from_llm(user_msg: str, top_k: int = 5):
     """
-    1) Use Groq to analyse the user's question.
-    2) Build a metadata filter based on intent + keywords.
-    3) Query Pinecone and return a list of relevant chunks.
+    1) Analyse the user's question locally (while its embedding is computed).
+    2) Build a metadata filter based on intent + keywords, and work out locally
+       which records it leaves (relaxing it if that's none).
+    3) Query Pinecone, restricted to those records, and return the chunks.
 
     Returns: (intent: str, chunks: list[dict])
     """
 
-    analysis = llm_understand_query(user_msg)
+    # ---- Embed the user's full question, and analyse it meanwhile ----
+    vec_future = _embed_pool.submit(embed_text, user_msg)
+    lexical = analyzer.scan(user_msg)
+    query_vec = vec_future.result()
+
+    analysis = analyzer.analyze(user_msg, query_vec, lexical)
 
     intent = analysis.get("intent", "general_info")
     keywords = analysis.get("keywords") or []
@@ -30,29 +66,36 @@ def search_pinecone_from_llm(user_msg: str, top_k: int = 5):
     # ---- Build metadata filter ----
     pine_filter: dict = {}
 
-    # Your metadata uses chunk_type, so filter on that
+    # chunk_type and food aren't stored in Pinecone - the metadata index derives
+    # them from each record (see metadata_index.py)
     if intent == "myth_check":
         pine_filter["chunk_type"] = {"$in": ["myth", "fact"]}
 
-    # If your metadata has a "food" field, use the detected keywords
+    # The detected keywords are tags / category words
     if keywords:
         pine_filter["food"] = {"$in": keywords}
 
-    # ---- Embed the user's full question ----
-    query_vec = embed_text(user_msg)
-
-    # Pinecone v3 query
-    res = index.query(
-        vector=query_vec,
-        top_k=top_k,
-        include_metadata=True,
-        filter=pine_filter or None,
-    )
+    # ---- Candidates from the local metadata index ----
+    plan = metadata_index.plan(pine_filter)
+    if plan.relaxed:
+        log.info("Filter %s matched nothing, relaxed (%s) to %d records",
+                 pine_filter, ", ".join(plan.relaxed), plan.count)
+    log.debug("Searching %d records (selectivity %.3f)", plan.count, plan.selectivity)
+
+    if retriever.searches_rows:
+        rows = None if plan.unrestricted else metadata_index.rows(plan.bitmap)
+        matches = retriever.query(query_vec, top_k=top_k, rows=rows)
+    else:
+        # Pinecone v3 query, filtered on the fields it stores; anything it can't
+        # filter on (chunk_type) is checked against the candidates here
+        remote_filter, remote_top_k = metadata_index.pinecone_query(plan, top_k)
+        found = retriever.query(query_vec, top_k=remote_top_k, filter=remote_filter)
+        matches = [m for m in found if metadata_index.allows(plan, m.id)][:top_k]
 
     chunks: list[dict] = []
 
-    # v3: res.matches is a list of Match objects
-    for match in res.matches:
+    # v3: matches are Match objects (ours have the same attributes)
+    for match in matches:
         meta = match.metadata or {}
 
         chunks.append(
@@ -0,0 +1,88 @@
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+from config import (
+    DATASET_PATH,
+    MYTH_CLASSIFIER_K,
+    MYTH_CLASSIFIER_MIN_CONFIDENCE,
+    MYTH_CLASSIFIER_MIN_SIMILARITY,
+    MYTH_CLASSIFIER_TEMPERATURE,
+)
+from dataset import load_dataset
+from vector_index import ExactIndex
+
+
+def myth_fact_statements(records: list[dict]) -> tuple[list[str], list[str]]:
+    """
+    (statements, labels): every record's myth labelled "myth" and fact labelled "fact"
+    """
+    statements, labels = [], []
+    for item in records:
+        for label in ("myth", "fact"):
+            if item.get(label):
+                statements.append(item[label])
+                labels.append(label)
+    return statements, labels
+
+
+class Classification(NamedTuple):
+    label: str          # "myth", "fact" or "general"
+    confidence: float   # share of the neighbour vote the label got (0.5 - 1.0)
+    similarity: float   # cosine similarity of the closest statement
+    source: str         # "knn" or "llm"
+
+
+class MythFactClassifier:
+    """
+    Is the user asking about a myth or a fact? Nearest-neighbour vote over the
+    dataset's myth statements and fact statements, using the query embedding we
+    already computed for retrieval - one small matmul instead of an LLM call.
+
+    Each of the k closest statements votes for its label with weight
+    exp(similarity / temperature), so the closest ones dominate. Results below
+    min_confidence should be double-checked by something smarter (the LLM).
+    """
+
+    def __init__(self, vectors, labels: list[str], k: int = MYTH_CLASSIFIER_K,
+                 temperature: float = MYTH_CLASSIFIER_TEMPERATURE,
+                 min_similarity: float = MYTH_CLASSIFIER_MIN_SIMILARITY,
+                 min_confidence: float = MYTH_CLASSIFIER_MIN_CONFIDENCE, normalized: bool = False):
+        if len(labels) != len(vectors):
+            raise ValueError(f"Got {len(vectors)} vectors but {len(labels)} labels")
+        self.index = ExactIndex(vectors, normalized=normalized)
+        self.labels = np.asarray(labels)
+        self.k = k
+        self.temperature = temperature
+        self.min_similarity = min_similarity
+        self.min_confidence = min_confidence
+
+    @classmethod
+    def from_dataset(cls, encode: Callable, path: str = DATASET_PATH, **kwargs) -> "MythFactClassifier":
+        statements, labels = myth_fact_statements(load_dataset(path))
+        return cls(encode(statements), labels, **kwargs)
+
+    @classmethod
+    def from_artifact(cls, artifact, **kwargs) -> "MythFactClassifier":
+        """
+        Use the statement vectors from a precomputed EmbeddingArtifact (no encoding)
+        """
+        return cls(artifact.statement_vectors, artifact.statement_labels, normalized=True, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def is_confident(self, result: Classification) -> bool:
+        return result.source != "knn" or result.confidence >= self.min_confidence
+
+    def classify(self, query_vec) -> Classification:
+        rows, scores = self.index.search(query_vec, top_k=self.k)
+        if len(rows) == 0 or scores[0] < self.min_similarity:
+            # Nothing in the dataset is about this - there's no myth to bust
+            best = float(scores[0]) if len(rows) else 0.0
+            return Classification("general", 1.0, best, "knn")
+
+        weights = np.exp((scores - scores[0]) / self.temperature)
+        myth_share = float(weights[self.labels[rows] == "myth"].sum() / weights.sum())
+        label, confidence = ("myth", myth_share) if myth_share >= 0.5 else ("fact", 1.0 - myth_share)
+        return Classification(label, round(confidence, 4), float(scores[0]), "knn")
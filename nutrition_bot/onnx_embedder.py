@@ -0,0 +1,269 @@
+"""
+ONNX Runtime embedding engine - a drop-in for SentenceTransformer.encode().
+
+Runs an exported, int8 dynamically-quantized copy of the embedding model, which is
+several times faster and smaller than fp32 PyTorch on our CPU-only boxes. The vectors
+stay compatible with the existing index: `export` checks cosine agreement with the
+torch model on the dataset and sample queries, and the engine refuses to load a
+model that didn't pass.
+
+Build it once (needs torch, transformers, onnx and onnxruntime):
+    python onnx_embedder.py export --out models/bge-large-en-v1.5-onnx
+
+Then serve with EMBEDDING_ENGINE=onnx ONNX_MODEL_DIR=models/bge-large-en-v1.5-onnx
+"""
+import argparse
+import json
+import os
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+from config import (
+    EMBEDDING_MODEL_NAME,
+    ONNX_INTER_OP_THREADS,
+    ONNX_INTRA_OP_THREADS,
+    ONNX_MIN_AGREEMENT,
+)
+
+MANIFEST_NAME = "onnx_manifest.json"
+FP32_NAME = "model.onnx"
+INT8_NAME = "model.int8.onnx"
+
+# Questions people actually ask, used next to the dataset for the agreement check
+SAMPLE_QUERIES = [
+    "is rice at night bad",
+    "are carbs bad",
+    "I want to lose weight. Is eating eggs every day unhealthy?",
+    "does protein powder damage your kidneys",
+    "I'm vegan. do I need supplements?",
+    "is fruit sugar as bad as table sugar",
+]
+
+
+class OnnxEmbedder:
+    """
+    Same encode() contract as SentenceTransformer: a string gives a 1-d vector,
+    a list gives a (n, dim) matrix. Vectors are pooled and L2-normalised like the
+    original model's pipeline.
+    """
+
+    def __init__(self, model_dir: str, intra_op_threads: int = ONNX_INTRA_OP_THREADS,
+                 inter_op_threads: int = ONNX_INTER_OP_THREADS, max_length: int = 512,
+                 expected_model: str = None, require_agreement: bool = True):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+
+        if expected_model and self.manifest["model_name"] != expected_model:
+            raise ValueError(
+                f"ONNX model in {model_dir} was exported from {self.manifest['model_name']}, "
+                f"but EMBEDDING_MODEL_NAME is {expected_model}"
+            )
+        if require_agreement and not self.manifest.get("agreement", {}).get("passed"):
+            raise ValueError(f"ONNX model in {model_dir} never passed the cosine-agreement check")
+
+        self.pooling = self.manifest["pooling"]
+        self.dimension = self.manifest["dimension"]
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads > 0:
+            options.inter_op_num_threads = inter_op_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, self.manifest["model_file"]),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.no_padding()  # we pad per batch ourselves, from cached token ids
+        self._tokenize = lru_cache(maxsize=4096)(self._tokenize_uncached)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _tokenize_uncached(self, text: str) -> tuple[tuple[int, ...], tuple[int, ...]]:
+        encoding = self.tokenizer.encode(text)
+        return tuple(encoding.ids), tuple(encoding.type_ids)
+
+    def _run(self, texts: list[str]) -> np.ndarray:
+        tokenized = [self._tokenize(t) for t in texts]
+        length = max(len(ids) for ids, _ in tokenized)
+
+        input_ids = np.zeros((len(texts), length), dtype=np.int64)
+        type_ids = np.zeros((len(texts), length), dtype=np.int64)
+        attention = np.zeros((len(texts), length), dtype=np.int64)
+        for row, (ids, types) in enumerate(tokenized):
+            input_ids[row, :len(ids)] = ids
+            type_ids[row, :len(types)] = types
+            attention[row, :len(ids)] = 1
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention, "token_type_ids": type_ids}
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:  # mean over real tokens
+            mask = attention[..., None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def encode(self, sentences, batch_size: int = 32, **_ignored):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        # Sort by length so each batch pads as little as possible
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            out[rows] = self._run([texts[i] for i in rows])
+
+        return out[0] if single else out
+
+
+# -------------------------
+# EXPORT + AGREEMENT CHECK
+# -------------------------
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    ref = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cand = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (ref * cand).sum(axis=1)
+    return {
+        "min": round(float(cosines.min()), 5),
+        "mean": round(float(cosines.mean()), 5),
+        "samples": int(len(cosines)),
+    }
+
+
+def write_manifest(model_dir: str, manifest: dict):
+    with open(os.path.join(model_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def check_agreement(model_dir: str, model_name: str, min_agreement: float) -> dict:
+    """
+    Embed the dataset + sample queries with both engines and compare them
+    """
+    from sentence_transformers import SentenceTransformer
+
+    texts = agreement_texts()
+    reference = SentenceTransformer(model_name).encode(texts, batch_size=16)
+    candidate = OnnxEmbedder(model_dir, expected_model=model_name,
+                             require_agreement=False).encode(texts, batch_size=16)
+
+    agreement = cosine_agreement(reference, candidate)
+    agreement["threshold"] = min_agreement
+    agreement["passed"] = agreement["min"] >= min_agreement
+    return agreement
+
+
+def agreement_texts() -> list[str]:
+    from dataset import load_dataset, record_text
+    return [record_text(item) for item in load_dataset()] + SAMPLE_QUERIES
+
+
+def export(model_name: str, out_dir: str, pooling: str, quantize: bool, min_agreement: float) -> dict:
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(out_dir)  # writes tokenizer.json for the runtime
+
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    dummy = tokenizer(["Is eating rice at night bad?"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+    dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    fp32_path = os.path.join(out_dir, FP32_NAME)
+    print(f"Exporting {model_name} to {fp32_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[n] for n in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+        )
+
+    model_file = FP32_NAME
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print("Applying int8 dynamic quantization")
+        quantize_dynamic(fp32_path, os.path.join(out_dir, INT8_NAME), weight_type=QuantType.QInt8)
+        model_file = INT8_NAME
+
+    manifest = {
+        "model_name": model_name,
+        "model_file": model_file,
+        "pooling": pooling,
+        "dimension": int(model.config.hidden_size),
+        "quantized": quantize,
+        "agreement": {"passed": False},
+    }
+    write_manifest(out_dir, manifest)
+
+    # Only a model that matches the torch pipeline we index with gets marked servable
+    manifest["agreement"] = check_agreement(out_dir, model_name, min_agreement)
+    write_manifest(out_dir, manifest)
+    return manifest
+
+
+def verify(model_dir: str, model_name: str, min_agreement: float) -> dict:
+    with open(os.path.join(model_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["agreement"] = check_agreement(model_dir, model_name, min_agreement)
+    write_manifest(model_dir, manifest)
+    return manifest["agreement"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / verify the ONNX embedding engine")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export", help="export, quantize and agreement-check a model")
+    exp.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    exp.add_argument("--out", required=True)
+    exp.add_argument("--pooling", choices=["cls", "mean"], default="cls",
+                     help="cls for bge models, mean for MiniLM-style models")
+    exp.add_argument("--no-quantize", action="store_true")
+    exp.add_argument("--min-agreement", type=float, default=ONNX_MIN_AGREEMENT)
+
+    ver = sub.add_parser("verify", help="re-run the cosine agreement check")
+    ver.add_argument("--model-dir", required=True)
+    ver.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    ver.add_argument("--min-agreement", type=float, default=ONNX_MIN_AGREEMENT)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        manifest = export(args.model, args.out, args.pooling, not args.no_quantize, args.min_agreement)
+        agreement = manifest["agreement"]
+    else:
+        agreement = verify(args.model_dir, args.model, args.min_agreement)
+
+    print(json.dumps(agreement, indent=2))
+    if not agreement["passed"]:
+        print(f"❌ Cosine agreement {agreement['min']} is below {agreement['threshold']} - don't serve this model")
+        sys.exit(1)
+    print("✅ ONNX vectors agree with the torch model")
+
+
+if __name__ == "__main__":
+    main()
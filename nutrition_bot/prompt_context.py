@@ -0,0 +1,217 @@
+"""
+Token-budgeted "Retrieved Information" for the answer prompt.
+
+The retrieved chunks used to be pasted verbatim. Now they go through a small
+assembly stage first:
+  - duplicates (same id, or myth/fact wording that mostly overlaps) are dropped
+  - with plain vector search, chunks scoring far below the best match are dropped.
+    Hybrid search scores are RRF ranks, not relevance: a chunk both retrievers
+    found scores ~2/61 and one only a single retriever found at most 1/61, so a
+    relative cutoff there just drops the single-retriever hits. Those are kept.
+  - long explanations are cut down to the sentences closest to the question
+  - sources are added best first until the token budget is used up
+
+Token counts are estimates (Llama's tokenizer isn't a dependency here). Groq's own
+usage numbers are recorded next to them when the response has them.
+"""
+import re
+import threading
+from typing import NamedTuple, Optional
+
+from config import (
+    CONTEXT_DEDUPE_OVERLAP,
+    CONTEXT_EXPLANATION_SENTENCES,
+    CONTEXT_MAX_SOURCES,
+    CONTEXT_MIN_RELATIVE_SCORE,
+    CONTEXT_TOKEN_BUDGET,
+    HYBRID_SEARCH,
+)
+from lexical_index import tokenize
+
+_PIECE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Rough Llama-3 token count: a token per word or punctuation mark, plus one
+    for every 8 characters of a long word. Within ~10% on English prose.
+    """
+    return sum(1 + len(piece) // 8 for piece in _PIECE.findall(text))
+
+
+def split_sentences(text: str) -> list[str]:
+    return [s.strip() for s in _SENTENCE_END.split(text.strip()) if s.strip()]
+
+
+class ContextReport(NamedTuple):
+    sources: int              # chunks that made it into the prompt
+    dropped: int              # duplicates, low scorers and whatever didn't fit
+    trimmed_sentences: int    # explanation sentences left out
+    context_tokens: int       # the Retrieved Information block
+    baseline_tokens: int      # what the top 3 chunks verbatim would have cost
+
+
+class ContextBuilder:
+    """
+    build(question, chunks) -> (context text, ContextReport).
+
+    Chunks are the dicts pinecone_search() returns; when they carry separate
+    "myth" / "fact" / "explanation" fields the explanation can be trimmed,
+    otherwise "text" is used whole. rank_fused says their scores are RRF scores
+    (HYBRID_SEARCH), which min_relative_score doesn't apply to.
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET,
+                 min_relative_score: float = CONTEXT_MIN_RELATIVE_SCORE,
+                 max_sources: int = CONTEXT_MAX_SOURCES,
+                 explanation_sentences: int = CONTEXT_EXPLANATION_SENTENCES,
+                 dedupe_overlap: float = CONTEXT_DEDUPE_OVERLAP,
+                 rank_fused: bool = HYBRID_SEARCH):
+        self.budget = budget
+        self.min_relative_score = min_relative_score
+        self.max_sources = max_sources
+        self.explanation_sentences = explanation_sentences
+        self.dedupe_overlap = dedupe_overlap
+        self.rank_fused = rank_fused
+
+    def select(self, chunks: list[dict]) -> list[dict]:
+        """
+        Best-first chunks worth sending: no duplicates, and (for cosine scores)
+        nothing far below the best one
+        """
+        if not chunks:
+            return []
+        # RRF scores only order the chunks - there's no cutoff to apply to them
+        best = 0.0 if self.rank_fused else max(c.get("score") or 0.0 for c in chunks)
+        kept, seen_ids, seen_terms = [], set(), []
+        for chunk in sorted(chunks, key=lambda c: c.get("score") or 0.0, reverse=True):
+            if chunk["id"] in seen_ids:
+                continue
+            if best > 0 and (chunk.get("score") or 0.0) < self.min_relative_score * best:
+                break  # sorted, so everything after scores lower still
+            terms = set(tokenize(self._claim(chunk)))
+            if any(self._overlap(terms, other) >= self.dedupe_overlap for other in seen_terms):
+                continue
+            kept.append(chunk)
+            seen_ids.add(chunk["id"])
+            seen_terms.append(terms)
+        return kept
+
+    @staticmethod
+    def _claim(chunk: dict) -> str:
+        # What the chunk says, without the explanation - that's what duplicates share
+        if chunk.get("myth") or chunk.get("fact"):
+            return f"{chunk.get('myth', '')} {chunk.get('fact', '')}"
+        return chunk.get("text", "")
+
+    @staticmethod
+    def _overlap(a: set, b: set) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    def trim(self, explanation: str, query_terms: set, limit: int) -> tuple[str, int]:
+        """
+        The limit sentences sharing the most terms with the question, kept in their
+        original order. Returns (text, sentences dropped).
+        """
+        sentences = split_sentences(explanation)
+        if len(sentences) <= limit:
+            return explanation.strip(), 0
+        if limit <= 0:
+            return "", len(sentences)
+        # Ties go to the earlier sentence: explanations lead with the main point
+        ranked = sorted(range(len(sentences)),
+                        key=lambda i: (-len(query_terms & set(tokenize(sentences[i]))), i))
+        keep = sorted(ranked[:limit])
+        return " ".join(sentences[i] for i in keep), len(sentences) - limit
+
+    def render(self, chunk: dict, query_terms: set, explanation_sentences: int) -> tuple[str, int]:
+        if not (chunk.get("myth") and chunk.get("fact")):
+            return chunk.get("text", ""), 0
+        text = f"**Myth**: {chunk['myth']}\n\n**Fact**: {chunk['fact']}"
+        explanation, trimmed = self.trim(chunk.get("explanation") or "", query_terms, explanation_sentences)
+        if explanation:
+            text += f"\n\n**Explanation**: {explanation}"
+        return text, trimmed
+
+    def build(self, question: str, chunks: list[dict]) -> tuple[str, ContextReport]:
+        baseline = "\n\n".join(f"Source {i+1}:\n{c['text']}" for i, c in enumerate(chunks[:3]))
+        selected = self.select(chunks)[:self.max_sources]
+        query_terms = set(tokenize(question))
+
+        blocks, used, trimmed_total = [], 0, 0
+        for chunk in selected:
+            header = f"Source {len(blocks) + 1}:\n"
+            # Shorter and shorter versions of the source until one fits
+            for sentences in (self.explanation_sentences, 1, 0):
+                text, trimmed = self.render(chunk, query_terms, sentences)
+                cost = count_tokens(header + text) + 1
+                if used + cost <= self.budget:
+                    break
+            else:
+                if blocks:
+                    break  # the best source always goes in, even over budget
+            blocks.append(header + text)
+            used += cost
+            trimmed_total += trimmed
+
+        context = "\n\n".join(blocks)
+        return context, ContextReport(
+            sources=len(blocks),
+            dropped=len(chunks) - len(blocks),
+            trimmed_sentences=trimmed_total,
+            context_tokens=count_tokens(context),
+            baseline_tokens=count_tokens(baseline),
+        )
+
+
+class PromptStats:
+    """
+    Running totals of prompt sizes for /api/stats: what we sent, what the old
+    verbatim context would have cost, and what Groq actually counted
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.context_tokens = 0
+        self.baseline_tokens = 0
+        self.groq_requests = 0
+        self.groq_prompt_tokens = 0
+        self.groq_completion_tokens = 0
+
+    def record(self, prompt_tokens: int, report: ContextReport):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.context_tokens += report.context_tokens
+            self.baseline_tokens += report.baseline_tokens
+
+    def record_usage(self, usage) -> Optional[int]:
+        """
+        Adds Groq's usage (prompt and completion tokens), if the response had any
+        """
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if prompt_tokens is None:
+            return None
+        with self._lock:
+            self.groq_requests += 1
+            self.groq_prompt_tokens += prompt_tokens
+            self.groq_completion_tokens += getattr(usage, "completion_tokens", None) or 0
+        return prompt_tokens
+
+    def stats(self) -> dict:
+        with self._lock:
+            saved = self.baseline_tokens - self.context_tokens
+            return {
+                "requests": self.requests,
+                "avg_prompt_tokens": round(self.prompt_tokens / self.requests, 1) if self.requests else 0.0,
+                "avg_context_tokens": round(self.context_tokens / self.requests, 1) if self.requests else 0.0,
+                "avg_context_tokens_saved": round(saved / self.requests, 1) if self.requests else 0.0,
+                "context_saved_ratio": round(saved / self.baseline_tokens, 4) if self.baseline_tokens else 0.0,
+                "avg_groq_prompt_tokens": (round(self.groq_prompt_tokens / self.groq_requests, 1)
+                                           if self.groq_requests else None),
+            }
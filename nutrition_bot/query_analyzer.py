@@ -0,0 +1,180 @@
+"""
+Local replacement for llm_understand_query(): the same {intent, keywords, diet_topic}
+contract, without a DeepSeek round trip in front of every Pinecone query.
+
+- keywords come from a lexicon of the dataset's tags and categories, matched in one
+  pass with the keyword_rules automaton
+- diet_topic is the topic (carbs / protein / fat) of the records those keywords
+  belong to
+- intent is the nearest of a few example questions per intent, using the query
+  embedding we compute for retrieval anyway
+
+When the intent match is weak, an optional remote analyzer (the DeepSeek call)
+gets the final say, and its answers are cached.
+"""
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Callable, Optional
+
+import numpy as np
+
+from config import (
+    DATASET_PATH,
+    QUERY_ANALYZER_CACHE_SIZE,
+    QUERY_ANALYZER_MIN_INTENT_SIMILARITY,
+)
+from dataset import load_dataset
+from embedding_cache import normalize_text
+from keyword_rules import AhoCorasick
+from telemetry import get_logger
+from vector_index import normalize_rows
+
+log = get_logger("query_analyzer")
+
+# A few typical phrasings per intent; the query's closest example decides
+INTENT_PROTOTYPES = {
+    "myth_check": [
+        "is it true that carbs make you fat",
+        "is eating rice at night bad",
+        "does protein powder damage your kidneys",
+        "is this a myth",
+        "do detox teas really work",
+        "are eggs bad for your heart",
+        "will skipping breakfast slow my metabolism",
+    ],
+    "calories": [
+        "how many calories are in a banana",
+        "how many calories should I eat a day",
+        "calories in chicken breast",
+        "how much protein is in an egg",
+        "what is the calorie count of rice",
+    ],
+    "general_info": [
+        "tell me about healthy eating",
+        "what foods are good sources of fiber",
+        "what should I eat for breakfast",
+        "explain what omega 3 fats do",
+        "give me tips for a balanced diet",
+    ],
+}
+
+# Which diet topic a category or tag belongs to, by the words in its name
+DIET_TOPIC_ROOTS = {
+    "carbs": ("carb", "sugar", "grain", "rice", "bread", "staple", "fruit", "banana"),
+    "protein": ("protein", "muscle", "egg"),
+    "fat": ("fat", "oil", "omega", "cholesterol"),
+}
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def _pad_words(text: str) -> str:
+    # " is rice at night bad " - padding lets " rice " match whole words only
+    return f" {_NON_WORD.sub(' ', text.lower()).strip()} "
+
+
+def _topic_of(name: str) -> Optional[str]:
+    name = name.lower()
+    for topic, roots in DIET_TOPIC_ROOTS.items():
+        if any(root in name for root in roots):
+            return topic
+    return None
+
+
+class QueryAnalyzer:
+    """
+    analyze(text, query_vec) -> {"intent", "keywords", "diet_topic"}.
+
+    Split in two so the caller can overlap them with the embedding:
+    scan(text) is the lexicon pass (needs no vector), analyze() adds the intent.
+    """
+
+    def __init__(self, records: list[dict], encode: Callable,
+                 min_intent_similarity: float = QUERY_ANALYZER_MIN_INTENT_SIMILARITY,
+                 remote: Optional[Callable] = None, cache_size: int = QUERY_ANALYZER_CACHE_SIZE):
+        self.encode = encode
+        self.min_intent_similarity = min_intent_similarity
+        self.remote = lru_cache(maxsize=cache_size)(remote) if remote else None
+        self.stats = Counter()
+
+        # surface form (" weight loss ") -> canonical tag ("weight_loss")
+        self.surface_forms: dict[str, str] = {}
+        category_topics: dict[str, set] = {}
+        for item in records:
+            category = item.get("category") or ""
+            category_terms = [t for t in category.split("_and_") if t]
+            for term in (item.get("tags") or []) + category_terms:
+                keyword = term.lower()
+                self._add_forms(keyword)
+                category_topics.setdefault(keyword, set()).add(_topic_of(category))
+
+        # A keyword's topic is in its own name ("seed_oils" -> fat), or failing that,
+        # the one topic all of its records' categories agree on ("rice" -> carbs)
+        self.topics: dict[str, str] = {}
+        for keyword, topics in category_topics.items():
+            topic = _topic_of(keyword) or (next(iter(topics)) if len(topics) == 1 else None)
+            if topic:
+                self.topics[keyword] = topic
+        self.automaton = AhoCorasick(sorted(self.surface_forms))
+
+        self._prototypes = None  # embedded on first use, the model may still be loading
+
+    def _add_forms(self, keyword: str):
+        words = keyword.replace("_", " ")
+        forms = {words}
+        # Let "egg" find the "eggs" tag and "carb" find "carbs"
+        if words.endswith("s") and len(words) > 3:
+            forms.add(words[:-1])
+        else:
+            forms.add(words + "s")
+        for form in forms:
+            self.surface_forms.setdefault(f" {form} ", keyword)
+
+    def scan(self, text: str) -> dict:
+        """
+        Keywords and diet topic from the lexicon - no embedding needed
+        """
+        found = self.automaton.find(_pad_words(text))
+        keywords = sorted({self.surface_forms[form] for form in found})
+        topics = Counter(self.topics[k] for k in keywords if k in self.topics)
+        return {
+            "keywords": keywords,
+            "diet_topic": topics.most_common(1)[0][0] if topics else "general",
+        }
+
+    def _prototype_matrix(self) -> tuple[np.ndarray, list[str]]:
+        if self._prototypes is None:
+            labels = [intent for intent, examples in INTENT_PROTOTYPES.items() for _ in examples]
+            texts = [text for examples in INTENT_PROTOTYPES.values() for text in examples]
+            self._prototypes = (normalize_rows(self.encode(texts)), labels)
+        return self._prototypes
+
+    def intent(self, query_vec) -> tuple[str, float]:
+        vectors, labels = self._prototype_matrix()
+        scores = vectors @ normalize_rows(query_vec)[0]
+        best = int(np.argmax(scores))
+        return labels[best], float(scores[best])
+
+    def analyze(self, text: str, query_vec, lexical: Optional[dict] = None) -> dict:
+        lexical = lexical or self.scan(text)
+        intent, similarity = self.intent(query_vec)
+
+        if similarity < self.min_intent_similarity and self.remote:
+            try:
+                remote = dict(self.remote(normalize_text(text)))
+                self.stats["remote"] += 1
+                # Keep our own keywords if the remote one didn't find any
+                remote.setdefault("intent", intent)
+                remote["keywords"] = remote.get("keywords") or lexical["keywords"]
+                remote.setdefault("diet_topic", lexical["diet_topic"])
+                return remote
+            except Exception as e:
+                log.warning("!! Remote query analysis failed, using the local one: %s", e)
+
+        self.stats["local"] += 1
+        return {"intent": intent, **lexical}
+
+    @classmethod
+    def from_dataset(cls, encode: Callable, path: str = DATASET_PATH, **kwargs) -> "QueryAnalyzer":
+        return cls(load_dataset(path), encode, **kwargs)
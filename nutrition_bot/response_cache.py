@@ -0,0 +1,134 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from config import (
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_THRESHOLD,
+    RESPONSE_CACHE_TTL,
+)
+from vector_index import normalize_rows
+
+
+class SemanticResponseCache:
+    """
+    Caches finished chat answers and finds them again by meaning, not exact text.
+
+    A lookup embeds the question and returns a stored payload if a previous question
+    in the same partition is at least `threshold` cosine-similar. Partitions keep
+    answers personalised for a vegan from being served to a diabetic, and stale
+    answers from surviving a dataset re-upload.
+    """
+
+    def __init__(self, threshold: float = RESPONSE_CACHE_THRESHOLD,
+                 max_entries: int = RESPONSE_CACHE_SIZE,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # entry id -> (partition, stored_at, payload); ordered oldest-used first
+        self._entries: OrderedDict[int, tuple[tuple, float, dict]] = OrderedDict()
+        # partition -> (entry ids, stacked unit vectors)
+        self._partitions: dict[tuple, tuple[list[int], np.ndarray]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def partition_key(context_signature: str, dataset_version: str, variant: str = "") -> tuple:
+        """
+        `variant` keeps payloads that were put together differently (say, a myTake
+        written from the sources rather than the answer) from being served for each other
+        """
+        return (context_signature or "", dataset_version or "", variant or "")
+
+    def lookup(self, query_vec, partition: tuple) -> Optional[dict]:
+        """
+        Returns a copy of the cached payload (with its similarity) or None.
+        """
+        query = normalize_rows(query_vec)[0]
+        with self._lock:
+            ids, matrix = self._partitions.get(partition, ([], None))
+            if not ids:
+                self.misses += 1
+                return None
+
+            sims = matrix @ query
+            best = int(np.argmax(sims))
+            entry_id = ids[best]
+            _, stored_at, payload = self._entries[entry_id]
+
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                self._remove(entry_id)
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return {**payload, "similarity": float(sims[best])}
+
+    def store(self, query_vec, partition: tuple, payload: dict):
+        query = normalize_rows(query_vec)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (partition, time.monotonic(), dict(payload))
+
+            ids, matrix = self._partitions.get(partition, ([], None))
+            matrix = query if matrix is None else np.vstack([matrix, query])
+            self._partitions[partition] = (ids + [entry_id], matrix)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, entry_id: int):
+        partition, _, _ = self._entries.pop(entry_id)
+        ids, matrix = self._partitions[partition]
+        row = ids.index(entry_id)
+        if len(ids) == 1:
+            del self._partitions[partition]
+        else:
+            self._partitions[partition] = (
+                ids[:row] + ids[row + 1:],
+                np.delete(matrix, row, axis=0),
+            )
+
+    def invalidate(self, keep_dataset_version: Optional[str] = None) -> int:
+        """
+        Drop cached answers. Call this after re-uploading the dataset.
+        With keep_dataset_version, answers built from that version survive.
+        Returns how many entries were removed.
+        """
+        with self._lock:
+            stale = [
+                entry_id for entry_id, (partition, _, _) in self._entries.items()
+                if keep_dataset_version is None or partition[1] != keep_dataset_version
+            ]
+            for entry_id in stale:
+                self._remove(entry_id)
+            return len(stale)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "partitions": len(self._partitions),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
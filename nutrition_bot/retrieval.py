@@ -0,0 +1,307 @@
+from typing import Callable, NamedTuple, Optional
+
+from config import (
+    DATASET_PATH,
+    EMBEDDING_MODEL_NAME,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    HNSW_M,
+    LEXICAL_FAST_PATH,
+    LEXICAL_FAST_PATH_MIN_COVERAGE,
+    LEXICAL_FAST_PATH_MIN_MARGIN,
+    PINECONE_INDEX_HOST,
+    PINECONE_POOL_THREADS,
+    RETRIEVAL_BACKEND,
+    RETRIEVAL_SIDECAR_SOCKET,
+    RRF_K,
+)
+from dataset import load_dataset, record_metadata, record_text
+from telemetry import get_logger
+from upstream import UpstreamError, get_upstream
+from vector_index import ExactIndex, HNSWIndex
+
+log = get_logger("retrieval")
+
+
+class Match(NamedTuple):
+    """
+    Same attributes as a Pinecone match, so callers don't care where it came from.
+    """
+    id: str
+    score: float
+    metadata: dict
+
+
+def _matches_filter(metadata: dict, pine_filter: Optional[dict]) -> bool:
+    """
+    Supports the subset of Pinecone's filter language we actually use:
+    {"field": value}, {"field": {"$eq": value}}, {"field": {"$in": [...]}} and
+    {"$and": [...]} / {"$or": [...]} of those.
+    List-valued metadata (like tags) matches if any element matches.
+    """
+    if not pine_filter:
+        return True
+
+    for field, cond in pine_filter.items():
+        if field == "$and":
+            if not all(_matches_filter(metadata, part) for part in cond):
+                return False
+            continue
+        if field == "$or":
+            if not any(_matches_filter(metadata, part) for part in cond):
+                return False
+            continue
+
+        value = metadata.get(field)
+        values = value if isinstance(value, list) else [value]
+
+        if isinstance(cond, dict) and "$in" in cond:
+            allowed = cond["$in"]
+        elif isinstance(cond, dict) and "$eq" in cond:
+            allowed = [cond["$eq"]]
+        else:
+            allowed = [cond]
+
+        if not any(v in allowed for v in values):
+            return False
+    return True
+
+
+class PineconeRetriever:
+    """
+    The original remote lookup against our Pinecone index. With an upstream,
+    queries get its deadline, retries, hedging and circuit breaker.
+    """
+
+    # Pinecone knows nothing about our row numbers: no rows= queries, no query_batch()
+    searches_rows = False
+
+    def __init__(self, index, namespace: Optional[str] = None, upstream=None,
+                 index_factory: Optional[Callable] = None):
+        self.index = index
+        self.namespace = namespace
+        self.upstream = upstream
+        self.index_factory = index_factory
+
+    def reopen(self):
+        """
+        A fresh index client, so a forked worker doesn't share its parent's connections
+        """
+        if self.index_factory is not None:
+            self.index = self.index_factory()
+
+    def query(self, vector, top_k: int = 5, filter: Optional[dict] = None) -> list:
+        kwargs = {"namespace": self.namespace} if self.namespace else {}
+        kwargs.update(vector=vector, top_k=top_k, include_metadata=True, filter=filter or None)
+        if self.upstream is not None:
+            result = self.upstream.call(self.index.query, **kwargs)
+        else:
+            result = self.index.query(**kwargs)
+        return result.matches
+
+
+def open_pinecone_index(api_key: Optional[str], name: Optional[str] = None):
+    """
+    The Pinecone index, by PINECONE_INDEX_HOST when that's set, otherwise by name
+    """
+    from pinecone import Pinecone
+
+    client = Pinecone(api_key=api_key)
+    if PINECONE_INDEX_HOST:
+        return client.Index(host=PINECONE_INDEX_HOST, pool_threads=PINECONE_POOL_THREADS)
+    return client.Index(name, pool_threads=PINECONE_POOL_THREADS)
+
+
+def _build_index(vectors, engine: str, normalized: bool = False):
+    if engine == "hnsw":
+        return HNSWIndex(
+            vectors,
+            m=HNSW_M,
+            ef_construction=HNSW_EF_CONSTRUCTION,
+            ef_search=HNSW_EF_SEARCH,
+        )
+    return ExactIndex(vectors, normalized=normalized)
+
+
+class LocalRetriever:
+    """
+    In-process retrieval over the myths dataset.
+    The whole corpus fits in memory, so a query is a matmul (or a short HNSW walk)
+    instead of a network round trip.
+    """
+
+    searches_rows = True
+
+    def __init__(self, ids: list[str], metadata: list[dict], index):
+        self.ids = ids
+        self.row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+        self.metadata = metadata
+        self.index = index
+
+    @classmethod
+    def from_dataset(cls, encode: Callable, engine: str = "local",
+                     path: str = DATASET_PATH) -> "LocalRetriever":
+        """
+        Embed every record with `encode` (list[str] -> matrix) and index it.
+        Use the same model that embeds the queries!
+        """
+        records = load_dataset(path)
+        vectors = encode([record_text(item) for item in records])
+
+        return cls(
+            ids=[item["id"] for item in records],
+            metadata=[record_metadata(item) for item in records],
+            index=_build_index(vectors, engine),
+        )
+
+    @classmethod
+    def from_artifact(cls, artifact, engine: str = "local") -> "LocalRetriever":
+        """
+        Use precomputed vectors (see embedding_artifact.py) - nothing to encode,
+        and the exact index searches the memory-mapped matrix in place.
+        """
+        return cls(
+            ids=artifact.ids,
+            metadata=artifact.metadata,
+            index=_build_index(artifact.vectors, engine, normalized=True),
+        )
+
+    def query(self, vector, top_k: int = 5, filter: Optional[dict] = None, rows=None) -> list[Match]:
+        """
+        rows restricts the search to those records (a MetadataIndex plan's candidates,
+        which already had the filter applied)
+        """
+        if rows is not None:
+            found, scores = self.index.search_rows(vector, rows, top_k=top_k)
+            return [Match(id=self.ids[row], score=float(score), metadata=self.metadata[row])
+                    for row, score in zip(found, scores)]
+        if filter:
+            # Over-fetch so filtering still leaves us top_k results
+            rows, scores = self.index.search(vector, top_k=len(self.ids))
+        else:
+            rows, scores = self.index.search(vector, top_k=top_k)
+
+        matches = []
+        for row, score in zip(rows, scores):
+            meta = self.metadata[row]
+            if not _matches_filter(meta, filter):
+                continue
+            matches.append(Match(id=self.ids[row], score=float(score), metadata=meta))
+            if len(matches) >= top_k:
+                break
+        return matches
+
+
+    def query_batch(self, vectors, top_k: int = 5) -> list[list[Match]]:
+        """
+        Unfiltered query() for many vectors, scored together
+        """
+        return [
+            [Match(id=self.ids[row], score=float(score), metadata=self.metadata[row]) for row, score in zip(rows, scores)]
+            for rows, scores in self.index.search_batch(vectors, top_k=top_k)
+        ]
+
+
+def make_retriever(encode: Callable, pinecone_index_factory: Callable,
+                   backend: str = RETRIEVAL_BACKEND, namespace: Optional[str] = None,
+                   model_name: str = EMBEDDING_MODEL_NAME, index_name: Optional[str] = None,
+                   sidecar: str = RETRIEVAL_SIDECAR_SOCKET):
+    """
+    Build the retriever selected by RETRIEVAL_BACKEND.
+    pinecone_index_factory is only called for the "pinecone" backend, so local
+    setups don't need Pinecone credentials at all.
+
+    Local backends use the precomputed embedding artifact when there is a current
+    one for model_name, and embed the dataset with `encode` otherwise - so
+    model_name must be the model `encode` and the queries use.
+
+    With a sidecar socket, the retrieval sidecar searches instead (its own backend,
+    over model_name's vectors, for the Pinecone index index_name) and nothing is
+    loaded here.
+    """
+    if sidecar:
+        from retrieval_sidecar import SidecarRetriever, get_client
+
+        retriever = SidecarRetriever(index_name, namespace, model_name, client=get_client(sidecar))
+        log.info("Using the retrieval sidecar at %s (%r backend)", sidecar, retriever.backend)
+        return retriever
+    if backend in ("local", "hnsw"):
+        from embedding_artifact import artifact_dir, shared_artifact
+
+        artifact = shared_artifact(artifact_dir(model_name), model_name=model_name)
+        if artifact is not None:
+            retriever = LocalRetriever.from_artifact(artifact, engine=backend)
+            source = f"precomputed vectors from {artifact.directory}"
+        else:
+            retriever = LocalRetriever.from_dataset(encode, engine=backend)
+            source = "freshly embedded records"
+        log.info("Using in-process %r retrieval over %d %s", backend, len(retriever.ids), source)
+        return retriever
+    if backend != "pinecone":
+        raise ValueError(f"Unknown RETRIEVAL_BACKEND: {backend!r}")
+    return PineconeRetriever(pinecone_index_factory(), namespace=namespace, upstream=get_upstream("pinecone"),
+                             index_factory=pinecone_index_factory)
+
+
+# -------------------------
+# HYBRID (LEXICAL + VECTOR)
+# -------------------------
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = RRF_K) -> list[tuple[str, float]]:
+    """
+    Merge ranked id lists: each list gives a document 1 / (k + rank).
+    Only ranks matter, so BM25 and cosine scores never have to be put on one scale.
+    """
+    fused: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+def hybrid_depth(top_k: int) -> int:
+    # How many results each side contributes to the fusion
+    return max(2 * top_k, 10)
+
+
+def hybrid_query(text: str, dense, lexical, vector=None, embed: Optional[Callable] = None,
+                 top_k: int = 5, fast_path: bool = LEXICAL_FAST_PATH,
+                 dense_matches: Optional[list] = None) -> tuple[list[Match], str]:
+    """
+    BM25 and vector search fused with RRF. Returns (matches, path), where path is:
+      "lexical" - a confident keyword hit answered without embedding anything
+                  (only when no vector was passed in, i.e. none was computed yet)
+      "hybrid"  - both sides, fused
+      "lexical_fallback" - the vector side is down (Pinecone unhealthy), BM25 only
+
+    dense_matches are vector results already fetched (hybrid_depth(top_k) of them,
+    e.g. by a batched query) - then the dense side isn't queried again.
+
+    Match scores are the fused RRF scores (higher is better, not cosines).
+    """
+    depth = hybrid_depth(top_k)
+    hits = lexical.search(text, top_k=depth)
+
+    if vector is None and dense_matches is None and fast_path and lexical.confident_hit(
+            text, hits, LEXICAL_FAST_PATH_MIN_COVERAGE, LEXICAL_FAST_PATH_MIN_MARGIN):
+        fused = reciprocal_rank_fusion([[doc_id for doc_id, *_ in hits]])
+        by_id = {doc_id: meta for doc_id, _, _, meta in hits}
+        return [Match(doc_id, score, by_id[doc_id]) for doc_id, score in fused[:top_k]], "lexical"
+
+    if dense_matches is None:
+        if vector is None:
+            vector = embed(text)
+        try:
+            dense_matches = dense.query(vector, top_k=depth)
+        except UpstreamError as e:
+            if not hits:
+                raise
+            log.warning("⚠️ Vector search unavailable, answering from keyword search: %s", e)
+            fused = reciprocal_rank_fusion([[doc_id for doc_id, *_ in hits]])
+            by_id = {doc_id: meta for doc_id, _, _, meta in hits}
+            return [Match(doc_id, score, by_id[doc_id]) for doc_id, score in fused[:top_k]], "lexical_fallback"
+
+    # Prefer the vector side's metadata (it's what Pinecone actually stores)
+    by_id = {doc_id: meta for doc_id, _, _, meta in hits}
+    by_id.update({m.id: m.metadata or {} for m in dense_matches})
+    fused = reciprocal_rank_fusion([[m.id for m in dense_matches], [doc_id for doc_id, *_ in hits]])
+    return [Match(doc_id, score, by_id[doc_id]) for doc_id, score in fused[:top_k]], "hybrid"
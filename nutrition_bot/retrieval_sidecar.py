@@ -0,0 +1,562 @@
+"""
+One process that owns the embedding models and the retrievers for every app on
+the box, so nutrition_bot/app.py, vrm-next-app/backend/app.py and embeddings.py
+stop holding a transformer each. They talk to it over a Unix socket:
+
+    python retrieval_sidecar.py serve               # on RETRIEVAL_SIDECAR_SOCKET
+    python retrieval_sidecar.py stats               # what a running sidecar has done
+
+and the apps pick it up when RETRIEVAL_SIDECAR_SOCKET is set: load_encoder() then
+returns a SidecarEncoder and make_retriever() a SidecarRetriever, both drop-in
+replacements for what they'd have loaded themselves. Query caching and
+micro-batching of concurrent single-text embeds happen here, once for everyone.
+
+Wire format (little-endian). Every message is a u32 length and then the body:
+    request   u8 version, u8 op, op fields
+    response  u8 status (0 ok, 1 error), then the op's result or a utf-8 error
+
+    EMBED   model str16, u32 n, n x text str32     -> u32 n, u32 dim, n*dim float32
+    SEARCH  model str16, index str16, namespace str16, u16 top_k, u8 flags,
+            u32 n, u32 dim, n*dim float32, [filter json str32], [u32 count, count x u32 row]
+                                                   -> u32 n, per query: u16 matches, per match:
+                                                      f32 score, i32 row (-1: u16+id, u32+metadata json)
+    INFO    model str16, index str16, namespace str16  -> json str32 (backend, dimension, ids, metadata)
+    STATS                                          -> json str32
+
+Matches from the in-process index are just (score, row): clients fetch the ids
+and metadata once with INFO. Pinecone matches carry their own.
+
+SEARCH and INFO name the model the query vectors come from: each model has its
+own index (a MiniLM query can't be scored against bge rows), and vectors of the
+wrong size are refused with an error saying so.
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from config import (
+    EMBEDDING_ENGINE,
+    EMBEDDING_MODEL_NAME,
+    PINECONE_API_KEY,
+    RETRIEVAL_BACKEND,
+    RETRIEVAL_SIDECAR_MODELS,
+    RETRIEVAL_SIDECAR_SOCKET,
+    RETRIEVAL_SIDECAR_TIMEOUT_SECONDS,
+)
+from telemetry import get_logger
+from upstream import UpstreamError
+
+log = get_logger("sidecar")
+
+PROTOCOL_VERSION = 2
+OP_EMBED, OP_SEARCH, OP_INFO, OP_STATS = 1, 2, 3, 4
+OP_NAMES = {OP_EMBED: "embed", OP_SEARCH: "search", OP_INFO: "info", OP_STATS: "stats"}
+STATUS_OK, STATUS_ERROR = 0, 1
+FLAG_FILTER, FLAG_ROWS = 1, 2
+MAX_MESSAGE_BYTES = 64 << 20
+
+
+class SidecarError(UpstreamError):
+    """
+    The sidecar is unreachable or couldn't answer - callers fall back like for any upstream
+    """
+
+
+# -------------------------
+# WIRE FORMAT
+# -------------------------
+class Writer:
+    def __init__(self):
+        self.parts: list[bytes] = []
+
+    def pack(self, fmt: str, *values) -> "Writer":
+        self.parts.append(struct.pack("<" + fmt, *values))
+        return self
+
+    def str16(self, text: str) -> "Writer":
+        raw = text.encode("utf-8")
+        return self.pack("H", len(raw)).raw(raw)
+
+    def str32(self, text: str) -> "Writer":
+        raw = text.encode("utf-8")
+        return self.pack("I", len(raw)).raw(raw)
+
+    def matrix(self, vectors) -> "Writer":
+        matrix = np.ascontiguousarray(np.atleast_2d(np.asarray(vectors, dtype="<f4")))
+        return self.pack("II", *matrix.shape).raw(matrix.tobytes())
+
+    def raw(self, data: bytes) -> "Writer":
+        self.parts.append(data)
+        return self
+
+    def frame(self) -> bytes:
+        body = b"".join(self.parts)
+        return struct.pack("<I", len(body)) + body
+
+
+class Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, fmt: str):
+        values = struct.unpack_from("<" + fmt, self.data, self.offset)
+        self.offset += struct.calcsize("<" + fmt)
+        return values if len(values) > 1 else values[0]
+
+    def raw(self, size: int) -> memoryview:
+        if self.offset + size > len(self.data):
+            raise ValueError("Truncated message")
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def str16(self) -> str:
+        return str(self.raw(self.unpack("H")), "utf-8")
+
+    def str32(self) -> str:
+        return str(self.raw(self.unpack("I")), "utf-8")
+
+    def matrix(self) -> np.ndarray:
+        rows, dim = self.unpack("II")
+        return np.frombuffer(self.raw(rows * dim * 4), dtype="<f4").reshape(rows, dim)
+
+
+def read_message(sock: socket.socket) -> Optional[bytes]:
+    """
+    One message body, or None if the other side closed the connection between messages
+    """
+    header = _read_exactly(sock, 4)
+    if header is None:
+        return None
+    (size,) = struct.unpack("<I", header)
+    if size > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message of {size} bytes is over the {MAX_MESSAGE_BYTES} limit")
+    body = _read_exactly(sock, size)
+    if body is None:
+        raise ConnectionError("Connection closed mid-message")
+    return body
+
+
+def _read_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            if received:
+                raise ConnectionError("Connection closed mid-message")
+            return None
+        received += count
+    return bytes(buffer)
+
+
+# -------------------------
+# SERVER
+# -------------------------
+class RetrievalSidecar:
+    """
+    The models (with their embedding cache and batcher) and the retrievers,
+    loaded once and shared by every connection
+    """
+
+    def __init__(self, model_names: list[str] = RETRIEVAL_SIDECAR_MODELS):
+        self.model_names = model_names
+        self._models: dict[str, tuple] = {}
+        self._dimensions: dict[str, int] = {}
+        self._retrievers: dict[tuple, object] = {}
+        self._model_lock = threading.Lock()
+        self._retriever_lock = threading.Lock()
+        self.requests = Counter()
+        self.errors = Counter()
+        self.started = time.time()
+
+    def model(self, name: str) -> tuple:
+        """
+        (encoder, embedding cache, batcher) for one of the models we serve
+        """
+        if name not in self.model_names:
+            raise ValueError(f"Model {name!r} isn't served here (RETRIEVAL_SIDECAR_MODELS)")
+        with self._model_lock:
+            if name not in self._models:
+                from batch_embedder import BatchingEmbedder
+                from embedding_cache import get_embedding_cache
+                from encoders import load_encoder
+
+                started = time.perf_counter()
+                # The ONNX export is of our main model; anything else runs on torch
+                engine = EMBEDDING_ENGINE if name == EMBEDDING_MODEL_NAME else "torch"
+                encoder = load_encoder(name, engine, sidecar="")
+                probe = encoder.encode(["Is eating rice at night bad for weight loss?"])
+                self._dimensions[name] = int(np.asarray(probe).shape[-1])
+                batcher = BatchingEmbedder(lambda texts: encoder.encode(texts, batch_size=len(texts)))
+                self._models[name] = (encoder, get_embedding_cache(name), batcher)
+                log.info("Loaded %s (%s) in %.1fs", name, engine, time.perf_counter() - started)
+            return self._models[name]
+
+    def retriever(self, model_name: str, index: str, namespace: str):
+        from retrieval import make_retriever, open_pinecone_index
+
+        self.model(model_name)  # only models we serve, and we need its dimension
+        # Apps using the same model share one local index; Pinecone ones also differ
+        # by name and namespace
+        if RETRIEVAL_BACKEND != "pinecone":
+            key = (RETRIEVAL_BACKEND, model_name)
+        else:
+            key = (RETRIEVAL_BACKEND, model_name, index, namespace)
+        with self._retriever_lock:
+            if key not in self._retrievers:
+                self._retrievers[key] = make_retriever(
+                    encode=lambda texts: self._encode_uncached(model_name, texts),
+                    pinecone_index_factory=lambda: open_pinecone_index(PINECONE_API_KEY, index or None),
+                    backend=RETRIEVAL_BACKEND,
+                    namespace=namespace or None,
+                    model_name=model_name,
+                    sidecar="",
+                )
+            return self._retrievers[key]
+
+    def dimension(self, model_name: str) -> int:
+        self.model(model_name)
+        return self._dimensions[model_name]
+
+    def _encode_uncached(self, name: str, texts: list[str]) -> np.ndarray:
+        encoder, _, _ = self.model(name)
+        return encoder.encode(texts, batch_size=32)
+
+    # -------------------------
+    # OPERATIONS
+    # -------------------------
+    def embed(self, name: str, texts: list[str]) -> np.ndarray:
+        encoder, cache, batcher = self.model(name)
+        if len(texts) == 1:
+            # Single questions from many clients share one model call
+            return np.atleast_2d(cache.get_or_compute(texts[0], batcher.encode))
+        return np.asarray(cache.get_or_compute_many(texts, lambda batch: encoder.encode(batch, batch_size=32)))
+
+    def search(self, model_name: str, index: str, namespace: str, vectors: np.ndarray, top_k: int,
+               pine_filter: Optional[dict] = None, rows=None) -> list[list]:
+        retriever = self.retriever(model_name, index, namespace)
+        if vectors.shape[1] != self.dimension(model_name):
+            raise ValueError(f"Query vectors are {vectors.shape[1]}-d, but {model_name} "
+                             f"vectors are {self.dimension(model_name)}-d - embed them with {model_name}")
+        if pine_filter is None and rows is None and len(vectors) > 1 and getattr(retriever, "searches_rows", False):
+            return retriever.query_batch(vectors, top_k=top_k)
+        kwargs = {"rows": rows} if rows is not None else {}
+        return [retriever.query(vector, top_k=top_k, filter=pine_filter, **kwargs) for vector in vectors]
+
+    def info(self, model_name: str, index: str, namespace: str) -> dict:
+        retriever = self.retriever(model_name, index, namespace)
+        local = getattr(retriever, "searches_rows", False)
+        return {
+            "backend": RETRIEVAL_BACKEND,
+            "model_name": model_name,
+            "dimension": self.dimension(model_name),
+            "searches_rows": local,
+            "ids": retriever.ids if local else None,
+            "metadata": retriever.metadata if local else None,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "models": {
+                name: {"embedding_cache": cache.stats(), "batcher": batcher.stats()}
+                for name, (_, cache, batcher) in list(self._models.items())
+            },
+            "retrievers": [list(key) for key in self._retrievers],
+            "requests": dict(self.requests),
+            "errors": dict(self.errors),
+        }
+
+    # -------------------------
+    # REQUESTS
+    # -------------------------
+    def handle(self, body: bytes) -> bytes:
+        op = None
+        try:
+            reader = Reader(body)
+            version, op = reader.unpack("BB")
+            if version != PROTOCOL_VERSION:
+                raise ValueError(f"Protocol version {version}, expected {PROTOCOL_VERSION}")
+            self.requests[OP_NAMES.get(op, "unknown")] += 1
+            out = Writer().pack("B", STATUS_OK)
+            if op == OP_EMBED:
+                name = reader.str16()
+                texts = [reader.str32() for _ in range(reader.unpack("I"))]
+                out.matrix(self.embed(name, texts))
+            elif op == OP_SEARCH:
+                self._write_matches(out, *self._read_search(reader))
+            elif op == OP_INFO:
+                out.str32(json.dumps(self.info(reader.str16(), reader.str16(), reader.str16())))
+            elif op == OP_STATS:
+                out.str32(json.dumps(self.stats()))
+            else:
+                raise ValueError(f"Unknown op {op}")
+            return out.frame()
+        except Exception as e:
+            self.errors[OP_NAMES.get(op, "unknown")] += 1
+            log.warning("!! Sidecar %s failed: %s", OP_NAMES.get(op, op), e)
+            return Writer().pack("B", STATUS_ERROR).str32(f"{type(e).__name__}: {e}").frame()
+
+    def _read_search(self, reader: Reader):
+        model_name, index, namespace = reader.str16(), reader.str16(), reader.str16()
+        top_k, flags = reader.unpack("HB")
+        vectors = reader.matrix()
+        pine_filter = json.loads(reader.str32()) if flags & FLAG_FILTER else None
+        rows = None
+        if flags & FLAG_ROWS:
+            count = reader.unpack("I")
+            rows = np.frombuffer(reader.raw(count * 4), dtype="<u4").astype(np.int64)
+        retriever = self.retriever(model_name, index, namespace)
+        results = self.search(model_name, index, namespace, vectors, top_k, pine_filter, rows)
+        return retriever, results
+
+    @staticmethod
+    def _write_matches(out: Writer, retriever, results: list[list]):
+        row_of = getattr(retriever, "row_of", None)
+        out.pack("I", len(results))
+        for matches in results:
+            out.pack("H", len(matches))
+            for match in matches:
+                row = row_of.get(match.id, -1) if row_of is not None else -1
+                out.pack("fi", float(match.score), row)
+                if row < 0:
+                    out.str16(match.id).str32(json.dumps(match.metadata or {}))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # One connection serves a client thread's requests one after another
+        while True:
+            try:
+                body = read_message(self.request)
+            except (ConnectionError, ValueError) as e:
+                log.warning("!! Dropping sidecar connection: %s", e)
+                return
+            if body is None:
+                return
+            self.request.sendall(self.server.sidecar.handle(body))
+
+
+class SidecarServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, sidecar: RetrievalSidecar):
+        if os.path.exists(path):
+            os.unlink(path)  # left over from a sidecar that didn't shut down cleanly
+        self.sidecar = sidecar
+        super().__init__(path, _Handler)
+        # Only processes running as the same user get to connect
+        os.chmod(path, 0o600)
+
+
+def serve(path: str = RETRIEVAL_SIDECAR_SOCKET):
+    if not path:
+        raise SystemExit("Set RETRIEVAL_SIDECAR_SOCKET (or pass --socket) to where the sidecar should listen")
+    sidecar = RetrievalSidecar()
+    for name in sidecar.model_names:
+        sidecar.model(name)
+    with SidecarServer(path, sidecar) as server:
+        log.info("Retrieval sidecar listening on %s (models: %s)", path, ", ".join(sidecar.model_names))
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+# -------------------------
+# CLIENT
+# -------------------------
+class SidecarClient:
+    """
+    Blocking client, one connection per thread (and per process - connections
+    don't survive a fork). A broken connection is reopened once per request, so
+    restarting the sidecar doesn't take the apps down with it.
+    """
+
+    def __init__(self, path: str = RETRIEVAL_SIDECAR_SOCKET, timeout: float = RETRIEVAL_SIDECAR_TIMEOUT_SECONDS):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None or self._local.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def call(self, request: Writer) -> Reader:
+        frame = request.frame()
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(frame)
+                body = read_message(sock)
+                if body is None:
+                    raise ConnectionError("Sidecar closed the connection")
+                break
+            except (OSError, ConnectionError) as e:
+                self._close()
+                if attempt:
+                    raise SidecarError(f"Retrieval sidecar at {self.path} unavailable: {e}") from e
+        reader = Reader(body)
+        if reader.unpack("B") != STATUS_OK:
+            raise SidecarError(reader.str32())
+        return reader
+
+    @staticmethod
+    def _request(op: int) -> Writer:
+        return Writer().pack("BB", PROTOCOL_VERSION, op)
+
+    def embed(self, model_name: str, texts: list[str]) -> np.ndarray:
+        request = self._request(OP_EMBED).str16(model_name).pack("I", len(texts))
+        for text in texts:
+            request.str32(text)
+        return self.call(request).matrix()
+
+    def search(self, model_name: str, index: str, namespace: str, vectors, top_k: int,
+               pine_filter: Optional[dict] = None, rows=None) -> list[list[tuple]]:
+        """
+        [[(score, row, id, metadata)]] per vector; row is -1 (and id and metadata
+        are set) for matches that aren't in the sidecar's local index
+        """
+        flags = (FLAG_FILTER if pine_filter else 0) | (FLAG_ROWS if rows is not None else 0)
+        request = self._request(OP_SEARCH).str16(model_name).str16(index).str16(namespace).pack("HB", top_k, flags)
+        request.matrix(vectors)
+        if pine_filter:
+            request.str32(json.dumps(pine_filter))
+        if rows is not None:
+            rows = np.asarray(rows, dtype="<u4")
+            request.pack("I", len(rows)).raw(rows.tobytes())
+
+        reader = self.call(request)
+        results = []
+        for _ in range(reader.unpack("I")):
+            matches = []
+            for _ in range(reader.unpack("H")):
+                score, row = reader.unpack("fi")
+                if row < 0:
+                    matches.append((score, row, reader.str16(), json.loads(reader.str32())))
+                else:
+                    matches.append((score, row, None, None))
+            results.append(matches)
+        return results
+
+    def info(self, model_name: str, index: str, namespace: str) -> dict:
+        request = self._request(OP_INFO).str16(model_name).str16(index).str16(namespace)
+        return json.loads(self.call(request).str32())
+
+    def stats(self) -> dict:
+        return json.loads(self.call(self._request(OP_STATS)).str32())
+
+
+_clients: dict[str, SidecarClient] = {}
+
+
+def get_client(path: str = RETRIEVAL_SIDECAR_SOCKET) -> SidecarClient:
+    if path not in _clients:
+        _clients[path] = SidecarClient(path)
+    return _clients[path]
+
+
+class SidecarEncoder:
+    """
+    SentenceTransformer's encode() for a model the sidecar serves
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, client: Optional[SidecarClient] = None):
+        self.model_name = model_name
+        self.client = client or get_client()
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        # The sidecar does its own batching, so batch_size is only accepted for compatibility
+        if isinstance(sentences, str):
+            return self.client.embed(self.model_name, [sentences])[0]
+        return self.client.embed(self.model_name, list(sentences))
+
+
+class SidecarRetriever:
+    """
+    A retriever (see retrieval.py) that searches in the sidecar. When the sidecar's
+    index is in process, the ids and metadata are fetched once, matches come back
+    as rows, and row-restricted and batched queries work like LocalRetriever's.
+    """
+
+    def __init__(self, index: str = "", namespace: Optional[str] = None, model_name: str = EMBEDDING_MODEL_NAME,
+                 client: Optional[SidecarClient] = None):
+        self.index = index or ""
+        self.namespace = namespace or ""
+        # The model the query vectors come from - the sidecar searches that model's index
+        self.model_name = model_name
+        self.client = client or get_client()
+        info = self.client.info(self.model_name, self.index, self.namespace)
+        self.backend = info["backend"]
+        self.searches_rows = info["searches_rows"]
+        self.ids = info["ids"] or []
+        self.metadata = info["metadata"] or []
+
+    def reopen(self):
+        # Connections are per process already
+        pass
+
+    def _matches(self, found: list[tuple]) -> list:
+        from retrieval import Match
+
+        return [
+            Match(id=self.ids[row], score=score, metadata=self.metadata[row]) if row >= 0
+            else Match(id=doc_id, score=score, metadata=metadata)
+            for score, row, doc_id, metadata in found
+        ]
+
+    def query(self, vector, top_k: int = 5, filter: Optional[dict] = None, rows=None) -> list:
+        return self._matches(self.client.search(self.model_name, self.index, self.namespace, [vector], top_k,
+                                                     filter, rows)[0])
+
+    def query_batch(self, vectors, top_k: int = 5) -> list[list]:
+        return [self._matches(found) for found in self.client.search(self.model_name, self.index, self.namespace,
+                                                                        vectors, top_k)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared embedding / retrieval sidecar")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="load the models and listen on the socket")
+    serve_parser.add_argument("--socket", default=RETRIEVAL_SIDECAR_SOCKET)
+    stats_parser = sub.add_parser("stats", help="ask a running sidecar what it has done")
+    stats_parser.add_argument("--socket", default=RETRIEVAL_SIDECAR_SOCKET)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.socket)
+        return
+    print(json.dumps(SidecarClient(args.socket).stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Production entry point for the chat backends: a gunicorn master that loads the
+embedding model, the local indexes and the dataset once, then forks workers that
+share those pages copy-on-write instead of each reading its own 1.3 GB model.
+
+    python serve.py vrm                  # vrm-next-app/backend/app.py on :5002
+    python serve.py nutrition_bot        # nutrition_bot/app.py on :5001
+    python serve.py memory               # shared vs unique memory per worker
+
+Workers, threads, timeouts and worker recycling come from the SERVE_* settings in
+config.py. Graceful restarts are gunicorn's signals, sent to the master (its pid is
+in SERVE_PIDFILE):
+
+    HUP         new workers forked from the already-loaded master, old ones finish
+                their requests first (code and model changes need a full restart)
+    TERM        graceful shutdown, waiting up to SERVE_GRACEFUL_TIMEOUT
+    TTIN / TTOU one worker more / fewer
+
+Conversation sessions have to be shared by every worker, so with more than one
+the default SESSION_BACKEND ("auto") keeps them in SQLite, and "memory" is refused.
+(Started with one worker and "memory", don't add workers with TTIN.)
+
+Only the Flask apps fork; the ASGI mode (asgi_app.py) still runs under hypercorn.
+"""
+import argparse
+import gc
+import importlib
+import os
+import sys
+import tempfile
+from typing import Optional
+
+# Nothing may still be loading in a background thread when we fork (threads don't
+# survive into the workers), so the app loads everything on import. This has to be
+# set before config.py reads it.
+REQUESTED_MODEL_LOADING = os.environ.get("MODEL_LOADING", "eager")
+os.environ["MODEL_LOADING"] = "eager"
+
+from config import (
+    EMBED_TORCH_THREADS,
+    SERVE_BIND,
+    SERVE_GRACEFUL_TIMEOUT,
+    SERVE_KEEPALIVE,
+    SERVE_MAX_REQUESTS,
+    SERVE_MAX_REQUESTS_JITTER,
+    SERVE_PIDFILE,
+    SERVE_THREADS,
+    SERVE_TIMEOUT,
+    SERVE_WORKERS,
+    SESSION_BACKEND,
+)
+from session_store import FORKED_WORKERS_ENV
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+APPS = {
+    "vrm": {"dir": os.path.join(HERE, "..", "vrm-next-app", "backend"), "bind": "0.0.0.0:5002"},
+    "nutrition_bot": {"dir": HERE, "bind": "127.0.0.1:5001"},
+}
+
+
+def default_pidfile(name: str) -> str:
+    return SERVE_PIDFILE or os.path.join(tempfile.gettempdir(), f"serve-{name}.pid")
+
+
+def load_app_module(name: str):
+    """
+    Import the app, which loads its model and indexes on the way (MODEL_LOADING=eager)
+    """
+    if REQUESTED_MODEL_LOADING.lower() != "eager":
+        print(f"⚠️ Ignoring MODEL_LOADING={REQUESTED_MODEL_LOADING} - prefork serving loads eagerly")
+    sys.path.insert(0, os.path.abspath(APPS[name]["dir"]))
+    return importlib.import_module("app")
+
+
+# -------------------------
+# MEMORY REPORT
+# -------------------------
+def read_smaps_rollup(pid: int) -> Optional[dict]:
+    """
+    kB figures for one process: rss, pss (shared pages split between their users),
+    shared and private (pages only this process has - what a worker really costs)
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "shared_kb": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(pid: int) -> list[int]:
+    pids = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+    except OSError:
+        pass
+    return sorted(set(pids))
+
+
+def memory_report(master_pid: int) -> dict:
+    processes = [{"pid": master_pid, "role": "master", **(read_smaps_rollup(master_pid) or {})}]
+    for pid in child_pids(master_pid):
+        usage = read_smaps_rollup(pid)
+        if usage is not None:
+            processes.append({"pid": pid, "role": "worker", **usage})
+    return {
+        "processes": processes,
+        # What the whole server really uses, vs. what adding up RSS would suggest
+        "total_pss_kb": sum(p.get("pss_kb", 0) for p in processes),
+        "total_rss_kb": sum(p.get("rss_kb", 0) for p in processes),
+    }
+
+
+def print_memory_report(report: dict):
+    print(f"{'pid':>8} {'role':<7} {'rss MB':>9} {'pss MB':>9} {'shared MB':>10} {'unique MB':>10}")
+    for p in report["processes"]:
+        print(f"{p['pid']:>8} {p['role']:<7} {p.get('rss_kb', 0) / 1024:>9.1f} {p.get('pss_kb', 0) / 1024:>9.1f} "
+              f"{p.get('shared_kb', 0) / 1024:>10.1f} {p.get('private_kb', 0) / 1024:>10.1f}")
+    print(f"Total: {report['total_pss_kb'] / 1024:.1f} MB actually used (PSS), "
+          f"{report['total_rss_kb'] / 1024:.1f} MB if you add up RSS")
+
+
+def process_memory_metrics():
+    from telemetry import MetricFamily
+
+    usage = read_smaps_rollup(os.getpid()) or {}
+    return [MetricFamily("process_memory_bytes", "gauge",
+                         "This worker's memory: rss, pss, shared with other processes, and private to it",
+                         [("", {"kind": key[:-3]}, value * 1024) for key, value in usage.items()])]
+
+
+# -------------------------
+# GUNICORN
+# -------------------------
+def worker_torch_threads(workers: int) -> int:
+    # N workers each running torch's default pool (one thread per core) would fight
+    # over every core - split the cores between them unless EMBED_TORCH_THREADS says otherwise
+    if EMBED_TORCH_THREADS > 0:
+        return EMBED_TORCH_THREADS
+    return max(1, (os.cpu_count() or 1) // max(workers, 1))
+
+
+def check_session_backend(workers: int):
+    """
+    Sessions must be visible to every worker - a user's next turn can land on any of them
+    """
+    if workers > 1 and SESSION_BACKEND == "memory":
+        raise SystemExit(f"SESSION_BACKEND=memory keeps sessions per process, so with {workers} workers "
+                         "users would lose their preferences between turns - use sqlite (or auto), "
+                         "or --workers 1")
+    # Read by session_store's "auto" backend when the app loads
+    os.environ[FORKED_WORKERS_ENV] = str(workers)
+
+
+def serve(name: str, bind: Optional[str], workers: int, threads: int):
+    from gunicorn.app.base import BaseApplication
+
+    check_session_backend(workers)
+    pidfile = default_pidfile(name)
+
+    def when_ready(server):
+        # Everything loaded so far is permanent: moving it out of the GC's generations
+        # means no collection ever writes to (and so un-shares) those pages in a worker
+        gc.collect()
+        gc.freeze()
+        server.log.info(f"{gc.get_freeze_count()} objects frozen; forking {workers} workers "
+                        f"(memory report: python serve.py memory --pidfile {pidfile})")
+
+    def post_fork(server, worker):
+        if "torch" in sys.modules:
+            import torch
+            torch.set_num_threads(worker_torch_threads(workers))
+        module = sys.modules.get("app")
+        if module is not None and hasattr(module, "after_fork"):
+            module.after_fork()
+
+        from telemetry import register_collector
+        register_collector(process_memory_metrics)
+
+    class PreforkApplication(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": bind or SERVE_BIND or APPS[name]["bind"],
+                "workers": workers,
+                "threads": threads,
+                "worker_class": "gthread" if threads > 1 else "sync",
+                "preload_app": True,
+                "timeout": SERVE_TIMEOUT,
+                "graceful_timeout": SERVE_GRACEFUL_TIMEOUT,
+                "keepalive": SERVE_KEEPALIVE,
+                "max_requests": SERVE_MAX_REQUESTS,
+                "max_requests_jitter": SERVE_MAX_REQUESTS_JITTER,
+                "pidfile": pidfile,
+                "proc_name": f"nutrition-{name}",
+                # The worker heartbeat file, in RAM rather than on a possibly slow disk
+                "worker_tmp_dir": "/dev/shm" if os.path.isdir("/dev/shm") else None,
+                "when_ready": when_ready,
+                "post_fork": post_fork,
+            }
+            for key, value in settings.items():
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return load_app_module(name).app
+
+    PreforkApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("app", choices=sorted(APPS) + ["memory"])
+    parser.add_argument("--bind", default=None, help="host:port (default SERVE_BIND, or the app's usual port)")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS)
+    parser.add_argument("--pid", type=int, default=None, help="memory: the master's pid")
+    parser.add_argument("--pidfile", default=None, help="memory: read the master's pid from here")
+    args = parser.parse_args()
+
+    if args.app != "memory":
+        serve(args.app, args.bind, args.workers, args.threads)
+        return
+
+    pid = args.pid
+    if pid is None:
+        candidates = [args.pidfile] if args.pidfile else [default_pidfile(n) for n in APPS]
+        for path in candidates:
+            if os.path.exists(path):
+                with open(path) as f:
+                    pid = int(f.read().strip())
+                break
+    if pid is None:
+        parser.error("no running server found - pass --pid or --pidfile")
+    print_memory_report(memory_report(pid))
+
+
+if __name__ == "__main__":
+    main()
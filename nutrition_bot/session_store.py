@@ -0,0 +1,240 @@
+"""
+Server-side conversation sessions, so the chat UI can send a sessionId instead of
+resending (and us re-parsing) its preferences on every turn.
+
+A session only keeps what can't be recomputed: the preferences the user picked and
+the user-context signature they add up to. Anything derived from them (the query
+prefix, the keyword scan over it) is memoized per process by the app, keyed by the
+preferences, so a thousand "I'm vegan" sessions share one copy.
+
+Two backends (SESSION_BACKEND):
+    "memory" - an LRU dict with idle TTL and a size cap, per process
+    "sqlite" - a local SQLite file, shared by every worker on the machine
+and "auto" (the default) picks sqlite when serve.py runs more than one worker:
+with per-process sessions, a turn landing on another worker would silently lose
+the user's preferences.
+"""
+import json
+import os
+import re
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import SESSION_BACKEND, SESSION_DB_PATH, SESSION_MAX_ENTRIES, SESSION_TTL_SECONDS
+
+_VALID_ID = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+# serve.py puts its worker count here before the app (and its session store) loads
+FORKED_WORKERS_ENV = "SERVE_FORKED_WORKERS"
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+class Session:
+    __slots__ = ("id", "preferences", "context", "turns", "is_new")
+
+    def __init__(self, session_id: str, preferences: tuple = (), context: str = "",
+                 turns: int = 0, is_new: bool = False):
+        self.id = session_id
+        # Interned: the same few button labels are shared by every session
+        self.preferences = tuple(sys.intern(p) for p in preferences)
+        self.context = context
+        self.turns = turns
+        self.is_new = is_new
+
+    def set_preferences(self, preferences) -> bool:
+        """
+        Returns True if they changed
+        """
+        cleaned = tuple(sys.intern(str(p).strip()) for p in preferences if str(p).strip())
+        changed = cleaned != self.preferences
+        self.preferences = cleaned
+        return changed
+
+    def add_preference(self, preference: str) -> bool:
+        preference = preference.strip()
+        if not preference or preference in self.preferences:
+            return False
+        self.preferences += (sys.intern(preference),)
+        return True
+
+    def to_json(self) -> str:
+        return json.dumps([list(self.preferences), self.context, self.turns], separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, session_id: str, data: str) -> "Session":
+        preferences, context, turns = json.loads(data)
+        return cls(session_id, tuple(preferences), context, turns)
+
+
+class MemorySessionStore:
+    """
+    Sessions in this process, least recently used first; idle ones expire after ttl_seconds
+    """
+
+    def __init__(self, max_entries: int = SESSION_MAX_ENTRIES, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, Session]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Optional[Session]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or now - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[session_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[1]
+
+    def save(self, session: Session):
+        with self._lock:
+            self._entries[session.id] = (time.monotonic(), session)
+            self._entries.move_to_end(session.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / (self.hits + self.misses), 4) if self.hits + self.misses else 0.0,
+        }
+
+
+class SQLiteSessionStore:
+    """
+    Sessions in a local SQLite file (WAL mode), so every prefork worker sees the same
+    ones. One connection per thread per process; expired rows are purged now and then.
+    """
+
+    PURGE_EVERY = 500  # saves
+
+    def __init__(self, path: str = SESSION_DB_PATH, max_entries: int = SESSION_MAX_ENTRIES,
+                 ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._saves = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                       "id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection mustn't cross fork() or threads
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")  # a lost session is a re-asked question, not lost data
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get(self, session_id: str) -> Optional[Session]:
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE id = ? AND updated > ?",
+            (session_id, time.time() - self.ttl_seconds),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Session.from_json(session_id, row[0])
+
+    def save(self, session: Session):
+        db = self._connection()
+        db.execute("INSERT OR REPLACE INTO sessions (id, data, updated) VALUES (?, ?, ?)",
+                   (session.id, session.to_json(), time.time()))
+        self._saves += 1
+        if self._saves % self.PURGE_EVERY == 0:
+            self.purge(db)
+
+    def purge(self, db: Optional[sqlite3.Connection] = None):
+        db = db or self._connection()
+        expired = db.execute("DELETE FROM sessions WHERE updated <= ?", (time.time() - self.ttl_seconds,)).rowcount
+        # Past the cap, the least recently used go first
+        over_cap = db.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        self.evictions += expired + over_cap
+
+    def stats(self) -> dict:
+        size = self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "size": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / (self.hits + self.misses), 4) if self.hits + self.misses else 0.0,
+        }
+
+
+def resolve_backend(backend: str = SESSION_BACKEND) -> str:
+    if backend == "auto":
+        return "sqlite" if int(os.environ.get(FORKED_WORKERS_ENV, "1")) > 1 else "memory"
+    return backend
+
+
+def make_session_store(backend: str = SESSION_BACKEND):
+    backend = resolve_backend(backend)
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend!r}")
+
+
+def load_session(store, session_id: Optional[str]) -> Session:
+    """
+    The stored session for session_id, or a new one (unknown, expired or malformed ids
+    get a fresh id rather than an error - the client just starts over)
+    """
+    if session_id and _VALID_ID.match(str(session_id)):
+        session = store.get(session_id)
+        if session is not None:
+            return session
+    return Session(new_session_id(), is_new=True)
+
+
+def save_session(store, session: Session) -> bool:
+    """
+    Store the session after a turn, unless it's a new one with nothing to remember.
+    Stateless callers (no sessionId, no preferences) get an id back but take no
+    space - otherwise every one of their requests would push a real user's
+    preferences out of the store. Returns True if it was stored.
+    """
+    if session.is_new and not session.preferences:
+        return False
+    # From now on it's in the store (the memory backend keeps this very object)
+    session.is_new = False
+    store.save(session)
+    return True
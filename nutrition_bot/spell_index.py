@@ -0,0 +1,123 @@
+import re
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Iterable, Optional
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WORD = re.compile(r"[a-z]+")
+
+
+def _deletes(word: str, max_distance: int) -> set[str]:
+    """
+    Every string reachable from word by deleting up to max_distance characters.
+    """
+    results = set()
+    frontier = {word}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for w in frontier:
+            if len(w) <= 1:
+                continue
+            for i in range(len(w)):
+                next_frontier.add(w[:i] + w[i + 1:])
+        results |= next_frontier
+        frontier = next_frontier
+    return results
+
+
+class SpellCorrector:
+    """
+    Fuzzy typo correction backed by a SymSpell-style deletes dictionary.
+
+    Instead of comparing every word against the whole vocabulary (what difflib does),
+    we index every vocabulary word under all its deletions once at startup. A lookup
+    only generates the deletions of the typed word and checks the handful of words
+    that share one, so cost barely grows with the vocabulary. Candidates are then
+    ranked with the same difflib ratio and cutoff as before, and every distinct
+    token's answer is memoized.
+    """
+
+    def __init__(self, vocabulary: Iterable[str], max_edit_distance: int = 2,
+                 prefix_length: int = 7, cutoff: float = 0.7, min_word_length: int = 4,
+                 memo_size: int = 50000):
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.cutoff = cutoff
+        self.min_word_length = min_word_length
+
+        self.words = list(dict.fromkeys(w.lower() for w in vocabulary if w))
+        self.vocabulary = set(self.words)
+        # Longer words get indexed under their first prefix_length characters only
+        # (standard SymSpell trick) - that keeps the index small for big vocabularies.
+        self.index: dict[str, list[str]] = {}
+        for word in self.words:
+            prefix = word[:prefix_length]
+            for key in _deletes(prefix, max_edit_distance) | {prefix}:
+                self.index.setdefault(key, []).append(word)
+
+        self.lookup = lru_cache(maxsize=memo_size)(self._lookup)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def _lookup(self, clean_word: str) -> Optional[str]:
+        """
+        Best vocabulary match for a cleaned, lowercased word, or None.
+        """
+        if not clean_word or clean_word in self.vocabulary:
+            return None
+
+        prefix = clean_word[:self.prefix_length]
+        candidates = set()
+        for key in _deletes(prefix, self.max_edit_distance) | {prefix}:
+            candidates.update(self.index.get(key, ()))
+
+        best, best_score = None, self.cutoff
+        matcher = SequenceMatcher()
+        matcher.set_seq2(clean_word)
+        for candidate in candidates:
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() < best_score or matcher.quick_ratio() < best_score:
+                continue
+            score = matcher.ratio()
+            # Same tie-breaking as difflib.get_close_matches
+            if score > best_score or (score == best_score and (best is None or candidate > best)):
+                best, best_score = candidate, score
+        return best
+
+    def correct(self, text: str) -> tuple[str, list[str]]:
+        """
+        Returns (corrected text, ["typo → fix", ...]), the correct_spelling() contract.
+        """
+        corrected_words = []
+        corrections_made = []
+
+        for word in text.split():
+            # Don't bother correcting really short words
+            if len(word) < self.min_word_length:
+                corrected_words.append(word)
+                continue
+
+            match = self.lookup(_PUNCTUATION.sub("", word.lower()))
+            if match:
+                corrected_words.append(match)
+                corrections_made.append(f"{word} → {match}")
+            else:
+                corrected_words.append(word)
+
+        return " ".join(corrected_words), corrections_made
+
+
+def dataset_vocabulary(records: list[dict]) -> set[str]:
+    """
+    Real words from the dataset (myths, facts, tags, categories), so "night" in
+    "rice at night" is recognised instead of being "fixed" into a nutrition term.
+    """
+    words = set()
+    for item in records:
+        for field in ("myth", "fact"):
+            words.update(_WORD.findall(item.get(field, "").lower()))
+        words.update(item.get("category", "").lower().split("_"))
+        for tag in item.get("tags") or []:
+            words.update(tag.lower().split("_"))
+    return {w for w in words if len(w) >= 4}
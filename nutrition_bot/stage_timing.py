@@ -0,0 +1,92 @@
+"""
+Per-request stage timings, returned as a Server-Timing header so the load tests
+in benchmarks/ (and the browser's network panel) can see where a request's time
+went without any tracing setup:
+
+    Server-Timing: prepare;dur=0.4, embed;dur=21.7, search;dur=3.1, llm;dur=812.5, total;dur=840.2
+
+The web app calls begin() when a request starts and header() when it ends; code
+in between just wraps its work in `with stage("search"):`. Outside a request
+(scripts, background warmup) stage() does nothing. Each stage is also observed in
+the chat_stage_seconds histogram on /metrics (see telemetry.py).
+"""
+import contextvars
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from telemetry import STAGE_SECONDS
+
+_current: contextvars.ContextVar = contextvars.ContextVar("stage_timings", default=None)
+
+
+class StageTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: list[tuple[str, float]] = []
+        self.active: set[str] = set()
+
+    def add(self, name: str, ms: float):
+        self.stages.append((name, ms))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def header(self) -> str:
+        # A stage that ran twice (e.g. two Groq calls) is reported once, summed
+        totals: dict[str, float] = {}
+        for name, ms in self.stages:
+            totals[name] = totals.get(name, 0.0) + ms
+        totals["total"] = self.elapsed() * 1000
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in totals.items())
+
+
+def begin() -> StageTimings:
+    timings = StageTimings()
+    _current.set(timings)
+    return timings
+
+
+def current() -> Optional[StageTimings]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    timings = _current.get()
+    # A stage nested in itself (an async caller timing a sync helper that times
+    # itself too) is only counted by the outermost one
+    if timings is None or name in timings.active:
+        yield
+        return
+    timings.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(name)
+        elapsed = time.perf_counter() - started
+        timings.add(name, elapsed * 1000)
+        STAGE_SECONDS.observe(elapsed, stage=name)
+
+
+def timed(name: str):
+    """
+    Decorator form of stage(), for plain functions and coroutines
+    """
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,126 @@
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Callable
+
+
+class StartupReport:
+    """
+    Records how long each startup phase took (imports, model load, warmup)
+    so we can see where a cold start goes.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: list[dict] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timed(self, phase: str):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            with self._lock:
+                self.phases.append({
+                    "phase": phase,
+                    "seconds": round(ended - began, 4),
+                    "finished_at": round(ended - self.started, 4),
+                })
+
+    def mark(self, phase: str):
+        """
+        Record a point in time (e.g. "module imported") rather than a duration
+        """
+        now = round(time.perf_counter() - self.started, 4)
+        with self._lock:
+            self.phases.append({"phase": phase, "seconds": now, "finished_at": now})
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.perf_counter() - self.started, 3),
+                "phases": list(self.phases),
+            }
+
+    def print_summary(self, title: str = "Startup report"):
+        print(f"⏱️ {title}:")
+        for p in self.as_dict()["phases"]:
+            print(f"   {p['phase']:<36} {p['seconds']:>8.3f}s  (done at +{p['finished_at']:.3f}s)")
+
+
+class LazyResource:
+    """
+    Something expensive (a model, a client, an index) that is built on first use.
+
+    The first caller of get() runs the loader; concurrent callers wait for it.
+    Call get() from a background thread at startup to warm it up before traffic arrives.
+    """
+
+    def __init__(self, name: str, loader: Callable, report: StartupReport = None):
+        self.name = name
+        self.loader = loader
+        self.report = report
+        self._value = None
+        self._error = None
+        self._started = False
+        self._loaded = threading.Event()
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            load_here = not self._started
+            self._started = True
+
+        if load_here:
+            self._load()
+        self._loaded.wait()
+
+        if self._error is not None:
+            raise RuntimeError(f"{self.name} failed to load: {self._error}")
+        return self._value
+
+    def _load(self):
+        try:
+            if self.report:
+                with self.report.timed(f"load {self.name}"):
+                    self._value = self.loader()
+            else:
+                self._value = self.loader()
+        except Exception as e:
+            self._error = e
+            print(f"!! Failed to load {self.name}: {e}")
+            traceback.print_exc()
+        finally:
+            self._loaded.set()
+
+    def reset(self):
+        """
+        Forget the loaded value; the next get() loads it again
+        """
+        with self._lock:
+            self._value = None
+            self._error = None
+            self._started = False
+            self._loaded = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded.is_set() and self._error is None
+
+    def status(self) -> dict:
+        if self._error is not None:
+            state = "failed"
+        elif self._loaded.is_set():
+            state = "ready"
+        elif self._started:
+            state = "loading"
+        else:
+            state = "not_started"
+
+        status = {"state": state}
+        if self._error is not None:
+            status["error"] = str(self._error)
+        return status
@@ -0,0 +1,300 @@
+"""
+Metrics and logging for the chat backends, cheap enough to leave on under load.
+
+Metrics are kept in process and rendered in the Prometheus text format for
+GET /metrics:
+
+    chat_stage_seconds{stage="llm"}        every stage_timing stage (spell, context,
+                                           embed, search, classify, llm, my_take, serialize)
+    http_request_duration_seconds          per endpoint
+    chat_answers_total{source="cache"}     groq_enhanced / cache / fallback / clarify
+
+Numbers other modules already keep (cache hits, upstream counters, token totals)
+aren't counted twice - register_collector() reads them when /metrics is scraped.
+
+Logging goes through get_logger(). Records are put on a queue and written by one
+background thread, so a request never waits on stdout; when the queue is full
+they're dropped and counted. Below WARNING, only LOG_SAMPLE_RATE of requests log
+anything - start_request() makes that choice once, so a kept request keeps all
+its lines.
+"""
+import atexit
+import bisect
+import contextvars
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from collections import defaultdict
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from config import LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upstream calls and encodes run from ~1 ms (cache hits) to tens of seconds (deadlines)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MetricFamily(NamedTuple):
+    name: str
+    kind: str  # "counter", "gauge" or "histogram"
+    help: str
+    samples: list  # (suffix, labels dict, value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+# -------------------------
+# METRICS
+# -------------------------
+class CounterMetric:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = defaultdict(float)
+        if not labels:
+            self._values[()] = 0.0  # report 0 rather than nothing
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def collect(self) -> MetricFamily:
+        with self._lock:
+            values = dict(self._values)
+        samples = [("", dict(zip(self.labels, key)), value) for key, value in sorted(values.items())]
+        return MetricFamily(self.name, "counter", self.help, samples)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (non-cumulative, +Inf last), sum]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def collect(self) -> MetricFamily:
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        samples = []
+        for key, (counts, total) in sorted(series.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append(("_bucket", {**labels, "le": le}, cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return MetricFamily(self.name, "histogram", self.help, samples)
+
+
+_metrics: list = []
+_collectors: list[Callable[[], Iterable[MetricFamily]]] = []
+_registry_lock = threading.Lock()
+
+
+def counter(name: str, help: str, labels: tuple = ()) -> CounterMetric:
+    metric = CounterMetric(name, help, labels)
+    with _registry_lock:
+        _metrics.append(metric)
+    return metric
+
+
+def histogram(name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help, labels, buckets)
+    with _registry_lock:
+        _metrics.append(metric)
+    return metric
+
+
+def register_collector(collect: Callable[[], Iterable[MetricFamily]]):
+    """
+    collect() is called on every scrape and returns MetricFamily tuples
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+
+
+def gauge(name: str, help: str, value: float, **labels) -> MetricFamily:
+    return MetricFamily(name, "gauge", help, [("", labels, value)])
+
+
+def counter_family(name: str, help: str, label: str, counts: dict) -> MetricFamily:
+    """
+    A plain {label value: count} dict (e.g. a collections.Counter) as a counter
+    """
+    return MetricFamily(name, "counter", help, [("", {label: key}, value) for key, value in sorted(counts.items())])
+
+
+def cache_families(cache_name: str, stats: dict) -> list[MetricFamily]:
+    """
+    The hits / misses / evictions / size every cache's stats() reports
+    """
+    labels = {"cache": cache_name}
+    return [
+        MetricFamily("cache_hits_total", "counter", "Cache lookups that found an entry", [("", labels, stats["hits"])]),
+        MetricFamily("cache_misses_total", "counter", "Cache lookups that didn't", [("", labels, stats["misses"])]),
+        MetricFamily("cache_evictions_total", "counter", "Entries evicted to stay under max size",
+                     [("", labels, stats["evictions"])]),
+        gauge("cache_entries", "Entries currently cached", stats["size"], **labels),
+        gauge("cache_hit_ratio", "Hits / lookups since start", stats["hit_ratio"], **labels),
+    ]
+
+
+def render_metrics() -> str:
+    with _registry_lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+
+    # Several collectors can report the same family (one per cache) - merge them
+    families: dict[str, MetricFamily] = {}
+    for family in [m.collect() for m in metrics] + [f for collect in collectors for f in collect()]:
+        if family.name in families:
+            families[family.name].samples.extend(family.samples)
+        else:
+            families[family.name] = MetricFamily(family.name, family.kind, family.help, list(family.samples))
+
+    lines = []
+    for family in families.values():
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for suffix, labels, value in family.samples:
+            if value is None:
+                continue
+            lines.append(f"{family.name}{suffix}{_label_text(labels)} {float(value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = histogram("chat_stage_seconds", "Time spent in each stage of a chat request", ("stage",))
+REQUEST_SECONDS = histogram("http_request_duration_seconds",
+                            "Request latency (streams: until the response starts)", ("endpoint",))
+REQUESTS = counter("http_requests_total", "Requests served", ("endpoint", "status"))
+CHAT_ANSWERS = counter("chat_answers_total", "Chat answers by where they came from", ("source",))
+LOG_RECORDS_DROPPED = counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+def observe_request(endpoint: str, status: int, seconds: Optional[float]):
+    REQUESTS.inc(endpoint=endpoint, status=status)
+    if seconds is not None:
+        REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+
+
+# -------------------------
+# LOGGING
+# -------------------------
+_sampled: contextvars.ContextVar = contextvars.ContextVar("log_sampled", default=None)
+
+
+def start_request():
+    """
+    Decide once whether this request's below-WARNING records get written
+    """
+    _sampled.set(LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE)
+
+
+class RequestSampler(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        sampled = _sampled.get()
+        if sampled is None:  # outside a request (startup, background threads)
+            return True
+        return sampled
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread. Never blocks the caller: a full queue
+    drops the record. Threads don't survive fork(), so each process starts its own.
+    """
+
+    def __init__(self, target: logging.Handler, maxsize: int = LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.maxsize = maxsize
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # A queue inherited across fork() may have a lock held by the parent's writer
+                self.queue = queue.Queue(self.maxsize)
+                self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Same process, so the record can go as it is - the writer thread does the formatting
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def stop(self):
+        """
+        Write out whatever is still queued (registered with atexit)
+        """
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+
+_root_logger = logging.getLogger("nutrition")
+
+
+def _configure_logging():
+    target = logging.StreamHandler(sys.stdout)
+    target.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    handler = DroppingQueueHandler(target)
+    handler.addFilter(RequestSampler())
+    _root_logger.addHandler(handler)
+    _root_logger.setLevel(LOG_LEVEL)
+    _root_logger.propagate = False
+    atexit.register(handler.stop)
+
+
+_configure_logging()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    A logger under "nutrition" (e.g. get_logger("vrm") -> "nutrition.vrm")
+    """
+    return _root_logger.getChild(name)
@@ -0,0 +1,429 @@
+"""
+One way of calling the services we depend on (Groq, Pinecone, DeepSeek), so a
+slow or broken upstream can't hold a worker for tens of seconds:
+
+- pooled keep-alive HTTP clients, with the SDKs' own retries turned off
+- a deadline per call, covering every attempt
+- retries with jittered exponential backoff, for timeouts, dropped connections,
+  429s and 5xx only - anything else (a bug of ours) is raised as it is
+- hedging: if an attempt is still running after the upstream's recent p95
+  latency, a duplicate is sent and whichever answers first wins
+- a circuit breaker per upstream: after a run of failures calls fail fast with
+  CircuitOpenError for a while, and callers serve their fallback answers instead
+
+    groq = get_upstream("groq")
+    completion = groq.call(client.chat.completions.create, messages=..., model=...)
+    completion = await groq.acall(async_client.chat.completions.create, ...)
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+from config import (
+    UPSTREAM_BREAKER_FAILURES,
+    UPSTREAM_BREAKER_RESET_SECONDS,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_HEDGE,
+    UPSTREAM_HEDGE_MAX_RATIO,
+    UPSTREAM_HEDGE_MIN_SAMPLES,
+    UPSTREAM_HEDGE_PERCENTILE,
+    UPSTREAM_KEEPALIVE_CONNECTIONS,
+    UPSTREAM_MAX_CONNECTIONS,
+    UPSTREAM_RETRIES,
+    UPSTREAM_THREADS,
+    UPSTREAM_TIMEOUTS,
+)
+from telemetry import MetricFamily, gauge, get_logger, register_collector
+
+log = get_logger("upstream")
+
+
+class UpstreamError(Exception):
+    """
+    The upstream couldn't give us an answer in time - serve a fallback
+    """
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class DeadlineExceeded(UpstreamError):
+    pass
+
+
+# The SDKs' connection / timeout errors, by name so we don't have to import every SDK
+TRANSPORT_ERROR_NAMES = {"APIConnectionError", "APITimeoutError"}
+# Everything httpx and urllib3 (under the Pinecone SDK) raise is about the transport
+TRANSPORT_ERROR_MODULES = ("httpx", "urllib3")
+
+
+def response_status(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Timeouts, dropped connections, rate limits and server errors are worth
+    another try. Any other 4xx means the request itself is wrong, and anything
+    else (a TypeError from a bad kwarg...) is a bug of ours, not an outage.
+    """
+    status = response_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(error, (DeadlineExceeded, TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSPORT_ERROR_NAMES or cls.__module__.split(".")[0] in TRANSPORT_ERROR_MODULES
+               for cls in type(error).__mro__)
+
+
+def pooled_http_client(timeout: float, is_async: bool = False):
+    """
+    A keep-alive httpx client for the Groq / OpenAI SDKs (pass max_retries=0 too -
+    retrying is Upstream's job)
+    """
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=60.0,
+    )
+    timeouts = httpx.Timeout(timeout, connect=UPSTREAM_CONNECT_TIMEOUT)
+    client_class = httpx.AsyncClient if is_async else httpx.Client
+    return client_class(limits=limits, timeout=timeouts)
+
+
+class LatencyWindow:
+    """
+    The last few hundred successful call latencies, for the hedging delay
+    """
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` calls in a row fail; open -> half-open after
+    reset_seconds, which lets one trial call through; its result closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, failures: int = UPSTREAM_BREAKER_FAILURES,
+                 reset_seconds: float = UPSTREAM_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        return self.acquire() is not None
+
+    def acquire(self) -> Optional[str]:
+        """
+        "call" or "trial" (the one half-open call) if a call may go through, else None.
+        Whoever gets "trial" must end it with success(), failure() or end_trial().
+        """
+        with self._lock:
+            if self.state == "closed":
+                return "call"
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return "trial"
+            return None
+
+    def end_trial(self):
+        """
+        The trial call ended without telling us anything (cancelled, or our own bug) -
+        let the next call be the trial instead of short-circuiting forever
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._trial_running = False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failures:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class Upstream:
+    """
+    Deadline, retries, hedging and a circuit breaker around one upstream service.
+    call() is for blocking SDK calls, acall() for coroutines.
+    """
+
+    def __init__(self, name: str, timeout: float, retries: int = UPSTREAM_RETRIES,
+                 hedge: bool = UPSTREAM_HEDGE, hedge_percentile: float = UPSTREAM_HEDGE_PERCENTILE,
+                 hedge_min_samples: int = UPSTREAM_HEDGE_MIN_SAMPLES,
+                 hedge_max_ratio: float = UPSTREAM_HEDGE_MAX_RATIO,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyWindow()
+        self.counts = Counter()
+
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # Threads don't survive fork(), so prefork workers each start their own pool
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=UPSTREAM_THREADS,
+                                                thread_name_prefix=f"upstream-{self.name}")
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def hedge_delay(self, hedge: Optional[bool]) -> Optional[float]:
+        """
+        How long to wait before sending a duplicate, or None for no hedging
+        """
+        if not (self.hedge if hedge is None else hedge):
+            return None
+        if len(self.latency) < self.hedge_min_samples:
+            return None  # we don't know what "slow" is yet
+        # When everything is slow, duplicates just double the load - cap them
+        if self.counts["hedged"] > self.hedge_max_ratio * max(self.counts["calls"], 1):
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    def _backoff(self, attempt: int) -> float:
+        return min(2.0, 0.1 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _start(self, deadline_seconds: Optional[float]) -> tuple[float, bool]:
+        """
+        (deadline, whether this is the breaker's half-open trial call)
+        """
+        permit = self.breaker.acquire()
+        if permit is None:
+            self.counts["short_circuited"] += 1
+            raise CircuitOpenError(f"{self.name} is unhealthy, not calling it for now")
+        self.counts["calls"] += 1
+        return time.monotonic() + (deadline_seconds or self.timeout), permit == "trial"
+
+    def _failed(self, error: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """
+        The backoff before the next attempt, or None if we should give up
+        """
+        if not is_retryable(error):
+            if response_status(error) is not None:
+                # The upstream answered - it's healthy, our request was just wrong
+                self.breaker.success()
+            # Otherwise it's a bug of ours: it says nothing about the upstream
+            raise error
+        delay = self._backoff(attempt)
+        if attempt >= self.retries or time.monotonic() + delay >= deadline:
+            self.counts["failures"] += 1
+            self.breaker.failure()
+            if isinstance(error, UpstreamError):
+                raise error
+            raise UpstreamError(f"{self.name} call failed: {error}") from error
+        self.counts["retries"] += 1
+        log.info("↻ %s call failed (%s), retrying in %.2fs", self.name, error, delay)
+        return delay
+
+    def _succeeded(self, started: float):
+        self.latency.add(time.monotonic() - started)
+        self.breaker.success()
+
+    # -------------------------
+    # BLOCKING CALLS
+    # -------------------------
+    def call(self, fn: Callable, *args, timeout: Optional[float] = None, hedge: Optional[bool] = None, **kwargs):
+        """
+        fn(*args, **kwargs) within timeout seconds (the upstream's default if None).
+        Pass hedge=False for calls that mustn't run twice (e.g. streams).
+        """
+        deadline, trial = self._start(timeout)
+        attempt = 0
+        try:
+            while True:
+                try:
+                    return self._attempt(fn, args, kwargs, deadline, hedge)
+                except Exception as e:
+                    time.sleep(self._failed(e, attempt, deadline))
+                    attempt += 1
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    def _attempt(self, fn, args, kwargs, deadline, hedge):
+        pool = self._executor()
+        started = time.monotonic()
+        pending = {pool.submit(fn, *args, **kwargs)}
+
+        delay = self.hedge_delay(hedge)
+        if delay is not None and started + delay < deadline:
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                self.counts["hedged"] += 1
+                pending.add(pool.submit(fn, *args, **kwargs))
+
+        error = None
+        while pending:
+            # An abandoned attempt keeps its thread until the HTTP client's own timeout
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                self.counts["deadline_exceeded"] += 1
+                raise DeadlineExceeded(f"{self.name} didn't answer within the deadline")
+            for future in done:
+                if future.exception() is None:
+                    self._succeeded(started)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    # -------------------------
+    # ASYNC CALLS
+    # -------------------------
+    async def acall(self, fn: Callable, *args, timeout: Optional[float] = None,
+                    hedge: Optional[bool] = None, **kwargs):
+        """
+        await fn(*args, **kwargs), with the same deadline / retry / hedging rules as call()
+        """
+        deadline, trial = self._start(timeout)
+        attempt = 0
+        try:
+            while True:
+                try:
+                    return await self._aattempt(fn, args, kwargs, deadline, hedge)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await asyncio.sleep(self._failed(e, attempt, deadline))
+                    attempt += 1
+        finally:
+            # A cancelled trial (the client went away) mustn't leave the circuit stuck half-open
+            if trial:
+                self.breaker.end_trial()
+
+    async def _aattempt(self, fn, args, kwargs, deadline, hedge):
+        started = time.monotonic()
+        pending = {asyncio.ensure_future(fn(*args, **kwargs))}
+        try:
+            delay = self.hedge_delay(hedge)
+            if delay is not None and started + delay < deadline:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    self.counts["hedged"] += 1
+                    pending.add(asyncio.ensure_future(fn(*args, **kwargs)))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.counts["deadline_exceeded"] += 1
+                    raise DeadlineExceeded(f"{self.name} didn't answer within the deadline")
+                for task in done:
+                    if task.exception() is None:
+                        self._succeeded(started)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Unlike threads, the losing coroutines can actually be stopped
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        return {
+            "state": self.breaker.state,
+            "times_opened": self.breaker.times_opened,
+            "timeout": self.timeout,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            **{key: self.counts[key] for key in
+               ("calls", "retries", "hedged", "failures", "deadline_exceeded", "short_circuited")},
+        }
+
+
+# One Upstream per service per process, shared by every chat path
+_upstreams: dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name: str) -> Upstream:
+    with _upstreams_lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name, timeout=UPSTREAM_TIMEOUTS.get(name, 10.0))
+        return _upstreams[name]
+
+
+def upstream_stats() -> dict:
+    with _upstreams_lock:
+        return {name: upstream.stats() for name, upstream in _upstreams.items()}
+
+
+UPSTREAM_EVENTS = ("calls", "retries", "hedged", "failures", "deadline_exceeded", "short_circuited")
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def upstream_metrics() -> list[MetricFamily]:
+    with _upstreams_lock:
+        upstreams = list(_upstreams.values())
+    events = MetricFamily("upstream_events_total", "counter",
+                          "Upstream calls and what happened to them (retries, hedges, failures...)", [])
+    families = [events]
+    for upstream in upstreams:
+        for event in UPSTREAM_EVENTS:
+            events.samples.append(("", {"upstream": upstream.name, "event": event}, upstream.counts[event]))
+        families.append(gauge("upstream_circuit_state", "0 closed, 1 half-open, 2 open",
+                              BREAKER_STATES[upstream.breaker.state], upstream=upstream.name))
+        for quantile in (50, 95):
+            families.append(gauge("upstream_latency_seconds", "Recent successful call latency",
+                                  upstream.latency.percentile(quantile),
+                                  upstream=upstream.name, quantile=quantile / 100))
+    return families
+
+
+register_collector(upstream_metrics)
@@ -0,0 +1,220 @@
+import heapq
+import math
+import random
+
+import numpy as np
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """
+    L2-normalise vectors (one per row) so a dot product is the cosine similarity.
+    """
+    mat = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+class ExactIndex:
+    """
+    Brute-force cosine top-k over a NumPy matrix.
+    For a few thousand vectors this is one matmul and well under a millisecond.
+
+    Pass normalized=True for rows that are already unit-length float32 (like a
+    memory-mapped embedding artifact) and they are used in place, without a copy.
+    """
+
+    def __init__(self, vectors, normalized: bool = False):
+        self.vectors = np.asarray(vectors, dtype=np.float32) if normalized else normalize_rows(vectors)
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def search(self, query_vec, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (row indices, cosine scores), best match first.
+        """
+        scores = self.vectors @ normalize_rows(query_vec)[0]
+        return _top_k(np.arange(len(scores)), scores, top_k)
+
+    def search_rows(self, query_vec, rows, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        return search_rows(self.vectors, query_vec, rows, top_k)
+
+    def search_batch(self, query_vecs, top_k: int = 5) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        search() for many queries at once: one matrix product for all of them
+        """
+        queries = normalize_rows(query_vecs)
+        scores = queries @ self.vectors.T  # (queries, records)
+        top_k = min(top_k, scores.shape[1])
+        if top_k <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+
+        best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        return list(zip(best, best_scores))
+
+
+def _top_k(rows: np.ndarray, scores: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    # argpartition gets the top-k without sorting the whole corpus
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    best = best[np.argsort(-scores[best])]
+    return rows[best], scores[best]
+
+
+def search_rows(vectors: np.ndarray, query_vec, rows, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top-k over just these rows of unit-length vectors (e.g. the records a
+    metadata filter left) - cheaper than searching everything and throwing most away.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    return _top_k(rows, vectors[rows] @ normalize_rows(query_vec)[0], top_k)
+
+
+class HNSWIndex:
+    """
+    A small Hierarchical Navigable Small World graph (Malkov & Yashunin).
+
+    Approximate cosine top-k: each query only visits a few hundred nodes instead of
+    scoring the whole corpus, which is what we want once the dataset grows past
+    tens of thousands of records. Recall is tuned with ef_search.
+    """
+
+    def __init__(self, vectors, m: int = 16, ef_construction: int = 100,
+                 ef_search: int = 64, seed: int = 42):
+        self.vectors = normalize_rows(vectors)
+        self.m = m
+        self.m0 = 2 * m  # the bottom layer gets twice the links
+        self.ef_construction = max(ef_construction, m)
+        self.ef_search = ef_search
+        self._level_mult = 1.0 / math.log(max(m, 2))
+        self._rng = random.Random(seed)
+
+        # layers[l][node] -> list of neighbour node ids on layer l
+        self.layers: list[dict[int, list[int]]] = []
+        self.entry_point = None
+
+        for node in range(len(self.vectors)):
+            self._insert(node)
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    # -------------------------
+    # GRAPH CONSTRUCTION
+    # -------------------------
+    def _random_level(self) -> int:
+        return int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+
+    def _insert(self, node: int):
+        level = self._random_level()
+        if self.entry_point is None:
+            self.layers = [{node: []} for _ in range(level + 1)]
+            self.entry_point = node
+            return
+
+        query = self.vectors[node]
+        entry = [self.entry_point]
+        top_level = len(self.layers) - 1
+
+        # Greedy descent through the layers above the new node's level
+        for layer in range(top_level, level, -1):
+            entry = [self._search_layer(query, entry, 1, layer)[0][1]]
+
+        for layer in range(min(level, top_level), -1, -1):
+            candidates = self._search_layer(query, entry, self.ef_construction, layer)
+            max_links = self.m0 if layer == 0 else self.m
+            neighbours = [n for _, n in candidates[:max_links]]
+            self.layers[layer][node] = neighbours
+
+            for neighbour in neighbours:
+                links = self.layers[layer][neighbour]
+                links.append(node)
+                if len(links) > max_links:
+                    self._prune(neighbour, layer, max_links)
+
+            entry = [n for _, n in candidates]
+
+        # A new tallest node becomes the entry point for every search
+        for _ in range(top_level + 1, level + 1):
+            self.layers.append({node: []})
+        if level > top_level:
+            self.entry_point = node
+
+    def _prune(self, node: int, layer: int, max_links: int):
+        links = self.layers[layer][node]
+        sims = self.vectors[links] @ self.vectors[node]
+        keep = np.argsort(-sims)[:max_links]
+        self.layers[layer][node] = [links[i] for i in keep]
+
+    # -------------------------
+    # SEARCH
+    # -------------------------
+    def _search_layer(self, query, entry_points, ef: int, layer: int) -> list[tuple[float, int]]:
+        """
+        Best-first search on one layer.
+        Returns up to ef (similarity, node) pairs, most similar first.
+        """
+        graph = self.layers[layer]
+        visited = set(entry_points)
+        entry_sims = self.vectors[entry_points] @ query
+
+        # candidates is a max-heap on similarity, results a min-heap of the best ef
+        candidates = [(-float(s), n) for s, n in zip(entry_sims, entry_points)]
+        heapq.heapify(candidates)
+        results = [(float(s), n) for s, n in zip(entry_sims, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+
+            fresh = [n for n in graph.get(node, ()) if n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+
+            for sim, neighbour in zip(self.vectors[fresh] @ query, fresh):
+                sim = float(sim)
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, neighbour))
+                    heapq.heappush(results, (sim, neighbour))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def search(self, query_vec, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (row indices, cosine scores), best match first.
+        """
+        if self.entry_point is None or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = normalize_rows(query_vec)[0]
+        entry = [self.entry_point]
+        for layer in range(len(self.layers) - 1, 0, -1):
+            entry = [self._search_layer(query, entry, 1, layer)[0][1]]
+
+        found = self._search_layer(query, entry, max(self.ef_search, top_k), 0)[:top_k]
+        indices = np.array([n for _, n in found], dtype=np.int64)
+        scores = np.array([s for s, _ in found], dtype=np.float32)
+        return indices, scores
+
+    def search_batch(self, query_vecs, top_k: int = 5) -> list[tuple[np.ndarray, np.ndarray]]:
+        # Graph walks don't share work between queries - one at a time
+        return [self.search(query, top_k) for query in normalize_rows(query_vecs)]
+
+    def search_rows(self, query_vec, rows, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        # A filtered candidate set is small - scoring it exactly beats walking the graph
+        return search_rows(self.vectors, query_vec, rows, top_k)
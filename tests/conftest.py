@@ -0,0 +1,52 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The shared modules are imported flat, the way the apps import them
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "nutrition_bot")))
+
+from config import EMBEDDING_MODEL_NAME  # noqa: E402
+
+OTHER_MODEL = "all-MiniLM-L6-v2"
+# Small stand-ins for bge-large (1024-d) and MiniLM (384-d): different sizes on purpose
+DIMENSIONS = {EMBEDDING_MODEL_NAME: 16, OTHER_MODEL: 8}
+
+
+class HashEncoder:
+    """
+    SentenceTransformer's encode() with deterministic bag-of-words vectors
+    """
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+
+    def _one(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimension] += 1
+        return vector
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self._one(texts)
+        return np.array([self._one(text) for text in texts])
+
+
+@pytest.fixture
+def hash_encoders(monkeypatch, tmp_path):
+    """
+    load_encoder() hands out HashEncoders, and artifacts go to an empty temp directory
+    """
+    import embedding_artifact
+    import encoders
+
+    root = str(tmp_path / "embeddings")
+    monkeypatch.setattr(embedding_artifact, "EMBEDDING_ARTIFACT_DIR", root)
+    monkeypatch.setattr(encoders, "load_encoder",
+                        lambda name, engine=None, sidecar="": HashEncoder(DIMENSIONS[name]))
+    embedding_artifact._load_once.cache_clear()
+    yield root
+    embedding_artifact._load_once.cache_clear()
@@ -0,0 +1,42 @@
+import json
+
+import numpy as np
+import pytest
+
+from answer_store import load_answer_store, write_answer_store
+from dataset import dataset_version
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    data = tmp_path / "other_dataset.json"
+    data.write_text(json.dumps([{"id": "rec-1", "myth": "Eggs raise cholesterol"}]))
+    answers = [{"record": "rec-1", "context": 0, "type": "myth", "answer": "Not much.", "myTake": "Eggs are fine!"}]
+    questions = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float32)
+    manifest = write_answer_store(str(tmp_path / "store"), ["vegan"], answers, [0, 0], questions,
+                                  "prompt-1", model_name="test-model", data_path=str(data))
+    return str(tmp_path / "store"), manifest, dataset_version(str(data))
+
+
+def test_manifest_is_versioned_by_the_dataset_it_was_built_from(store_dir):
+    _, manifest, version = store_dir
+    assert manifest["dataset_version"] == version
+
+
+def test_store_is_only_served_when_everything_matches(store_dir):
+    directory, _, version = store_dir
+    assert load_answer_store("prompt-1", directory, "test-model", version) is not None
+    assert load_answer_store("prompt-2", directory, "test-model", version) is None
+    assert load_answer_store("prompt-1", directory, "other-model", version) is None
+    assert load_answer_store("prompt-1", directory, "test-model", "0123456789ab") is None
+
+
+def test_lookup_needs_a_close_enough_question(store_dir):
+    directory, _, version = store_dir
+    store = load_answer_store("prompt-1", directory, "test-model", version)
+    store.min_similarity = 0.9
+
+    assert store.lookup("rec-1", "vegan", [0.0, 1.0, 0.05])["myTake"] == "Eggs are fine!"
+    assert store.lookup("rec-1", "vegan", [0.0, 0.0, 1.0]) is None
+    assert store.lookup("rec-1", "diabetic", [1.0, 0.0, 0.0]) is None
+    assert (store.hits, store.misses, store.too_far) == (1, 2, 1)
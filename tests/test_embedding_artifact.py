@@ -0,0 +1,29 @@
+import pytest
+
+import embedding_artifact
+from config import EMBEDDING_MODEL_NAME
+from conftest import DIMENSIONS, OTHER_MODEL, HashEncoder
+from retrieval import make_retriever
+
+
+def test_each_model_gets_its_own_artifact_directory(hash_encoders):
+    assert embedding_artifact.artifact_dir() == hash_encoders
+    assert embedding_artifact.artifact_dir(OTHER_MODEL) != hash_encoders
+    assert embedding_artifact.artifact_dir(OTHER_MODEL).startswith(hash_encoders)
+
+
+def test_retriever_uses_the_queries_model_not_the_main_artifact(hash_encoders):
+    embedding_artifact.build_artifact(embedding_artifact.artifact_dir(), EMBEDDING_MODEL_NAME, "torch")
+    other = HashEncoder(DIMENSIONS[OTHER_MODEL])
+
+    retriever = make_retriever(other.encode, pinecone_index_factory=None, backend="local",
+                               model_name=OTHER_MODEL, sidecar="")
+    matches = retriever.query(other.encode("are eggs bad for cholesterol"), top_k=3)
+    assert len(matches) == 3
+
+    # With its own artifact built, that's what gets used
+    embedding_artifact.build_artifact(embedding_artifact.artifact_dir(OTHER_MODEL), OTHER_MODEL, "torch")
+    embedding_artifact._load_once.cache_clear()
+    retriever = make_retriever(lambda texts: pytest.fail("should use the artifact"), pinecone_index_factory=None,
+                               backend="local", model_name=OTHER_MODEL, sidecar="")
+    assert retriever.query(other.encode("are eggs bad for cholesterol"), top_k=3)[0].id == matches[0].id
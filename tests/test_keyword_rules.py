@@ -0,0 +1,32 @@
+import pytest
+
+from keyword_rules import KeywordRules
+
+RULES = KeywordRules.from_file()
+
+PREFIXES = ["", "I'm vegan. ", "Vegan. I want to lose weight. ", "I am pregnant and keto. ", "I want to lose "]
+MESSAGES = [
+    "is protein good",
+    "should i eat rice at night",
+    "weight fast - does fasting help?",
+    "blood sugar and fruit juice",
+    "What about CHEESE on a low carb diet",
+]
+
+
+@pytest.mark.parametrize("prefix", PREFIXES)
+@pytest.mark.parametrize("message", MESSAGES)
+def test_resumed_scan_matches_scanning_the_whole_text(prefix, message):
+    assert RULES.analyze(message, resume=RULES.scan(prefix)) == RULES.analyze(prefix + message)
+
+
+def test_keyword_across_the_seam_is_found():
+    # "lose" + "weight" only matches "lose weight" once both halves are in
+    analysis = RULES.analyze("weight by summer", resume=RULES.scan("I want to lose "))
+    assert "User wants to lose weight" in analysis.goals
+
+
+def test_context_groups_take_the_first_rule_in_group_order():
+    analysis = RULES.analyze("I'm vegan and diabetic, I want to build muscle")
+    assert analysis.context == "User wants to gain muscle. User is vegan. User has diabetes concerns."
+    assert not analysis.is_general
@@ -0,0 +1,62 @@
+import pytest
+
+from metadata_index import MetadataIndex
+
+RECORDS = [
+    {"id": "r0", "category": "eggs_and_cholesterol", "tags": ["Eggs", "heart"], "myth": "m", "fact": "f"},
+    {"id": "r1", "category": "carbs", "tags": ["rice", "weight loss"], "myth": "m"},
+    {"id": "r2", "category": "carbs", "tags": ["bread"], "fact": "f"},
+    {"id": "r3", "category": "dairy_and_bones", "tags": ["milk"]},
+]
+
+
+@pytest.fixture
+def index():
+    return MetadataIndex([r["id"] for r in RECORDS], RECORDS)
+
+
+def ids(index, bitmap):
+    return [index.ids[row] for row in index.rows(bitmap)]
+
+
+def test_filters_are_normalised_like_the_records():
+    assert MetadataIndex.clauses({"food": {"$in": ["Eggs", "EGG"]}, "chunk_type": "myth", "tags": {"$eq": ""}}) == \
+        {"food": ["egg"], "chunk_type": ["myth"]}
+
+
+def test_exact_plan_ands_fields_and_ors_values(index):
+    plan = index.plan({"food": {"$in": ["rice", "bread", "milk"]}, "category": "carbs"})
+    assert ids(index, plan.bitmap) == ["r1", "r2"]
+    assert plan.count == 2 and plan.selectivity == 0.5 and plan.relaxed == ()
+
+    # Derived facets: category words are food, records without myth/fact are "info"
+    assert ids(index, index.plan({"food": "bones"}).bitmap) == ["r3"]
+    assert ids(index, index.plan({"chunk_type": "info"}).bitmap) == ["r3"]
+    assert ids(index, index.plan({"chunk_type": "myth"}).bitmap) == ["r0", "r1"]
+
+
+def test_plan_relaxes_until_there_are_candidates(index):
+    plan = index.plan({"food": "white rice"})
+    assert ids(index, plan.bitmap) == ["r1"] and plan.relaxed == ("partial_values",)
+
+    plan = index.plan({"food": "bread", "chunk_type": "myth"})
+    assert ids(index, plan.bitmap) == ["r2"] and plan.relaxed == ("drop:chunk_type",)
+
+    plan = index.plan({"food": "quinoa"})
+    assert plan.unrestricted and plan.count == len(RECORDS) and plan.relaxed == ("drop:food",)
+
+
+def test_pinecone_query_uses_stored_fields_and_makes_room_for_the_rest(index):
+    plan = index.plan({"food": "carbs", "chunk_type": "myth"})
+    assert ids(index, plan.bitmap) == ["r1"]
+    pine_filter, top_k = index.pinecone_query(plan, top_k=3)
+    # chunk_type isn't stored remotely - only half the carbs records are myths
+    assert pine_filter == {"category": {"$in": ["carbs"]}}
+    assert top_k == 2
+    assert index.allows(plan, "r1") and not index.allows(plan, "r2")
+    assert index.allows(plan, "not-in-our-copy")
+
+
+def test_unrestricted_plan_needs_no_filter(index):
+    plan = index.plan(None)
+    assert plan.unrestricted and index.pinecone_query(plan, top_k=5) == (None, 5)
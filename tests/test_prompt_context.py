@@ -0,0 +1,33 @@
+from prompt_context import ContextBuilder
+from retrieval import reciprocal_rank_fusion
+
+
+FOODS = {"a": "eggs", "b": "rice", "c": "bread", "d": "milk", "e": "butter",
+         "x": "salmon", "y": "spinach", "z": "coffee", "w": "oats"}
+
+
+def chunk(doc_id, score):
+    food = FOODS[doc_id]
+    return {"id": doc_id, "score": score, "text": f"All about {food}", "myth": f"{food} are unhealthy",
+            "fact": f"{food} are fine in moderation", "explanation": ""}
+
+
+def test_rrf_scores_are_not_cut_relative_to_the_best():
+    # Dense a,b,c,d,e and lexical x,y,a,z,w: only "a" is in both lists
+    fused = reciprocal_rank_fusion([list("abcde"), list("xyazw")])[:5]
+    chunks = [chunk(doc_id, score) for doc_id, score in fused]
+
+    selected = ContextBuilder(rank_fused=True).select(chunks)
+    assert [c["id"] for c in selected] == [doc_id for doc_id, _ in fused]
+    assert "b" in [c["id"] for c in selected]
+
+
+def test_cosine_scores_drop_chunks_far_below_the_best():
+    chunks = [chunk("a", 0.9), chunk("b", 0.6), chunk("c", 0.3)]
+    selected = ContextBuilder(min_relative_score=0.5, rank_fused=False).select(chunks)
+    assert [c["id"] for c in selected] == ["a", "b"]
+
+
+def test_duplicates_are_dropped_either_way():
+    same = [chunk("a", 0.9), {**chunk("a", 0.8), "id": "a2"}, chunk("b", 0.7)]
+    assert [c["id"] for c in ContextBuilder(rank_fused=True).select(same)] == ["a", "b"]
@@ -0,0 +1,16 @@
+import numpy as np
+
+from response_cache import SemanticResponseCache
+
+
+def test_myTake_variants_are_cached_apart():
+    cache = SemanticResponseCache(threshold=0.9, max_entries=10, ttl_seconds=60)
+    vector = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    from_sources = cache.partition_key("vegan", "v1", "source")
+    cache.store(vector, from_sources, {"answer": "a", "type": "myth", "myTake": "from the source"})
+
+    assert cache.lookup(vector, cache.partition_key("vegan", "v1")) is None
+    assert cache.lookup(vector, from_sources)["myTake"] == "from the source"
+
+    # Re-uploading the dataset still drops every variant
+    assert cache.invalidate(keep_dataset_version="v2") == 1
@@ -0,0 +1,87 @@
+import struct
+import threading
+
+import numpy as np
+import pytest
+
+import retrieval_sidecar
+from config import EMBEDDING_MODEL_NAME
+from conftest import DIMENSIONS, OTHER_MODEL
+from retrieval_sidecar import (Reader, RetrievalSidecar, SidecarClient, SidecarEncoder, SidecarError,
+                               SidecarRetriever, SidecarServer, Writer)
+
+
+def body(writer):
+    # A frame minus its length prefix, as read_message() returns it
+    frame = writer.frame()
+    assert struct.unpack("<I", frame[:4])[0] == len(frame) - 4
+    return frame[4:]
+
+
+def test_writer_reader_round_trip():
+    matrix = np.arange(6, dtype=np.float32).reshape(2, 3) / 7
+    writer = Writer().pack("BB", 2, 1).str16("bge 🥚").str32("Is rice bad? " * 100).matrix(matrix).pack("fi", 0.5, -1)
+
+    reader = Reader(body(writer))
+    assert reader.unpack("BB") == (2, 1)
+    assert reader.str16() == "bge 🥚"
+    assert reader.str32() == "Is rice bad? " * 100
+    np.testing.assert_array_equal(reader.matrix(), matrix)
+    assert reader.unpack("fi") == (0.5, -1)
+
+
+def test_single_vector_is_sent_as_one_row():
+    reader = Reader(body(Writer().matrix([0.25, 0.5])))
+    assert reader.matrix().shape == (1, 2)
+
+
+def test_truncated_message_is_refused():
+    data = body(Writer().str32("a long enough string"))
+    with pytest.raises(ValueError):
+        Reader(data[:-3]).str32()
+
+
+@pytest.fixture
+def sidecar(hash_encoders, monkeypatch, tmp_path):
+    monkeypatch.setattr(retrieval_sidecar, "RETRIEVAL_BACKEND", "local")
+    path = str(tmp_path / "sidecar.sock")
+    server = SidecarServer(path, RetrievalSidecar([EMBEDDING_MODEL_NAME, OTHER_MODEL]))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield SidecarClient(path, timeout=5.0)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("model_name", [EMBEDDING_MODEL_NAME, OTHER_MODEL])
+def test_embed_and_search_through_the_socket(sidecar, model_name):
+    encoder = SidecarEncoder(model_name, client=sidecar)
+    assert encoder.encode("are eggs bad for cholesterol").shape == (DIMENSIONS[model_name],)
+    vectors = encoder.encode(["are eggs bad for cholesterol", "is rice at night bad"])
+    assert vectors.shape == (2, DIMENSIONS[model_name])
+
+    retriever = SidecarRetriever("nutrition-myths", "default", model_name, client=sidecar)
+    assert retriever.searches_rows and retriever.ids
+
+    matches = retriever.query(vectors[0], top_k=3)
+    assert len(matches) == 3
+    assert matches[0].metadata == retriever.metadata[retriever.ids.index(matches[0].id)]
+    assert [m.id for m in retriever.query_batch(vectors, top_k=3)[0]] == [m.id for m in matches]
+
+    # Restricted to two records, only those come back
+    rows = [5, 7]
+    assert {m.id for m in retriever.query(vectors[0], top_k=3, rows=rows)} == {retriever.ids[r] for r in rows}
+
+
+def test_vectors_from_another_model_are_refused_clearly(sidecar):
+    minilm_vector = SidecarEncoder(OTHER_MODEL, client=sidecar).encode("are eggs bad")
+    retriever = SidecarRetriever("nutrition-myths", "default", EMBEDDING_MODEL_NAME, client=sidecar)
+    with pytest.raises(SidecarError, match="embed them with"):
+        retriever.query(minilm_vector, top_k=3)
+
+
+def test_unknown_model_is_an_error_not_a_dropped_connection(sidecar):
+    with pytest.raises(SidecarError, match="isn't served here"):
+        sidecar.embed("nope", ["x"])
+    # The connection is still usable afterwards
+    assert sidecar.embed(OTHER_MODEL, ["x"]).shape == (1, DIMENSIONS[OTHER_MODEL])
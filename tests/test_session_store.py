@@ -0,0 +1,57 @@
+import session_store
+from session_store import (FORKED_WORKERS_ENV, MemorySessionStore, Session, SQLiteSessionStore, load_session,
+                           make_session_store, save_session)
+
+
+def test_auto_backend_is_shared_when_forking_several_workers(monkeypatch, tmp_path):
+    monkeypatch.setattr(session_store, "SESSION_DB_PATH", str(tmp_path / "sessions.sqlite3"))
+    monkeypatch.delenv(FORKED_WORKERS_ENV, raising=False)
+    assert isinstance(make_session_store("auto"), MemorySessionStore)
+    monkeypatch.setenv(FORKED_WORKERS_ENV, "4")
+    assert session_store.resolve_backend("auto") == "sqlite"
+    assert session_store.resolve_backend("memory") == "memory"
+
+
+def test_sqlite_sessions_survive_a_second_store(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    session = Session("abcdefgh12345678", ("I'm vegan",), "User is vegan.", turns=2)
+    SQLiteSessionStore(path).save(session)
+
+    # Another worker has its own store object on the same file
+    loaded = load_session(SQLiteSessionStore(path), session.id)
+    assert loaded.preferences == ("I'm vegan",)
+    assert loaded.context == "User is vegan."
+    assert not loaded.is_new
+
+
+def test_unknown_or_malformed_ids_get_a_fresh_session():
+    store = MemorySessionStore()
+    assert load_session(store, "../etc/passwd").is_new
+    assert load_session(store, "abcdefgh12345678").is_new
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_entries=2)
+    for session_id in ("aaaaaaaa", "bbbbbbbb", "cccccccc"):
+        store.save(Session(session_id))
+    assert store.get("aaaaaaaa") is None
+    assert store.get("cccccccc") is not None
+    assert store.stats()["evictions"] == 1
+
+
+def test_turn_without_an_id_or_preferences_stores_nothing():
+    store = MemorySessionStore()
+    session = load_session(store, None)
+    session.turns += 1
+    assert not save_session(store, session)
+    assert store.get(session.id) is None and store.stats()["size"] == 0
+
+    # Once they pick something, it's worth keeping
+    session.add_preference("I'm vegan")
+    assert save_session(store, session)
+    assert store.get(session.id).preferences == ("I'm vegan",)
+
+    # ...and so is a stored session, even one whose preferences were cleared
+    stored = load_session(store, session.id)
+    stored.set_preferences([])
+    assert save_session(store, stored)
@@ -0,0 +1,134 @@
+import asyncio
+
+import httpx
+import pytest
+
+from upstream import CircuitBreaker, CircuitOpenError, DeadlineExceeded, Upstream, UpstreamError, is_retryable
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def make_upstream(failures=2, retries=1):
+    return Upstream("test", timeout=5.0, retries=retries, hedge=False,
+                    breaker=CircuitBreaker(failures=failures, reset_seconds=0.0))
+
+
+def open_circuit(upstream):
+    def down():
+        raise ConnectionError("refused")
+
+    for _ in range(upstream.breaker.failures):
+        with pytest.raises(UpstreamError):
+            upstream.call(down)
+    assert upstream.breaker.state == "open"
+
+
+def test_transport_timeouts_and_server_errors_are_retryable():
+    assert is_retryable(ConnectionError("reset"))
+    assert is_retryable(TimeoutError())
+    assert is_retryable(DeadlineExceeded("slow"))
+    assert is_retryable(httpx.ConnectTimeout("connect"))
+    assert is_retryable(StatusError(429))
+    assert is_retryable(StatusError(503))
+
+
+def test_client_errors_and_bugs_are_not_retryable():
+    assert not is_retryable(StatusError(400))
+    assert not is_retryable(TypeError("unexpected keyword argument"))
+    assert not is_retryable(KeyError("choices"))
+
+
+def test_bug_propagates_unchanged_without_retries_or_breaker_failure():
+    upstream = make_upstream(failures=1, retries=3)
+    calls = []
+
+    def buggy(**kwargs):
+        calls.append(kwargs)
+        raise TypeError("unexpected keyword argument 'modle'")
+
+    with pytest.raises(TypeError):
+        upstream.call(buggy, modle="x")
+    assert len(calls) == 1
+    assert upstream.breaker.state == "closed"
+    assert upstream.breaker.consecutive_failures == 0
+    assert upstream.counts["failures"] == 0
+
+
+def test_client_error_is_not_retried_and_keeps_circuit_closed():
+    upstream = make_upstream(failures=1, retries=3)
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise StatusError(400)
+
+    with pytest.raises(StatusError):
+        upstream.call(bad_request)
+    assert len(calls) == 1
+    assert upstream.breaker.state == "closed"
+
+
+def test_transport_errors_are_retried_then_open_the_circuit():
+    upstream = make_upstream(failures=1, retries=2)
+    calls = []
+
+    def down():
+        calls.append(1)
+        raise ConnectionError("refused")
+
+    with pytest.raises(UpstreamError):
+        upstream.call(down)
+    assert len(calls) == 3
+    assert upstream.breaker.state == "open"
+
+
+def test_open_circuit_short_circuits_until_a_trial_succeeds():
+    upstream = make_upstream()
+    upstream.breaker.reset_seconds = 60.0
+    open_circuit(upstream)
+    with pytest.raises(CircuitOpenError):
+        upstream.call(lambda: "ok")
+
+    upstream.breaker.reset_seconds = 0.0
+    assert upstream.call(lambda: "ok") == "ok"
+    assert upstream.breaker.state == "closed"
+
+
+def test_cancelled_async_trial_does_not_leave_circuit_stuck():
+    upstream = make_upstream()
+    open_circuit(upstream)
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def healthy():
+        return "ok"
+
+    async def scenario():
+        trial = asyncio.create_task(upstream.acall(slow))
+        await asyncio.sleep(0.01)
+        assert upstream.breaker.state == "half_open"
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        return [await upstream.acall(healthy) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == ["ok", "ok", "ok"]
+    assert upstream.breaker.state == "closed"
+
+
+def test_trial_that_hits_a_bug_lets_the_next_call_through():
+    upstream = make_upstream()
+    open_circuit(upstream)
+
+    def buggy():
+        raise TypeError("bug")
+
+    with pytest.raises(TypeError):
+        upstream.call(buggy)
+    assert upstream.call(lambda: "ok") == "ok"
+    assert upstream.breaker.state == "closed"
@@ -1,60 +1,287 @@
+"""
+Incremental upload of the myths dataset to Pinecone.
+
+Records are streamed from the dataset (JSON array or JSON Lines), each one gets a
+content hash, and a local manifest remembers what the index already has. Only
+new and changed records are upserted and records that disappeared are deleted,
+so re-running after editing one myth sends one record, not all of them.
+
+Batches go out concurrently (bounded), with retries and exponential backoff.
+
+    PINECONE_API_KEY=... python upload_to_pinecone.py
+    python upload_to_pinecone.py --dry-run          # just show what would change
+    python upload_to_pinecone.py --full             # ignore the manifest, re-send everything
+    python upload_to_pinecone.py --data big.jsonl --workers 8
+"""
+import argparse
+import hashlib
 import json
-from pinecone import Pinecone
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-# ========= CONFIG =========
-PINECONE_API_KEY = "pcsk_7RiVsb_EHC6WWgemh8MLnFaLzQMALcnF92RbPoCPNJAgbFRb648MqtWPvTRg31VcpXSa68"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrition_bot"))
+
+from config import DATASET_PATH  # noqa: E402
+from dataset import iter_records, record_metadata  # noqa: E402
 
-# copy EXACTLY from the Pinecone UI (what you sent me)
-INDEX_HOST = "https://nutrition-myths-386z0ub.svc.aped-4627-b74a.pinecone.io"
+# ========= CONFIG =========
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 
-JSON_PATH = "nutrition_bot/nutrition_myths_dataset.json"
+# copy EXACTLY from the Pinecone UI
+INDEX_HOST = os.getenv("PINECONE_INDEX_HOST", "https://nutrition-myths-386z0ub.svc.aped-4627-b74a.pinecone.io")
 NAMESPACE = "default"
 
-# If your field map during index creation is NOT 'text',
-# change this to that name (e.g. "chunk_text").
+# The field Pinecone's integrated embedding reads (record_metadata puts the
+# Myth/Fact/Explanation text there). Change it if the index's field map differs.
 EMBED_FIELD = "chunk_text"
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pinecone_manifest.json")
+BATCH_SIZE = 50
+WORKERS = 4
+MAX_RETRIES = 5
 # ==========================
 
-# 1. Init Pinecone client and index
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(host=INDEX_HOST)
-
-# 2. Load our myths dataset
-with open(JSON_PATH, "r", encoding="utf-8") as f:
-    data = json.load(f)
-
-records = []
-
-for item in data:
-    combined_text = (
-        f"Myth: {item['myth']}\n"
-        f"Fact: {item['fact']}\n"
-        f"Explanation: {item['explanation']}"
-    )
-
-    record = {
-        "_id": item["id"],               # record id
-        EMBED_FIELD: combined_text,      # this is what gets embedded
-        # metadata we can use later
-        "myth": item["myth"],
-        "fact": item["fact"],
-        "explanation": item["explanation"],
-        "category": item.get("category"),
-        "tags": item.get("tags"),
-        "source_title": item.get("source_title"),
-        "source_url": item.get("source_url"),
-        "source_type": item.get("source_type"),
-        "year": item.get("year"),
+
+def build_record(item: dict) -> dict:
+    record = {"_id": item["id"], **record_metadata(item)}
+    if EMBED_FIELD != "chunk_text":
+        record[EMBED_FIELD] = record.pop("chunk_text")
+    return record
+
+
+def content_hash(record: dict) -> str:
+    """
+    Hash of exactly what we send, so a change to the record *or* to how we build
+    records (record_text, metadata fields) both count as "changed"
+    """
+    canonical = json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# -------------------------
+# MANIFEST
+# -------------------------
+def load_manifest(path: str, index_host: str, namespace: str) -> dict:
+    """
+    {record id: content hash} for what this index + namespace already holds
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("index_host") != index_host or manifest.get("namespace") != namespace:
+        print(f"⚠️ Manifest {path} is for a different index/namespace - treating everything as new")
+        return {}
+    return manifest.get("records", {})
+
+
+def save_manifest(path: str, index_host: str, namespace: str, records: dict):
+    # Write-then-rename, so a crash never leaves a half-written manifest behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "index_host": index_host,
+            "namespace": namespace,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "records": records,
+        }, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# -------------------------
+# UPLOADING
+# -------------------------
+class Uploader:
+    """
+    Sends batches with bounded concurrency and retries, and keeps the manifest
+    in step with what actually made it to Pinecone.
+    """
+
+    def __init__(self, index, namespace: str, manifest: dict, workers: int = WORKERS,
+                 max_retries: int = MAX_RETRIES, dry_run: bool = False):
+        self.index = index
+        self.namespace = namespace
+        self.manifest = manifest
+        self.max_retries = max_retries
+        self.dry_run = dry_run
+        self.workers = workers
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upsert")
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+        self.upserted = 0
+        self.deleted = 0
+        self.retries = 0
+        self.failed_batches = 0
+
+    def _with_retries(self, what: str, call):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call()
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                # Exponential backoff with jitter, so parallel workers don't retry in lockstep
+                delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                with self._lock:
+                    self.retries += 1
+                print(f"↻ {what} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _upsert(self, batch: list[tuple[dict, str]]):
+        records = [record for record, _ in batch]
+        if not self.dry_run:
+            self._with_retries(f"upsert of {len(records)} records",
+                               lambda: self.index.upsert_records(self.namespace, records))
+        with self._lock:
+            for record, digest in batch:
+                self.manifest[record["_id"]] = digest
+            self.upserted += len(batch)
+
+    def _delete(self, ids: list[str]):
+        if not self.dry_run:
+            self._with_retries(f"delete of {len(ids)} records",
+                               lambda: self.index.delete(ids=ids, namespace=self.namespace))
+        with self._lock:
+            for record_id in ids:
+                self.manifest.pop(record_id, None)
+            self.deleted += len(ids)
+
+    def submit(self, fn, items):
+        # Never hold more than 2x workers batches in memory: wait for one to finish
+        while len(self._in_flight) >= self.workers * 2:
+            self._reap(wait(self._in_flight, return_when=FIRST_COMPLETED).done)
+        self._in_flight.add(self._pool.submit(fn, items))
+
+    def _reap(self, futures):
+        for future in futures:
+            self._in_flight.discard(future)
+            try:
+                future.result()
+            except Exception as e:
+                self.failed_batches += 1
+                print(f"❌ Batch failed for good: {e}")
+
+    def upsert(self, batch):
+        self.submit(self._upsert, batch)
+
+    def delete(self, ids):
+        self.submit(self._delete, ids)
+
+    def manifest_snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.manifest)
+
+    def finish(self):
+        self._reap(wait(self._in_flight).done)
+        self._pool.shutdown()
+
+
+def sync(data_path: str, index, namespace: str, manifest_path: str, index_host: str,
+         batch_size: int = BATCH_SIZE, workers: int = WORKERS, full: bool = False,
+         dry_run: bool = False) -> dict:
+    """
+    Brings the index in line with the dataset and returns a summary
+    """
+    manifest = load_manifest(manifest_path, index_host, namespace)
+    # --full re-sends every record, but still cleans up ones that were removed
+    known = {} if full else manifest
+    previous_ids = set(manifest)
+    uploader = Uploader(index, namespace, dict(manifest), workers=workers, dry_run=dry_run)
+
+    started = time.perf_counter()
+    seen, unchanged, batch = set(), 0, []
+    last_saved = time.monotonic()
+
+    for item in iter_records(data_path):
+        record = build_record(item)
+        record_id = record["_id"]
+        if record_id in seen:
+            print(f"⚠️ Duplicate id {record_id} - the later record wins")
+        seen.add(record_id)
+
+        digest = content_hash(record)
+        if known.get(record_id) == digest:
+            unchanged += 1
+            continue
+
+        batch.append((record, digest))
+        if len(batch) >= batch_size:
+            uploader.upsert(batch)
+            batch = []
+
+        # Checkpoint now and then, so an interrupted run resumes where it stopped
+        if not dry_run and time.monotonic() - last_saved > 10:
+            save_manifest(manifest_path, index_host, namespace, uploader.manifest_snapshot())
+            last_saved = time.monotonic()
+
+    if batch:
+        uploader.upsert(batch)
+
+    # Whatever the index had that the dataset no longer has
+    removed = sorted(previous_ids - seen)
+    for i in range(0, len(removed), 1000):
+        uploader.delete(removed[i:i + 1000])
+
+    uploader.finish()
+    elapsed = time.perf_counter() - started
+
+    if not dry_run:
+        save_manifest(manifest_path, index_host, namespace, uploader.manifest)
+
+    return {
+        "records": len(seen),
+        "unchanged": unchanged,
+        "upserted": uploader.upserted,
+        "deleted": uploader.deleted,
+        "retries": uploader.retries,
+        "failed_batches": uploader.failed_batches,
+        "seconds": round(elapsed, 2),
+        "records_per_second": round(len(seen) / elapsed, 1) if elapsed else 0.0,
+        "upserts_per_second": round(uploader.upserted / elapsed, 1) if elapsed else 0.0,
+        "dry_run": dry_run,
     }
 
-    records.append(record)
 
-# 3. Upload in batches
-BATCH_SIZE = 50
+def main():
+    parser = argparse.ArgumentParser(description="Upload new/changed myths to Pinecone")
+    parser.add_argument("--data", default=DATASET_PATH, help="JSON array or .jsonl file")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--index-host", default=INDEX_HOST)
+    parser.add_argument("--namespace", default=NAMESPACE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and re-upload everything")
+    parser.add_argument("--dry-run", action="store_true", help="report the diff without touching Pinecone")
+    args = parser.parse_args()
+
+    index = None  # a dry run only computes the diff
+    if not args.dry_run:
+        if not PINECONE_API_KEY:
+            sys.exit("Set PINECONE_API_KEY first")
+        from pinecone import Pinecone
+        index = Pinecone(api_key=PINECONE_API_KEY).Index(host=args.index_host)
+
+    summary = sync(args.data, index, args.namespace, args.manifest, args.index_host,
+                   batch_size=args.batch_size, workers=args.workers,
+                   full=args.full, dry_run=args.dry_run)
+    print(json.dumps(summary, indent=2))
+
+    if summary["failed_batches"]:
+        print("❌ Some batches failed - re-run to retry just those records")
+        sys.exit(1)
+    if args.dry_run:
+        print(f"🔎 Dry run – {summary['upserted']} to upsert, {summary['deleted']} to delete, "
+              f"{summary['unchanged']} already up to date")
+        return
+    print(f"✅ DONE – {summary['upserted']} upserted, {summary['deleted']} deleted, "
+          f"{summary['unchanged']} already up to date")
 
-for i in range(0, len(records), BATCH_SIZE):
-    batch = records[i : i + BATCH_SIZE]
-    index.upsert_records(NAMESPACE, batch)
-    print(f"Uploaded {i + len(batch)}/{len(records)}")
 
-print("✅ DONE – all myths uploaded to Pinecone!")
+if __name__ == "__main__":
+    main()
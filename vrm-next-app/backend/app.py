@@ -1,32 +1,151 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from pinecone import Pinecone
-from dotenv import load_dotenv
-from groq import Groq
-from sentence_transformers import SentenceTransformer
+import hashlib
 import os
 import sys
-import re
-from difflib import get_close_matches
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import NamedTuple
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Shared retrieval helpers live with the original nutrition bot
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "nutrition_bot")))
+
+from startup import LazyResource, StartupReport
+
+# Keep track of where our cold start time goes
+startup = StartupReport()
+
+with startup.timed("import flask"):
+    from flask import Flask, Response, g, request, jsonify, stream_with_context
+    from flask_cors import CORS
+    from dotenv import load_dotenv
+    import json
+
+with startup.timed("import local modules"):
+    from config import (ANSWER_STORE_ENABLED, BATCH_CONCURRENCY, BATCH_MAX_ITEMS, BATCH_PREPARE_SIZE, CACHE_ADMIN_TOKEN, EMBED_BATCHING,
+                        EMBEDDING_ENGINE, EMBEDDING_MODEL_NAME, GROQ_FAST_TIMEOUT_SECONDS, HYBRID_SEARCH, MODEL_LOADING,
+                        UPSTREAM_TIMEOUTS)
+    from answer_store import load_answer_store
+    from batch_embedder import BatchingEmbedder
+    from dataset import dataset_version, load_dataset
+    from embedding_artifact import shared_artifact
+    from embedding_cache import get_embedding_cache
+    from keyword_rules import KeywordRules, ScanState
+    from myth_classifier import Classification, MythFactClassifier
+    from prompt_context import ContextBuilder, PromptStats, count_tokens
+    from response_cache import SemanticResponseCache
+    from lexical_index import LexicalIndex
+    from retrieval import (PineconeRetriever, hybrid_depth, hybrid_query, make_retriever,
+                           open_pinecone_index)
+    from session_store import load_session, make_session_store, save_session
+    from spell_index import SpellCorrector, dataset_vocabulary
+    from stage_timing import begin, stage, timed
+    from telemetry import (CHAT_ANSWERS, CONTENT_TYPE, MetricFamily, cache_families, counter_family, gauge,
+                           get_logger, observe_request, register_collector, render_metrics, start_request)
+    from upstream import UpstreamError, get_upstream, pooled_http_client, upstream_stats
 
 # Let's grab our environment variables first
 load_dotenv()
 
+# Per-request logs go through a queue and are sampled (see LOG_SAMPLE_RATE)
+log = get_logger("vrm")
+
 # -------------------------
 # CONFIGURATION SETTINGS
 # -------------------------
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-# Setting up our API clients for Pinecone and Groq
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index("nutrition-myths")
-client = Groq(api_key=GROQ_API_KEY)
+# The heavy stuff (torch, the 1.3 GB model, the Pinecone and Groq SDKs) is loaded
+# by these loaders - in the background by default, so the server can bind right away
+def load_groq_client():
+    with startup.timed("import groq"):
+        from groq import Groq
+    # One keep-alive connection pool; retries and deadlines are groq_upstream's job
+    return Groq(api_key=GROQ_API_KEY, http_client=pooled_http_client(UPSTREAM_TIMEOUTS["groq"]), max_retries=0)
+
+def load_embedding_model():
+    # Needs to be 1024 dimensions to work with our Pinecone setup
+    from encoders import import_engine, load_encoder
+    with startup.timed(f"import {EMBEDDING_ENGINE} embedding engine"):
+        import_engine()
+    with startup.timed("read embedding model weights"):
+        model = load_encoder()
+    # The first encode pays for torch's lazy allocations - do it now, not on a user's request
+    with startup.timed("warmup encode"):
+        model.encode(["Is eating rice at night bad for weight loss?"])
+    return model
+
+def create_pinecone_index():
+    with startup.timed("import pinecone"):
+        return open_pinecone_index(PINECONE_API_KEY, "nutrition-myths")
+
+def load_retriever():
+    # Where our nutrition chunks come from: Pinecone, or a local in-memory index
+    # over the same dataset (set RETRIEVAL_BACKEND=local or hnsw to skip the network)
+    return make_retriever(
+        encode=lambda texts: embedding_model.get().encode(texts, batch_size=32),
+        pinecone_index_factory=create_pinecone_index,
+        namespace="default",  # This is where we stored our nutrition data
+        index_name="nutrition-myths",
+    )
+
+def load_myth_classifier():
+    # Myth and fact statements from the dataset: precomputed if there's a current
+    # embedding artifact (see embedding_artifact.py), otherwise embedded right now
+    artifact = shared_artifact()
+    if artifact is not None:
+        return MythFactClassifier.from_artifact(artifact)
+    return MythFactClassifier.from_dataset(
+        lambda texts: embedding_model.get().encode(texts, batch_size=32)
+    )
 
-# Loading our embedding model (needs to be 1024 dimensions to work with our Pinecone setup)
-embedding_model = SentenceTransformer("BAAI/bge-large-en-v1.5")
+groq_client = LazyResource("groq client", load_groq_client, startup)
+# Deadlines, retries, hedging and a circuit breaker for every Groq call
+groq_upstream = get_upstream("groq")
+embedding_model = LazyResource("embedding model", load_embedding_model, startup)
+retriever = LazyResource("retriever", load_retriever, startup)
+# BM25 over the same records, fused with the vector results (see HYBRID_SEARCH)
+lexical_index = LazyResource("lexical index", LexicalIndex.from_dataset, startup)
+myth_classifier = LazyResource("myth classifier", load_myth_classifier, startup)
+
+# Repeat questions ("are carbs bad") skip the transformer entirely
+embedding_cache = get_embedding_cache(EMBEDDING_MODEL_NAME)
+# Concurrent requests get coalesced into one batched encode() call
+embedding_batcher = BatchingEmbedder(lambda texts: embedding_model.get().encode(texts, batch_size=len(texts)))
+
+def encode_one(text):
+    if EMBED_BATCHING:
+        return embedding_batcher.encode(text)
+    return embedding_model.get().encode(text)
+
+# Answers we've already written, looked up by question similarity.
+# Tagged with the dataset version so a re-upload never serves stale answers.
+response_cache = SemanticResponseCache()
+current_dataset_version = dataset_version()
+
+def warm_up():
+    """
+    Loads everything the chat endpoints need; /readyz flips to 200 when this is done
+    """
+    for resource in search_resources() + (groq_client, myth_classifier):
+        try:
+            resource.get()
+        except RuntimeError:
+            pass  # already logged, and /readyz reports it
+    startup.print_summary()
+
+def after_fork():
+    """
+    Runs in each prefork worker (see serve.py). The model, indexes and caches stay
+    shared with the master; network clients are rebuilt so no two processes share
+    a connection.
+    """
+    groq_client.reset()
+    groq_client.get()
+    if retriever.ready and isinstance(retriever.get(), PineconeRetriever):
+        retriever.get().reopen()
 
 # -------------------------
 # FLASK APP SETUP
@@ -34,6 +153,26 @@ embedding_model = SentenceTransformer("BAAI/bge-large-en-v1.5")
 app = Flask(__name__)
 CORS(app)
 
+# Where each request's time goes, as a Server-Timing header (see stage_timing.py)
+# and in the /metrics histograms. Streamed responses send their headers before the
+# work happens, so they skip the header and only count as started.
+@app.before_request
+def start_timing():
+    g.timings = begin()
+    start_request()
+
+@app.after_request
+def add_server_timing(response):
+    if "timings" not in g:
+        return response
+    seconds = None
+    if not response.is_streamed:
+        response.headers["Server-Timing"] = g.timings.header()
+        seconds = g.timings.elapsed()
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    observe_request(endpoint, response.status_code, seconds)
+    return response
+
 # -------------------------
 # SPELL CHECKER VOCABULARY
 # -------------------------
@@ -52,262 +191,159 @@ NUTRITION_VOCABULARY = [
     'myth', 'fact', 'true', 'false', 'really', 'actually', 'always', 'never'
 ]
 
+# Built once at startup: our nutrition words plus every real word, tag and category
+# from the dataset, indexed so each lookup only checks a handful of candidates
+with startup.timed("build spell index"):
+    spell_corrector = SpellCorrector(NUTRITION_VOCABULARY + sorted(dataset_vocabulary(load_dataset())))
+
 def correct_spelling(text):
     """
     Helps fix typos in what users type using smart fuzzy matching
     """
-    words = text.split()
-    corrected_words = []
-    corrections_made = []
-    
-    for word in words:
-        # Don't bother correcting really short words
-        if len(word) <= 3:
-            corrected_words.append(word)
-            continue
-        
-        # Clean up the word by removing any punctuation
-        clean_word = re.sub(r'[^\w\s]', '', word.lower())
-        
-        # Let's see if we can find a similar word in our vocabulary
-        matches = get_close_matches(clean_word, NUTRITION_VOCABULARY, n=1, cutoff=0.7)
-        
-        if matches and matches[0] != clean_word:
-            # Great! We found a better match
-            corrected_words.append(matches[0])
-            corrections_made.append(f"{word} → {matches[0]}")
-        else:
-            # This word looks fine or we couldn't find a match
-            corrected_words.append(word)
-    
-    corrected_text = ' '.join(corrected_words)
-    return corrected_text, corrections_made
+    return spell_corrector.correct(text)
 
 # -------------------------
 # TEXT EMBEDDING FUNCTION
 # -------------------------
+@timed("embed")
 def embed(text):
-    emb = embedding_model.encode(text)
+    emb = embedding_cache.get_or_compute(text, encode_one)
     return emb.tolist()
 
+@timed("embed")
+def embed_many(texts):
+    """
+    embed() for a list of questions, in one encode() call for the ones not cached
+    """
+    vectors = embedding_cache.get_or_compute_many(
+        texts, lambda batch: embedding_model.get().encode(batch, batch_size=32))
+    return [vec.tolist() for vec in vectors]
+
 # -------------------------
 # UNDERSTANDING WHAT USERS NEED
 # -------------------------
+# Goals, diets, health conditions, topic buttons and the "too vague" check all come
+# from one keyword automaton - grow context_rules.json, not these functions
+with startup.timed("compile keyword rules"):
+    keyword_rules = KeywordRules.from_file()
+
+def analyze_message(message):
+    """
+    One pass over the message: everything below in a single TextAnalysis
+    """
+    return keyword_rules.analyze(message)
+
 def extract_user_context(message):
     """
     Figures out what the user's goals are, what diet they follow, and any health stuff
     This helps us give them personalized advice that actually matters to them
     """
-    message_lower = message.lower()
-    context_parts = []
-    
-    # What's their fitness goal?
-    if any(word in message_lower for word in ['lose weight', 'weight loss', 'fat loss', 'slim down', 'cut']):
-        context_parts.append("User wants to lose weight")
-    elif any(word in message_lower for word in ['gain muscle', 'build muscle', 'bulk', 'get stronger', 'bodybuilding']):
-        context_parts.append("User wants to gain muscle")
-    elif any(word in message_lower for word in ['maintain', 'stay healthy', 'general health']):
-        context_parts.append("User focused on general health")
-    
-    # What's their eating style?
-    if any(word in message_lower for word in ['vegan', "i'm vegan", "i am vegan"]):
-        context_parts.append("User is vegan")
-    elif any(word in message_lower for word in ['vegetarian', "i'm vegetarian", "i am vegetarian"]):
-        context_parts.append("User is vegetarian")
-    
-    if any(word in message_lower for word in ['keto', 'ketogenic', 'low carb']):
-        context_parts.append("User follows keto/low-carb diet")
-    
-    # Any health conditions we should know about?
-    if any(word in message_lower for word in ['diabetic', 'diabetes', 'blood sugar']):
-        context_parts.append("User has diabetes concerns")
-    elif any(word in message_lower for word in ['pregnant', 'pregnancy', "i'm pregnant"]):
-        context_parts.append("User is pregnant")
-    
-    if context_parts:
-        return ". ".join(context_parts) + "."
-    return ""
+    return analyze_message(message).context
 
 def is_general_question(query):
     """
     Checks if someone's asking something super vague that needs more details
     Returns True if we should ask them to be more specific about their goals
     """
-    query_lower = query.lower()
-    
-    # These are the vague nutrition words people use when they need more specific advice
-    general_terms = [
-        'protein', 'carbs', 'carbohydrates', 'fat', 'fats', 
-        'calories', 'diet', 'food', 'eat', 'nutrition',
-        'healthy', 'good', 'bad', 'should i', 'can i'
-    ]
-    
-    # Is it a broad question without enough detail to give a useful answer?
-    has_general_term = any(term in query_lower for term in general_terms)
-    has_no_context = not extract_user_context(query)
-    
-    # Really vague questions like "is protein good?" or "should I eat carbs?"
-    is_vague = any(pattern in query_lower for pattern in [
-        'is protein good', 'are carbs good', 'are fats good',
-        'should i eat protein', 'should i eat carbs', 'should i eat fats',
-        'is diet good', 'how much protein', 'how much carbs',
-        'protein intake', 'carb intake', 'fat intake'
-    ])
-    
-    return (has_general_term and has_no_context) or is_vague
+    return analyze_message(query).is_general
 
 def get_context_specific_buttons(query):
     """
     Gives users relevant options based on what they're asking about
     Makes the conversation more personalized and helpful
     """
-    query_lower = query.lower()
-    
-    # If they're asking about protein...
-    if any(word in query_lower for word in ['protein', 'meat', 'chicken', 'fish', 'eggs', 'tofu']):
-        return [
-            {"label": "💪 Build Muscle", "value": "I want to gain muscle"},
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "🌱 I'm Vegan", "value": "I'm vegan"},
-            {"label": "🏋️ Athletic Performance", "value": "I'm an athlete"},
-            {"label": "👶 Pregnancy", "value": "I'm pregnant"},
-            {"label": "🥗 General Health", "value": "I want to maintain general health"}
-        ]
-    
-    # If they're asking about carbs...
-    elif any(word in query_lower for word in ['carbs', 'carbohydrate', 'rice', 'bread', 'pasta', 'sugar', 'glucose']):
-        return [
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "💪 Build Muscle", "value": "I want to gain muscle"},
-            {"label": "🥑 Low-Carb/Keto", "value": "I follow a keto diet"},
-            {"label": "🩺 Diabetic", "value": "I have diabetes"},
-            {"label": "🏋️ Athletic Training", "value": "I'm an athlete"},
-            {"label": "🧠 Mental Focus", "value": "I want better energy and focus"}
-        ]
-    
-    # If they're asking about fats...
-    elif any(word in query_lower for word in ['fat', 'fats', 'oil', 'butter', 'cheese', 'avocado', 'omega']):
-        return [
-            {"label": "❤️ Heart Health", "value": "I'm concerned about heart health"},
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "🥑 Low-Carb/Keto", "value": "I follow a keto diet"},
-            {"label": "🧠 Brain Health", "value": "I want to improve cognitive function"},
-            {"label": "💪 Build Muscle", "value": "I want to gain muscle"},
-            {"label": "🩺 High Cholesterol", "value": "I have high cholesterol"}
-        ]
-    
-    # If they're asking about dairy...
-    elif any(word in query_lower for word in ['milk', 'dairy', 'lactose', 'yogurt', 'cheese']):
-        return [
-            {"label": "🦴 Bone Health", "value": "I'm concerned about bone health"},
-            {"label": "🌱 Dairy-Free", "value": "I'm lactose intolerant or vegan"},
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "💪 Build Muscle", "value": "I want to gain muscle"},
-            {"label": "🥗 General Health", "value": "I want to maintain general health"}
-        ]
-    
-    # If they're asking about sugar...
-    elif any(word in query_lower for word in ['sugar', 'sweet', 'dessert', 'candy', 'artificial sweetener']):
-        return [
-            {"label": "🩺 Diabetic", "value": "I have diabetes"},
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "🦷 Dental Health", "value": "I'm concerned about teeth health"},
-            {"label": "🧠 Energy Levels", "value": "I want stable energy throughout the day"},
-            {"label": "🥑 Low-Carb", "value": "I follow a keto or low-carb diet"}
-        ]
-    
-    # If they're asking about diets in general...
-    elif any(word in query_lower for word in ['diet', 'dieting', 'eating plan', 'meal plan']):
-        return [
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "💪 Build Muscle", "value": "I want to gain muscle"},
-            {"label": "🌱 Plant-Based", "value": "I'm vegan or vegetarian"},
-            {"label": "🥑 Low-Carb/Keto", "value": "I follow a keto diet"},
-            {"label": "🩺 Medical Diet", "value": "I have specific health conditions"},
-            {"label": "⚖️ Balanced Approach", "value": "I want sustainable healthy eating"}
-        ]
-    
-    # If they're asking about calories or weight...
-    elif any(word in query_lower for word in ['calorie', 'calories', 'weight', 'lose', 'gain', 'metabolism']):
-        return [
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "💪 Gain Muscle", "value": "I want to gain muscle"},
-            {"label": "⚖️ Maintain Weight", "value": "I want to maintain my weight"},
-            {"label": "🏋️ Athletic Goals", "value": "I'm training for sports"},
-            {"label": "🩺 Medical Reasons", "value": "I need to manage weight for health"},
-            {"label": "🥗 General Health", "value": "I want to eat healthier overall"}
-        ]
-    
-    # If they're asking about fruits and vegetables...
-    elif any(word in query_lower for word in ['fruit', 'vegetable', 'veggie', 'salad', 'greens', 'produce']):
-        return [
-            {"label": "🥗 General Health", "value": "I want to maintain general health"},
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "🌱 Vegan", "value": "I'm vegan or vegetarian"},
-            {"label": "🩺 Disease Prevention", "value": "I want to prevent chronic diseases"},
-            {"label": "💪 Athletic Nutrition", "value": "I'm an athlete"},
-            {"label": "🧒 Family Nutrition", "value": "I'm planning meals for my family"}
-        ]
-    
-    # If they're asking about vitamins or supplements...
-    elif any(word in query_lower for word in ['vitamin', 'supplement', 'mineral', 'nutrient', 'deficiency']):
-        return [
-            {"label": "🥗 General Health", "value": "I want to optimize my nutrition"},
-            {"label": "🌱 Vegan/Vegetarian", "value": "I follow a plant-based diet"},
-            {"label": "👶 Pregnancy", "value": "I'm pregnant or planning to be"},
-            {"label": "👴 Aging Health", "value": "I'm concerned about aging"},
-            {"label": "🏋️ Athletic Performance", "value": "I'm an athlete"},
-            {"label": "🩺 Health Condition", "value": "I have specific health concerns"}
-        ]
-    
-    # If they're asking about when to eat...
-    elif any(word in query_lower for word in ['breakfast', 'lunch', 'dinner', 'snack', 'fasting', 'meal timing', 'when to eat']):
-        return [
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "💪 Build Muscle", "value": "I want to gain muscle"},
-            {"label": "🏋️ Athletic Performance", "value": "I'm training for sports"},
-            {"label": "🧠 Energy & Focus", "value": "I want better energy throughout the day"},
-            {"label": "⏰ Intermittent Fasting", "value": "I practice intermittent fasting"},
-            {"label": "🥗 General Health", "value": "I want healthy eating habits"}
-        ]
-    
-    # If they're asking about water or drinks...
-    elif any(word in query_lower for word in ['water', 'hydration', 'drink', 'fluid', 'juice', 'beverage']):
-        return [
-            {"label": "🏋️ Athletic Performance", "value": "I'm an athlete"},
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "🧠 Better Focus", "value": "I want improved mental clarity"},
-            {"label": "🦴 Kidney Health", "value": "I'm concerned about kidney health"},
-            {"label": "🩺 Health Condition", "value": "I have specific medical needs"},
-            {"label": "🥗 General Health", "value": "I want to stay healthy"}
-        ]
-    
-    # For everything else, give them the most common options
-    else:
-        return [
-            {"label": "🏃‍♀️ Lose Weight", "value": "I want to lose weight"},
-            {"label": "💪 Build Muscle", "value": "I want to gain muscle"},
-            {"label": "🥗 Stay Healthy", "value": "I want to maintain general health"},
-            {"label": "🌱 I'm Vegan", "value": "I'm vegan"},
-            {"label": "🥑 Low-Carb/Keto", "value": "I follow a keto diet"},
-            {"label": "🩺 Health Condition", "value": "I have specific health concerns"}
-        ]
+    return analyze_message(query).buttons
+
+# -------------------------
+# REMEMBERING THE CONVERSATION
+# -------------------------
+# The preferences each user picked, by sessionId - the UI doesn't have to resend them
+session_store = make_session_store()
+
+class PreferenceProfile(NamedTuple):
+    prefix: str      # what goes in front of the message in the combined query
+    scan: ScanState  # the keyword scan over that prefix, continued for each message
+    context: str     # the user context the preferences alone add up to
+
+@lru_cache(maxsize=1024)
+def preference_profile(user_preferences, user_selection=None):
+    """
+    Everything that depends only on the preferences (and the button just clicked),
+    worked out once per combination instead of on every turn
+    """
+    prefix = " ".join(user_preferences) + ". " if user_preferences else ""
+    if user_selection:
+        prefix += f"{user_selection}. "
+    return PreferenceProfile(prefix, keyword_rules.scan(prefix), keyword_rules.analyze(prefix).context)
+
+def resolve_session(data):
+    """
+    The request's session, and the button they clicked (if any). Preferences sent
+    with the request (older clients resend them every turn) replace the stored ones.
+    """
+    session = load_session(session_store, data.get("sessionId"))
+    if isinstance(data.get("userPreferences"), list):
+        session.set_preferences(data["userPreferences"])
+    return session, data.get("userSelection") or None
+
+def remember_session(session, user_selection):
+    """
+    A clicked button becomes one of their preferences for the rest of the conversation
+    """
+    if user_selection:
+        session.add_preference(user_selection)
+    session.context = preference_profile(session.preferences).context
+    session.turns += 1
+    save_session(session_store, session)
 
 # -------------------------
 # SEARCHING OUR NUTRITION DATABASE
 # -------------------------
-def pinecone_search(query):
-    query_vec = embed(query)
+# Which way each search went: "lexical" (no embedding needed), "hybrid" or "vector"
+retrieval_paths = Counter()
 
-    result = index.query(
-        vector=query_vec,
-        top_k=5,
-        include_metadata=True,
-        namespace="default"  # This is where we stored our nutrition data
-    )
+def search_resources():
+    if HYBRID_SEARCH:
+        return (embedding_model, retriever, lexical_index)
+    return (embedding_model, retriever)
+
+@timed("search")
+def pinecone_search(query, query_vec=None, dense_matches=None):
+    """
+    Top 5 chunks for the query. With HYBRID_SEARCH, exact food words count too:
+    BM25 and vector results are fused, and a clear keyword hit doesn't even need
+    the embedding (when the caller hasn't computed one yet).
+    dense_matches are vector results the caller already has (see pinecone_search_batch).
+    """
+    if HYBRID_SEARCH:
+        matches, path = hybrid_query(query, retriever.get(), lexical_index.get(),
+                                     vector=query_vec, embed=embed, top_k=5, dense_matches=dense_matches)
+    elif dense_matches is not None:
+        matches, path = dense_matches[:5], "vector"
+    else:
+        if query_vec is None:
+            query_vec = embed(query)
+        matches, path = retriever.get().query(query_vec, top_k=5), "vector"
+    retrieval_paths[path] += 1
+    return chunks_from_matches(matches)
+
+@timed("search")
+def pinecone_search_batch(queries, query_vecs):
+    """
+    pinecone_search() for many queries. An in-process retriever (ours or the
+    sidecar's) scores all of them in one matrix product; Pinecone is a network call
+    per query, so that returns None and each item searches on its own (concurrently,
+    see answer_batch).
+    """
+    if not all(r.ready for r in search_resources()) or not retriever.get().searches_rows:
+        return None
+    depth = hybrid_depth(5) if HYBRID_SEARCH else 5
+    dense = retriever.get().query_batch(query_vecs, top_k=depth)
+    return [pinecone_search(query, vec, matches) for query, vec, matches in zip(queries, query_vecs, dense)]
 
+def chunks_from_matches(matches):
     chunks = []
-    for m in result.matches:
+    for m in matches:
         # Pull out the myth, fact, and explanation from what we stored
         myth = m.metadata.get("myth", "")
         fact = m.metadata.get("fact", "")
@@ -328,7 +364,11 @@ def pinecone_search(query):
             chunks.append({
                 "id": m.id,
                 "score": m.score,
-                "text": text
+                "text": text,
+                # Kept separate so the prompt builder can trim the explanation
+                "myth": myth,
+                "fact": fact,
+                "explanation": explanation
             })
 
     return chunks
@@ -336,16 +376,67 @@ def pinecone_search(query):
 # -------------------------
 # FIGURING OUT IF IT'S A MYTH OR FACT
 # -------------------------
-def classify_myth_or_fact(query):
+# How often the local classifier was sure enough vs. had to ask Groq
+answer_type_sources = Counter()
+
+def build_classify_messages(query):
     prompt = f"Classify the following nutrition question as either a MYTH or a FACT.\nQuestion: '{query}'\nReply with EXACTLY ONE WORD: either 'myth' or 'fact'."
-    response = client.chat.completions.create(
-        model="llama3-8b-8192",
-        messages=[{"role": "user", "content": prompt}]
-    )
+    return [{"role": "user", "content": prompt}]
+
+CLASSIFY_PARAMS = {"model": "llama3-8b-8192"}
+
+def parse_myth_or_fact(response):
     result = response.choices[0].message.content.strip().lower()
     if "myth" in result:
         return "myth"
     return "fact"
+
+def classify_myth_or_fact(query):
+    response = groq_upstream.call(
+        groq_client.get().chat.completions.create,
+        timeout=GROQ_FAST_TIMEOUT_SECONDS,
+        messages=build_classify_messages(query),
+        **CLASSIFY_PARAMS
+    )
+    return parse_myth_or_fact(response)
+
+def classify_locally(turn):
+    """
+    Nearest-neighbour vote against the dataset's myths and facts - well under a
+    millisecond, and it reuses the query embedding we already have.
+    Returns (classification, whether it's confident enough to use as-is).
+    """
+    classifier = myth_classifier.get()
+    local = classifier.classify(turn["query_vec"])
+    return local, classifier.is_confident(local)
+
+def settle_answer_type(turn, local, llm_label=None):
+    """
+    Records the final classification on the turn and returns its label
+    """
+    if llm_label is None:
+        result = local
+    else:
+        result = Classification(llm_label, local.confidence, local.similarity, "llm")
+    answer_type_sources[result.source] += 1
+    turn["classification"] = result
+    log.debug("🏷️ Answer type: %s (%s, confidence %.2f)", result.label, result.source, result.confidence)
+    return result.label
+
+@timed("classify")
+def classify_answer_type(turn):
+    """
+    Is the user asking about a myth or a fact? Only unsure cases cost a Groq call.
+    """
+    local, confident = classify_locally(turn)
+    if confident:
+        return settle_answer_type(turn, local)
+    try:
+        return settle_answer_type(turn, local, classify_myth_or_fact(turn["combined_query"]))
+    except Exception as e:
+        # A label is better than no answer - keep our own best guess
+        log.warning("!! Groq classification failed, keeping local guess: %s", e)
+        return settle_answer_type(turn, local)
 # -------------------------
 # PUTTING TOGETHER THE FINAL ANSWER
 # -------------------------
@@ -361,90 +452,32 @@ def build_answer(result_type, chunks):
 
     return prefix + body.strip()
 
-# -------------------------
-# MAIN CHAT API ENDPOINT
-# -------------------------
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    data = request.json
-    user_msg = data.get("message", "").strip()
-    user_selection = data.get("userSelection", None)
-    user_preferences = data.get("userPreferences", [])
+FALLBACK_MY_TAKE = "Straight from my nutrition notes! 📚"
 
-    if not user_msg:
-        return jsonify({"error": "Message is required"}), 400
+def fallback_reply(answer_type, chunks):
+    """
+    What we answer when Groq is unhealthy: the best sources, straight from the database
+    """
+    return build_answer(answer_type, chunks[:2]), FALLBACK_MY_TAKE
 
-    try:
-        print(f"📩 Received message: {user_msg}")
-        print(f"👆 User selection: {user_selection}")
-        print(f"💾 Stored preferences: {user_preferences}")
-        
-        # Let's fix any typos first
-        corrected_msg, corrections = correct_spelling(user_msg)
-        if corrections:
-            print(f"✏️ Spell corrections: {', '.join(corrections)}")
-            correction_note = f"*(I understood: {corrected_msg})*\n\n"
-        else:
-            correction_note = ""
-        
-        # Work with the corrected version from here on
-        processed_msg = corrected_msg
-        
-        # Remember what they told us before about their goals and preferences
-        preference_context = ""
-        if user_preferences:
-            preference_context = " ".join(user_preferences) + ". "
-        
-        # Is this question too vague? Should we ask them for more details?
-        # Only show buttons on their first question (before they've told us their preferences)
-        if not user_selection and not user_preferences and is_general_question(processed_msg):
-            print("❓ Detected general question - returning context-specific options")
-            dynamic_buttons = get_context_specific_buttons(processed_msg)
-            return jsonify({
-                "answer": f"{correction_note}🤔 Great question! To give you the most helpful answer, what's your situation?",
-                "buttons": dynamic_buttons,
-                "originalQuery": processed_msg
-            })
-        
-        # If they selected something, add it to their original question for better context
-        if user_selection:
-            combined_query = f"{preference_context}{user_selection}. {processed_msg}"
-            print(f"🔄 Combined query: {combined_query}")
-        else:
-            # Just use what they've told us before
-            combined_query = f"{preference_context}{processed_msg}"
-            print(f"🔄 Query with preferences: {combined_query}")
-        
-        # What do we know about this user from their message?
-        user_context = extract_user_context(combined_query)
-        if user_context:
-            print(f"🎯 Detected context: {user_context}")
-        
-        # Let's search our database for relevant nutrition info
-        chunks = pinecone_search(combined_query)
-        print(f"🔍 Found {len(chunks)} chunks from Pinecone")
-        
-        if chunks and len(chunks) > 0:
-            # Let's ask Groq to write a natural response using what we found
-            context = "\n\n".join([f"Source {i+1}:\n{c['text']}" for i, c in enumerate(chunks[:3])])
-            
-            # If we know something about the user's goals/diet/health, tell Groq to personalize
-            context_note = ""
-            if user_context:
-                context_note = f"\n\n⚠️ IMPORTANT PERSONALIZATION: {user_context}\nTailor your advice specifically for this user's situation. Make recommendations that align with their goals/diet/conditions."
-            
-            prompt = f"""You are a friendly, helpful nutrition expert. Based on the verified nutrition information below, answer the user's question in a warm, conversational way.
+# -------------------------
+# WRITING THE ANSWER WITH GROQ
+# -------------------------
+ANSWER_SYSTEM_PROMPT = "You are a friendly, supportive nutrition expert who makes healthy eating feel approachable and fun. Use emojis naturally and structure your responses clearly with markdown formatting. NEVER use greetings like 'Hey there, friend!' or 'Hello!' - start directly with the answer. Always base your answers strictly on the provided Retrieved Information from the nutrition database - cite specific myths, facts, and explanations from the sources."
 
-Retrieved Information:
-{context}{context_note}
+NO_RESULTS_ANSWER = "🤔 Hmm, I don't have specific information about that topic in my nutrition database yet.\n\n**Try asking about:**\n• Common nutrition myths (carbs, fats, protein)\n• Specific foods (rice, chicken, fruits)\n• Weight management questions\n• Healthy eating tips\n\nI'm here to help separate nutrition facts from fiction! 💪"
+NO_RESULTS_MY_TAKE = "Let me know what nutrition topic you'd like to explore!"
 
-User Question: {user_msg}
+# The instructions never change, so they live in the system message: it's built
+# (and counted) once, and every request starts with the same prefix, which is
+# what Groq's prompt caching can reuse. Only the sources and question vary.
+ANSWER_INSTRUCTIONS = """Based on the verified nutrition information in the user's message, answer their question in a warm, conversational way.
 
 Instructions:
 1. Start directly with the myth/fact assessment - NO greetings like "Hey there, friend!" or "Hello!"
 2. If it's a myth, start with "❌ Myth Alert!" followed by what's wrong
 3. If it's a fact, start with "✅ That's Right!" or similar positive affirmation
-4. ALWAYS reference the specific information from the Retrieved Information above - cite the myths/facts/explanations provided
+4. ALWAYS reference the specific information from the Retrieved Information - cite the myths/facts/explanations provided
 5. Use clear sections with headers like:
    - **The Truth:** (directly quote or paraphrase from the retrieved information)
    - **The Science:** (explain using the evidence from the database)
@@ -459,75 +492,746 @@ Instructions:
 
 Make it feel like evidence-based advice from a knowledgeable friend, not a textbook!"""
 
-            completion = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[
-                    {"role": "system", "content": "You are a friendly, supportive nutrition expert who makes healthy eating feel approachable and fun. Use emojis naturally and structure your responses clearly with markdown formatting. NEVER use greetings like 'Hey there, friend!' or 'Hello!' - start directly with the answer. Always base your answers strictly on the provided Retrieved Information from the nutrition database - cite specific myths, facts, and explanations from the sources."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=600
-            )
+ANSWER_SYSTEM_MESSAGE = {"role": "system", "content": f"{ANSWER_SYSTEM_PROMPT}\n\n{ANSWER_INSTRUCTIONS}"}
+ANSWER_SYSTEM_TOKENS = count_tokens(ANSWER_SYSTEM_MESSAGE["content"])
+
+# Dedupes, filters and trims the retrieved chunks to CONTEXT_TOKEN_BUDGET
+context_builder = ContextBuilder()
+prompt_stats = PromptStats()
+
+def build_answer_messages(user_msg, chunks, user_context):
+    """
+    Builds the chat messages for the main llama-3.3-70b answer
+    """
+    context, report = context_builder.build(user_msg, chunks)
+    
+    # If we know something about the user's goals/diet/health, tell Groq to personalize
+    context_note = ""
+    if user_context:
+        context_note = f"\n\n⚠️ IMPORTANT PERSONALIZATION: {user_context}\nTailor your advice specifically for this user's situation. Make recommendations that align with their goals/diet/conditions."
+    
+    prompt = f"""Retrieved Information:
+{context}{context_note}
+
+User Question: {user_msg}"""
+
+    prompt_tokens = ANSWER_SYSTEM_TOKENS + count_tokens(prompt)
+    prompt_stats.record(prompt_tokens, report)
+    log.debug("🧮 Prompt ~%d tokens: %d sources, context %d (verbatim would be %d), %d chunks dropped, "
+              "%d sentences trimmed", prompt_tokens, report.sources, report.context_tokens,
+              report.baseline_tokens, report.dropped, report.trimmed_sentences)
+
+    return [
+        ANSWER_SYSTEM_MESSAGE,
+        {"role": "user", "content": prompt}
+    ]
+
+# Model settings for our two Groq calls (shared with the async server in asgi_app.py)
+ANSWER_PARAMS = {"model": "llama-3.3-70b-versatile", "temperature": 0.3, "max_tokens": 600}
+MY_TAKE_PARAMS = {"model": "llama-3.1-8b-instant", "temperature": 0.7, "max_tokens": 50}
+
+@timed("llm")
+def generate_answer(messages, stream=False):
+    """
+    The main Groq call. With stream=True you get an iterator of completion chunks
+    (the deadline then covers getting the stream going, and it's never hedged).
+    Raises UpstreamError when Groq is too slow or unhealthy - use fallback_reply().
+    """
+    return groq_upstream.call(groq_client.get().chat.completions.create, hedge=not stream,
+                              messages=messages, stream=stream, **ANSWER_PARAMS)
+
+def build_my_take_messages(answer):
+    my_take_prompt = f"Based on this nutrition answer, write ONE SHORT sentence (max 15 words) that's a friendly personal take or key insight. Make it conversational and fun.\n\nAnswer: {answer[:200]}\n\nYour short take:"
+    return [{"role": "user", "content": my_take_prompt}]
+
+def build_source_take_messages(source):
+    """
+    The myTake prompt for when it's written alongside the answer (asgi_app.py)
+    instead of from it: all we have yet is the top source from the database
+    """
+    my_take_prompt = f"Based on this nutrition fact from our database, write ONE SHORT sentence (max 15 words) that's a friendly personal take or key insight. Make it conversational and fun.\n\nFact: {source[:200]}\n\nYour short take:"
+    return [{"role": "user", "content": my_take_prompt}]
+
+def clean_my_take(completion):
+    my_take = completion.choices[0].message.content.strip()
+    # Clean up any quotes around it
+    return my_take.strip('"\'')
+
+@timed("my_take")
+def generate_my_take(answer):
+    """
+    A fun little one-liner summary for the avatar to say
+    """
+    try:
+        my_take_completion = groq_upstream.call(
+            groq_client.get().chat.completions.create,
+            timeout=GROQ_FAST_TIMEOUT_SECONDS,
+            messages=build_my_take_messages(answer),
+            **MY_TAKE_PARAMS
+        )
+    except UpstreamError as e:
+        log.warning("!! Groq unavailable for the myTake: %s", e)
+        return FALLBACK_MY_TAKE
+    return clean_my_take(my_take_completion)
+
+# -------------------------
+# GETTING A CHAT TURN READY
+# -------------------------
+def build_chat_turn(user_msg, user_selection, user_preferences):
+    """
+    The cheap, text-only part of a chat turn: spell correction, preferences,
+    the clarifying-buttons check and the user's context.
+
+    Returns a dict describing the turn. If turn["response"] is set, that payload
+    already answers the user and no embedding or LLM call is needed.
+    """
+    log.info("📩 Received message: %s (selection %r, preferences %r)", user_msg, user_selection, user_preferences)
+    
+    # Let's fix any typos first
+    with stage("spell"):
+        corrected_msg, corrections = correct_spelling(user_msg)
+    if corrections:
+        log.debug("✏️ Spell corrections: %s", ", ".join(corrections))
+        correction_note = f"*(I understood: {corrected_msg})*\n\n"
+    else:
+        correction_note = ""
+    
+    # Work with the corrected version from here on
+    processed_msg = corrected_msg
+    turn = {
+        "user_msg": user_msg,
+        "processed_msg": processed_msg,
+        "corrections": corrections,
+        "correction_note": correction_note,
+        "response": None
+    }
+    
+    # What they told us before about their goals and preferences (and the button
+    # they just clicked) goes in front of their question for better context
+    profile = preference_profile(tuple(user_preferences or ()), user_selection)
+    combined_query = profile.prefix + processed_msg
+    
+    # One scan tells us their context, the topic and whether the question is too vague.
+    # The preference part was scanned once for the profile - only the message is new.
+    with stage("context"):
+        analysis = keyword_rules.analyze(processed_msg, resume=profile.scan)
+    turn["analysis"] = analysis
+    
+    # Is this question too vague? Should we ask them for more details?
+    # Only show buttons on their first question (before they've told us their preferences)
+    if not user_selection and not user_preferences and analysis.is_general:
+        log.debug("❓ Detected general question - returning context-specific options")
+        turn["response"] = {
+            "answer": f"{correction_note}🤔 Great question! To give you the most helpful answer, what's your situation?",
+            "buttons": analysis.buttons,
+            "originalQuery": processed_msg
+        }
+        return turn
+    
+    log.debug("🔄 Query %s: %s", "combined with selection" if user_selection else "with preferences", combined_query)
+    
+    # What do we know about this user from their message?
+    user_context = analysis.context
+    if user_context:
+        log.debug("🎯 Detected context: %s", user_context)
+    
+    turn.update({
+        "combined_query": combined_query,
+        "user_context": user_context
+    })
+    return turn
+
+def check_answer_cache(turn, query_vec, my_take_from="answer"):
+    """
+    Have we already answered this (or something that means the same) for someone like them?
+    Sets turn["response"] on a hit. Answers whose myTake was written from the sources
+    (my_take_from="source") are cached apart from ones written from the answer.
+    """
+    variant = "" if my_take_from == "answer" else my_take_from
+    cache_partition = response_cache.partition_key(turn["user_context"], current_dataset_version, variant)
+    turn.update({
+        "query_vec": query_vec,
+        "cache_partition": cache_partition
+    })
+    
+    cached = response_cache.lookup(query_vec, cache_partition)
+    if cached:
+        log.debug("⚡ Answer cache hit (similarity %.3f)", cached["similarity"])
+        turn["response"] = {
+            "answer": turn["correction_note"] + cached["answer"],
+            "type": cached["type"],
+            "myTake": cached["myTake"],
+            "source": "cache"
+        }
+    return turn
+
+def prepare_chat_turn(user_msg, user_selection, user_preferences):
+    """
+    Everything /api/chat and /api/chat/stream do before asking Groq
+    """
+    turn = build_chat_turn(user_msg, user_selection, user_preferences)
+    if not turn["response"]:
+        query_vec = embed(turn["combined_query"])
+        with stage("cache"):
+            check_answer_cache(turn, query_vec)
+    return turn
+
+def remember_answer(turn, answer, answer_type, my_take):
+    """
+    Keep a finished answer (without this user's spelling note) for the next paraphrase
+    """
+    response_cache.store(turn["query_vec"], turn["cache_partition"], {
+        "answer": answer,
+        "type": answer_type,
+        "myTake": my_take
+    })
+
+# -------------------------
+# ANSWERS WRITTEN AHEAD OF TIME
+# -------------------------
+def answer_prompt_version():
+    """
+    Changes whenever the answer prompt or model settings do, so compiled answers
+    written with the old ones aren't served
+    """
+    prompt = json.dumps([ANSWER_SYSTEM_MESSAGE, ANSWER_PARAMS, MY_TAKE_PARAMS], sort_keys=True)
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+# Every dataset myth, answered for every persona by compile_answers.py
+answer_store = load_answer_store(answer_prompt_version()) if ANSWER_STORE_ENABLED else None
+
+def compiled_answer(turn, chunks):
+    """
+    The answer compiled for the top chunk and this user's context, if the question
+    is close enough to one it was written for - no Groq call at all
+    """
+    if answer_store is None or not chunks:
+        return None
+    with stage("compiled"):
+        compiled = answer_store.lookup(chunks[0]["id"], turn["user_context"], turn["query_vec"])
+    if compiled is None:
+        return None
+    log.debug("📚 Compiled answer for %s (similarity %.3f)", chunks[0]["id"], compiled["similarity"])
+    return {
+        "answer": turn["correction_note"] + compiled["answer"],
+        "type": compiled["type"],
+        "myTake": compiled["myTake"],
+        "source": "compiled"
+    }
+
+# -------------------------
+# MAIN CHAT API ENDPOINT
+# -------------------------
+def answer_source(payload):
+    # Clarifying buttons don't say where they came from
+    return "clarify" if "buttons" in payload else payload.get("source", "fallback")
+
+def chat_response(payload, session):
+    """
+    The /api/chat reply, counted by answer source, with the JSON encoding timed as "serialize"
+    """
+    CHAT_ANSWERS.inc(source=answer_source(payload))
+    with stage("serialize"):
+        return jsonify({**payload, "sessionId": session.id})
+
+def answer_turn(turn, chunks):
+    """
+    The answer payload for a prepared turn and the chunks we found for it: the
+    classification, the Groq answer and the myTake (or our fallbacks for them)
+    """
+    correction_note = turn["correction_note"]
+    if not chunks:
+        # Uh oh, we couldn't find anything relevant in our database
+        return {
+            "answer": f"{correction_note}{NO_RESULTS_ANSWER}",
+            "type": "general",
+            "myTake": NO_RESULTS_MY_TAKE,
+            "source": "fallback"
+        }
+    
+    # The dataset's own myths were answered ahead of time
+    compiled = compiled_answer(turn, chunks)
+    if compiled:
+        return compiled
+    
+    # Is this debunking a myth or confirming a fact? Our own classifier knows
+    answer_type = classify_answer_type(turn)
+    
+    # Let's ask Groq to write a natural response using what we found
+    try:
+        completion = generate_answer(build_answer_messages(turn["user_msg"], chunks, turn["user_context"]))
+    except UpstreamError as e:
+        completion = None
+        log.warning("!! Groq unavailable, answering from the database directly: %s", e)
+    
+    if completion is not None:
+        answer = completion.choices[0].message.content
+        prompt_stats.record_usage(getattr(completion, "usage", None))
+        
+        # Now let's create a fun little "myTake" summary for the avatar to say
+        my_take = generate_my_take(answer)
+        
+        log.debug("💭 Generated myTake: %s", my_take)
+        log.debug("📝 Answer preview: %.100s...", answer)
+        
+        remember_answer(turn, answer, answer_type, my_take)
+    else:
+        # Not cached - next time Groq may be back
+        answer, my_take = fallback_reply(answer_type, chunks)
+    
+    # Add the spell correction note at the top if we fixed anything
+    return {
+        "answer": correction_note + answer,
+        "type": answer_type,
+        "myTake": my_take,
+        "source": "groq_enhanced" if completion is not None else "fallback"
+    }
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    data = request.json
+    user_msg = data.get("message", "").strip()
+
+    if not user_msg:
+        return jsonify({"error": "Message is required"}), 400
+
+    try:
+        session, user_selection = resolve_session(data)
+        turn = prepare_chat_turn(user_msg, user_selection, session.preferences)
+        remember_session(session, user_selection)
+        if turn["response"]:
+            return chat_response(turn["response"], session)
+        
+        # Let's search our database for relevant nutrition info
+        chunks = pinecone_search(turn["combined_query"], turn["query_vec"])
+        log.debug("🔍 Found %d chunks from Pinecone", len(chunks))
+        
+        return chat_response(answer_turn(turn, chunks), session)
+    except Exception as e:
+        log.exception("!! ERROR in /api/chat: %s", e)
+        return jsonify({
+            "answer": "😅 Oops! I ran into a technical hiccup. Please try asking your nutrition question again!",
+            "error": str(e)
+        }), 500
+
+# -------------------------
+# STREAMING CHAT API ENDPOINT
+# -------------------------
+def sse_event(event, data):
+    """
+    Formats one Server-Sent Event with a JSON payload
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def done_event(payload, session):
+    # The stream's last event, counted like an /api/chat reply
+    CHAT_ANSWERS.inc(source=answer_source(payload))
+    return sse_event("done", {**payload, "sessionId": session.id})
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Same request body as /api/chat, but answers as Server-Sent Events so the
+    avatar can start talking before Groq is done:
+
+        meta   -> retrieval info as soon as we have it (sources, corrections)
+        type   -> {"type": "myth" | "fact" | "general"}, before the answer starts
+        token  -> {"text": ...} answer pieces as Groq writes them
+        myTake -> {"myTake": ...}
+        done   -> the full /api/chat payload, for clients that just want the end result
+        error  -> {"answer": ..., "error": ...} if something broke mid-stream
+
+    Buttons, cached and compiled answers are sent as a single "done" event.
+    """
+    data = request.json or {}
+    user_msg = data.get("message", "").strip()
+
+    if not user_msg:
+        return jsonify({"error": "Message is required"}), 400
+    session, user_selection = resolve_session(data)
+
+    def generate():
+        try:
+            turn = prepare_chat_turn(user_msg, user_selection, session.preferences)
+            remember_session(session, user_selection)
+            if turn["response"]:
+                yield done_event(turn["response"], session)
+                return
+            correction_note = turn["correction_note"]
             
-            answer = completion.choices[0].message.content
-            print(f"✅ Generated answer from Groq")
+            chunks = pinecone_search(turn["combined_query"], turn["query_vec"])
+            log.debug("🔍 Found %d chunks from Pinecone", len(chunks))
+            compiled = compiled_answer(turn, chunks)
+            if compiled:
+                yield done_event(compiled, session)
+                return
+            yield sse_event("meta", {
+                "source": "groq_enhanced" if chunks else "fallback",
+                "correctedQuery": turn["processed_msg"] if turn["corrections"] else None,
+                "sources": [{"id": c["id"], "score": c["score"]} for c in chunks[:3]]
+            })
             
-            # Is this debunking a myth or confirming a fact? Let's figure that out
-            answer_lower = answer.lower()
-            if '❌' in answer or 'myth alert' in answer_lower or 'this is a myth' in answer_lower or "that's not quite right" in answer_lower or 'not true' in answer_lower or 'false' in answer_lower:
-                answer_type = "myth"
-            elif '✅' in answer or "that's right" in answer_lower or "this is true" in answer_lower or "this is correct" in answer_lower or 'correct' in answer_lower or 'yes' in answer_lower:
-                answer_type = "fact"
-            else:
-                answer_type = "general"
+            if not chunks:
+                answer = f"{correction_note}{NO_RESULTS_ANSWER}"
+                yield sse_event("type", {"type": "general"})
+                yield sse_event("token", {"text": answer})
+                yield sse_event("myTake", {"myTake": NO_RESULTS_MY_TAKE})
+                yield done_event({
+                    "answer": answer,
+                    "type": "general",
+                    "myTake": NO_RESULTS_MY_TAKE,
+                    "source": "fallback"
+                }, session)
+                return
             
-            # Now let's create a fun little "myTake" summary for the avatar to say
-            my_take_prompt = f"Based on this nutrition answer, write ONE SHORT sentence (max 15 words) that's a friendly personal take or key insight. Make it conversational and fun.\n\nAnswer: {answer[:200]}\n\nYour short take:"
+            # The avatar can pick its expression before the first word arrives
+            answer_type = classify_answer_type(turn)
+            yield sse_event("type", {"type": answer_type})
             
-            my_take_completion = client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[
-                    {"role": "user", "content": my_take_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=50
-            )
+            if correction_note:
+                yield sse_event("token", {"text": correction_note})
             
-            my_take = my_take_completion.choices[0].message.content.strip()
-            # Clean up any quotes around it
-            my_take = my_take.strip('"\'')
+            try:
+                stream = generate_answer(build_answer_messages(user_msg, chunks, turn["user_context"]), stream=True)
+            except UpstreamError as e:
+                log.warning("!! Groq unavailable, answering from the database directly: %s", e)
+                answer, my_take = fallback_reply(answer_type, chunks)
+                yield sse_event("token", {"text": answer})
+                yield sse_event("myTake", {"myTake": my_take})
+                yield done_event({
+                    "answer": correction_note + answer,
+                    "type": answer_type,
+                    "myTake": my_take,
+                    "source": "fallback"
+                }, session)
+                return
             
-            print(f"🏷️ Detected answer type: {answer_type}")
-            print(f"💭 Generated myTake: {my_take}")
-            print(f"📝 Answer preview: {answer[:100]}...")
+            # Pass Groq's tokens straight through as they arrive
+            pieces = []
+            for part in stream:
+                # Groq puts the usage on the last chunk
+                x_groq = getattr(part, "x_groq", None)
+                if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                    prompt_stats.record_usage(x_groq.usage)
+                if not part.choices:
+                    continue
+                text = part.choices[0].delta.content
+                if text:
+                    pieces.append(text)
+                    yield sse_event("token", {"text": text})
+            answer = "".join(pieces)
             
-            # Add the spell correction note at the top if we fixed anything
-            if correction_note:
-                answer = correction_note + answer
+            my_take = generate_my_take(answer)
+            yield sse_event("myTake", {"myTake": my_take})
+            
+            remember_answer(turn, answer, answer_type, my_take)
+            yield done_event({
+                "answer": correction_note + answer,
+                "type": answer_type,
+                "myTake": my_take,
+                "source": "groq_enhanced"
+            }, session)
+        except Exception as e:
+            log.exception("!! ERROR in /api/chat/stream: %s", e)
+            yield sse_event("error", {
+                "answer": "😅 Oops! I ran into a technical hiccup. Please try asking your nutrition question again!",
+                "error": str(e)
+            })
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # stop nginx from buffering the stream
+        }
+    )
+
+# -------------------------
+# BATCH CHAT API ENDPOINT
+# -------------------------
+def read_batch_request(data):
+    """
+    (items, concurrency, error). Items are {"message", "userPreferences"?, "userSelection"?,
+    "id"?} or plain strings; a top-level userPreferences applies to items without their own.
+    """
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, None, "items must be a non-empty list of questions"
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, None, f"At most {BATCH_MAX_ITEMS} items per batch"
+
+    shared_preferences = data.get("userPreferences") or []
+    items = [item if isinstance(item, dict) else {"message": item} for item in items]
+    items = [{"userPreferences": shared_preferences, **item} for item in items]
+    # A caller can ask for less concurrency than we allow, not more
+    try:
+        concurrency = max(1, min(int(data.get("concurrency") or BATCH_CONCURRENCY), BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        concurrency = BATCH_CONCURRENCY
+    return items, concurrency, None
+
+def batch_result(index, item, payload=None, error=None):
+    """
+    One NDJSON line's worth: the item's position (and its own id, if it sent one)
+    with either the usual /api/chat payload or an error
+    """
+    result = {"index": index}
+    if "id" in item:
+        result["id"] = item["id"]
+    if error is not None:
+        result["error"] = error
+    else:
+        CHAT_ANSWERS.inc(source=answer_source(payload))
+        result.update(payload)
+    return result
+
+def prepare_batch(items, offset):
+    """
+    Everything before Groq for a slice of a batch: the text checks per question, one
+    encode() for all of them, the answer cache, and one search when it's in process.
+    Returns (finished results, [(index, item, turn, chunks or None)] still to answer).
+    """
+    finished, waiting = [], []
+    for index, item in enumerate(items, start=offset):
+        try:
+            message = str(item.get("message") or "").strip()
+            if not message:
+                raise ValueError("Message is required")
+            turn = build_chat_turn(message, item.get("userSelection") or None,
+                                   tuple(item.get("userPreferences") or ()))
+        except Exception as e:
+            finished.append(batch_result(index, item, error=str(e)))
+            continue
+        if turn["response"]:
+            finished.append(batch_result(index, item, turn["response"]))
         else:
-            # Uh oh, we couldn't find anything relevant in our database
-            answer = f"{correction_note}🤔 Hmm, I don't have specific information about that topic in my nutrition database yet.\n\n**Try asking about:**\n• Common nutrition myths (carbs, fats, protein)\n• Specific foods (rice, chicken, fruits)\n• Weight management questions\n• Healthy eating tips\n\nI'm here to help separate nutrition facts from fiction! 💪"
-            answer_type = "general"
-            my_take = "Let me know what nutrition topic you'd like to explore!"
-        
-        return jsonify({
-            "answer": answer,
-            "type": answer_type,
-            "myTake": my_take,
-            "source": "groq_enhanced" if chunks else "fallback"
-        })
+            waiting.append((index, item, turn))
+    if not waiting:
+        return finished, []
+
+    texts = [turn["combined_query"] for _, _, turn in waiting]
+    try:
+        vectors = embed_many(texts)
     except Exception as e:
-        print(f"!! ERROR in /api/chat: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            "answer": "😅 Oops! I ran into a technical hiccup. Please try asking your nutrition question again!",
-            "error": str(e)
-        }), 500
+        # Find out which question the encoder chokes on - the others still get answers
+        log.warning("!! Batched encode failed, embedding one at a time: %s", e)
+        vectors = [None] * len(texts)
+
+    to_search = []
+    for (index, item, turn), vector in zip(waiting, vectors):
+        try:
+            check_answer_cache(turn, vector if vector is not None else embed(turn["combined_query"]))
+        except Exception as e:
+            finished.append(batch_result(index, item, error=str(e)))
+            continue
+        if turn["response"]:
+            finished.append(batch_result(index, item, turn["response"]))
+        else:
+            to_search.append((index, item, turn))
+
+    chunks = None
+    if to_search:
+        try:
+            chunks = pinecone_search_batch([t["combined_query"] for _, _, t in to_search],
+                                           [t["query_vec"] for _, _, t in to_search])
+        except Exception as e:
+            log.warning("!! Batched search failed, searching one at a time: %s", e)
+    chunks = chunks or [None] * len(to_search)
+    return finished, [(index, item, turn, found) for (index, item, turn), found in zip(to_search, chunks)]
+
+def answer_batch_item(index, item, turn, chunks):
+    """
+    Runs in the batch's thread pool: the search (unless it was done for the whole
+    slice) and the Groq calls for one question
+    """
+    try:
+        if chunks is None:
+            chunks = pinecone_search(turn["combined_query"], turn["query_vec"])
+        return batch_result(index, item, answer_turn(turn, chunks))
+    except Exception as e:
+        log.warning("!! Batch item %d failed: %s", index, e)
+        return batch_result(index, item, error=str(e))
+
+def answer_batch(items, concurrency=BATCH_CONCURRENCY):
+    """
+    Answers a list of questions (see read_batch_request for the item format) like
+    /api/chat would, without sessions. Yields one result per item as soon as it's
+    ready - not in order, each says which "index" it answers. A failing item gets
+    an "error" result; it doesn't stop the others.
+    """
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    pending = set()
+    try:
+        for start in range(0, len(items), BATCH_PREPARE_SIZE):
+            finished, waiting = prepare_batch(items[start:start + BATCH_PREPARE_SIZE], start)
+            yield from finished
+            for args in waiting:
+                # At most `concurrency` questions in flight; send answers as they finish
+                while len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(answer_batch_item, *args))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # If the client went away, don't start the questions still queued
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Many questions in one request, for bulk answering and evaluation jobs:
+        {"items": [{"message": "...", "userPreferences": [...], "id": "q1"}, "is rice bad?", ...],
+         "userPreferences": [...], "concurrency": 4}
+    Answers stream back as NDJSON, one line per item as it finishes.
+    """
+    items, concurrency, error = read_batch_request(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({"error": error}), 400
+
+    def generate():
+        for result in answer_batch(items, concurrency):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"}
+    )
+
+# -------------------------
+# CACHE INVALIDATION HOOK
+# -------------------------
+@app.route('/api/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """
+    Call this after re-uploading the dataset so we stop serving old answers
+    """
+    if CACHE_ADMIN_TOKEN and request.headers.get("X-Admin-Token") != CACHE_ADMIN_TOKEN:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    # An explicit {"all": true} also clears answers for the current version
+    clear_all = bool((request.get_json(silent=True) or {}).get("all"))
+    return jsonify(invalidate_answer_cache(clear_all))
+
+def invalidate_answer_cache(clear_all=False):
+    """
+    Re-reads the dataset version and drops answers built from older data
+    """
+    global current_dataset_version
+    current_dataset_version = dataset_version()
+    removed = response_cache.invalidate(keep_dataset_version=current_dataset_version)
+    if clear_all:
+        removed += response_cache.invalidate()
+
+    return {
+        "datasetVersion": current_dataset_version,
+        "removed": removed,
+        "responseCache": response_cache.stats(),
+        "embeddingCache": embedding_cache.stats()
+    }
+
+# -------------------------
+# HEALTH AND READINESS PROBES
+# -------------------------
+def readiness():
+    """
+    Ready once the model is warm and the retriever, myth classifier and Groq client exist
+    """
+    needed = search_resources() + (groq_client, myth_classifier)
+    resources = {r.name: r.status() for r in needed}
+    return {
+        "ready": all(r.ready for r in needed),
+        "resources": resources,
+        "startup": startup.as_dict()
+    }
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # The process is up and serving HTTP - that's all liveness means
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    status = readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+# -------------------------
+# RUNTIME STATS
+# -------------------------
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "datasetVersion": current_dataset_version,
+        "embeddingCache": embedding_cache.stats(),
+        "embeddingBatcher": embedding_batcher.stats(),
+        "responseCache": response_cache.stats(),
+        "answerStore": answer_store.stats() if answer_store is not None else None,
+        "answerTypeSources": dict(answer_type_sources),
+        "retrievalPaths": dict(retrieval_paths),
+        "promptTokens": prompt_stats.stats(),
+        "sessions": session_store.stats(),
+        "preferenceProfiles": preference_profile.cache_info()._asdict(),
+        "upstreams": upstream_stats()
+    })
+
+# -------------------------
+# PROMETHEUS METRICS
+# -------------------------
+def chat_metrics():
+    """
+    The /api/stats numbers, read at scrape time (stage and request latencies and
+    upstream counters are in telemetry.py and upstream.py)
+    """
+    batcher = embedding_batcher.stats()
+    families = cache_families("embedding", embedding_cache.stats()) + cache_families("response", response_cache.stats())
+    families += cache_families("session", session_store.stats())
+    if answer_store is not None:
+        families += cache_families("answer_store", answer_store.stats())
+    families += [
+        counter_family("retrieval_paths_total", "Searches by path (lexical, hybrid, vector...)", "path", retrieval_paths),
+        counter_family("answer_type_sources_total", "Myth/fact labels by who decided (local or llm)", "source",
+                       answer_type_sources),
+        gauge("embedding_batcher_queue_depth", "Texts waiting for a batched encode", batcher["queue_depth"]),
+        MetricFamily("embedding_batcher_items_total", "counter", "Texts encoded through the batcher",
+                     [("", {}, batcher["items"])]),
+        MetricFamily("prompt_tokens_total", "counter", "Answer prompt tokens: our estimate, the retrieved context "
+                     "(and what it would have been verbatim) and what Groq counted", [
+                         ("", {"kind": "estimated_prompt"}, prompt_stats.prompt_tokens),
+                         ("", {"kind": "context"}, prompt_stats.context_tokens),
+                         ("", {"kind": "context_verbatim"}, prompt_stats.baseline_tokens),
+                         ("", {"kind": "groq_prompt"}, prompt_stats.groq_prompt_tokens),
+                         ("", {"kind": "groq_completion"}, prompt_stats.groq_completion_tokens),
+                     ]),
+        MetricFamily("prompt_requests_total", "counter", "Answer prompts built, and Groq responses with usage", [
+            ("", {"kind": "built"}, prompt_stats.requests),
+            ("", {"kind": "groq_usage"}, prompt_stats.groq_requests),
+        ]),
+        gauge("resources_ready", "1 once every resource the chat needs has loaded", int(readiness()["ready"])),
+    ]
+    return families
+
+register_collector(chat_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
 
 # -------------------------
 # START THE SERVER
 # -------------------------
+# Kick off model loading as soon as we're imported (see MODEL_LOADING in config.py)
+if MODEL_LOADING == "eager":
+    warm_up()
+elif MODEL_LOADING == "background":
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
+startup.mark("app module imported")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5002, debug=False)
 
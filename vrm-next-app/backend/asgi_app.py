@@ -0,0 +1,401 @@
+"""
+Async (ASGI) serving mode for the chat backend.
+
+Same endpoints and payloads as app.py, but every request is a coroutine instead of
+a blocked worker thread, so one process can hold hundreds of conversations that
+are all waiting on Groq at the same time:
+
+- Groq calls go through the async client
+- encode() runs in a small thread pool (it's CPU-bound and releases the GIL)
+- Pinecone queries run in an I/O thread pool (sub-ms local retrieval runs inline)
+- the avatar's myTake is written from the top retrieved source (with its own
+  prompt), so it runs alongside the main answer instead of waiting for it. Those
+  answers are cached apart from app.py's, whose myTake comes from the answer.
+- Groq calls get the same deadlines, retries, hedging and circuit breaker as
+  app.py (see upstream.py); when Groq is unhealthy the sources are served directly
+
+Run it with an ASGI server, e.g.:
+    hypercorn asgi_app:app --bind 0.0.0.0:5002
+"""
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from groq import AsyncGroq
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+
+# The Flask module owns the models, retriever, caches and pipeline helpers
+import app as backend
+from config import ASYNC_EMBED_THREADS, ASYNC_IO_THREADS, CACHE_ADMIN_TOKEN, GROQ_FAST_TIMEOUT_SECONDS, UPSTREAM_TIMEOUTS
+from retrieval import LocalRetriever
+from stage_timing import begin, stage, timed
+from telemetry import CONTENT_TYPE, get_logger, observe_request, render_metrics, start_request
+from upstream import UpstreamError, pooled_http_client
+
+log = get_logger("vrm.asgi")
+
+app = cors(Quart(__name__))
+async_client = AsyncGroq(api_key=backend.GROQ_API_KEY, max_retries=0,
+                         http_client=pooled_http_client(UPSTREAM_TIMEOUTS["groq"], is_async=True))
+groq_upstream = backend.groq_upstream
+
+embed_executor = ThreadPoolExecutor(max_workers=ASYNC_EMBED_THREADS, thread_name_prefix="embed")
+io_executor = ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS, thread_name_prefix="retrieval")
+
+# Streams are timed until the response starts, without a Server-Timing header
+STREAMED_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+# Server-Timing header and request metrics, like app.py
+@app.before_request
+async def start_timing():
+    g.timings = begin()
+    start_request()
+
+
+@app.after_request
+async def add_server_timing(response):
+    if "timings" not in g:
+        return response
+    seconds = None
+    if response.mimetype not in STREAMED_TYPES:
+        response.headers["Server-Timing"] = g.timings.header()
+        seconds = g.timings.elapsed()
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    observe_request(endpoint, response.status_code, seconds)
+    return response
+
+
+ERROR_ANSWER = "😅 Oops! I ran into a technical hiccup. Please try asking your nutrition question again!"
+
+
+async def run_blocking(executor, fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args))
+
+
+# -------------------------
+# ASYNC PIPELINE STAGES
+# -------------------------
+async def prepare_turn(user_msg, session, user_selection):
+    """
+    Text-only checks inline, then the embedding off the event loop
+    """
+    turn = backend.build_chat_turn(user_msg, user_selection, session.preferences)
+    backend.remember_session(session, user_selection)
+    if turn["response"]:
+        return turn
+
+    with stage("embed"):
+        query_vec = await run_blocking(embed_executor, backend.embed, turn["combined_query"])
+    with stage("cache"):
+        return backend.check_answer_cache(turn, query_vec, my_take_from="source")
+
+
+async def search(turn):
+    # In-process retrieval is a matmul - cheaper than a thread hop. Until the
+    # retriever is loaded, go through the pool so we never block the event loop.
+    resources = backend.search_resources()
+    with stage("search"):
+        if all(r.ready for r in resources) and isinstance(backend.retriever.get(), LocalRetriever):
+            return backend.pinecone_search(turn["combined_query"], turn["query_vec"])
+        return await run_blocking(io_executor, backend.pinecone_search, turn["combined_query"], turn["query_vec"])
+
+
+@timed("classify")
+async def classify(turn):
+    """
+    Myth, fact or general - the local vote, and Groq only when it's unsure
+    """
+    if backend.myth_classifier.ready:
+        local, confident = backend.classify_locally(turn)
+    else:
+        local, confident = await run_blocking(io_executor, backend.classify_locally, turn)
+    if confident:
+        return backend.settle_answer_type(turn, local)
+
+    try:
+        completion = await groq_upstream.acall(
+            async_client.chat.completions.create,
+            timeout=GROQ_FAST_TIMEOUT_SECONDS,
+            messages=backend.build_classify_messages(turn["combined_query"]),
+            **backend.CLASSIFY_PARAMS
+        )
+        return backend.settle_answer_type(turn, local, backend.parse_myth_or_fact(completion))
+    except Exception as e:
+        log.warning("!! Groq classification failed, keeping local guess: %s", e)
+        return backend.settle_answer_type(turn, local)
+
+
+@timed("my_take")
+async def generate_my_take(source_text):
+    try:
+        completion = await groq_upstream.acall(
+            async_client.chat.completions.create,
+            timeout=GROQ_FAST_TIMEOUT_SECONDS,
+            messages=backend.build_source_take_messages(source_text),
+            **backend.MY_TAKE_PARAMS
+        )
+    except UpstreamError as e:
+        log.warning("!! Groq unavailable for the myTake: %s", e)
+        return backend.FALLBACK_MY_TAKE
+    return backend.clean_my_take(completion)
+
+
+@timed("llm")
+async def generate_answer(messages):
+    # None when Groq is unhealthy - the caller falls back to the raw sources
+    try:
+        return await groq_upstream.acall(async_client.chat.completions.create,
+                                         messages=messages, **backend.ANSWER_PARAMS)
+    except UpstreamError as e:
+        log.warning("!! Groq unavailable, answering from the database directly: %s", e)
+        return None
+
+
+def fallback_payload(turn, answer_type, chunks):
+    answer, my_take = backend.fallback_reply(answer_type, chunks)
+    return {
+        "answer": turn["correction_note"] + answer,
+        "type": answer_type,
+        "myTake": my_take,
+        "source": "fallback"
+    }
+
+
+def no_results_payload(turn):
+    return {
+        "answer": f"{turn['correction_note']}{backend.NO_RESULTS_ANSWER}",
+        "type": "general",
+        "myTake": backend.NO_RESULTS_MY_TAKE,
+        "source": "fallback"
+    }
+
+
+def chat_response(payload, session):
+    backend.CHAT_ANSWERS.inc(source=backend.answer_source(payload))
+    with stage("serialize"):
+        return jsonify({**payload, "sessionId": session.id})
+
+
+def read_chat_request(data):
+    """
+    The message, then the session and the button clicked (see backend.resolve_session)
+    """
+    return (data.get("message", "").strip(), *backend.resolve_session(data))
+
+
+# -------------------------
+# MAIN CHAT API ENDPOINT
+# -------------------------
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    user_msg, session, user_selection = read_chat_request(await request.get_json() or {})
+    if not user_msg:
+        return jsonify({"error": "Message is required"}), 400
+
+    try:
+        turn = await prepare_turn(user_msg, session, user_selection)
+        if turn["response"]:
+            return chat_response(turn["response"], session)
+
+        chunks = await search(turn)
+        log.debug("🔍 Found %d chunks from Pinecone", len(chunks))
+        if not chunks:
+            return chat_response(no_results_payload(turn), session)
+        compiled = backend.compiled_answer(turn, chunks)
+        if compiled:
+            return chat_response(compiled, session)
+
+        # The answer, the myTake and the answer type only depend on the retrieved
+        # sources and the question - run them together
+        messages = backend.build_answer_messages(user_msg, chunks, turn["user_context"])
+        completion, my_take, answer_type = await asyncio.gather(
+            generate_answer(messages),
+            generate_my_take(chunks[0]["text"]),
+            classify(turn)
+        )
+        if completion is None:
+            return chat_response(fallback_payload(turn, answer_type, chunks), session)
+        answer = completion.choices[0].message.content
+        backend.prompt_stats.record_usage(getattr(completion, "usage", None))
+        backend.remember_answer(turn, answer, answer_type, my_take)
+
+        return chat_response({
+            "answer": turn["correction_note"] + answer,
+            "type": answer_type,
+            "myTake": my_take,
+            "source": "groq_enhanced"
+        }, session)
+    except Exception as e:
+        log.exception("!! ERROR in async /api/chat: %s", e)
+        return jsonify({"answer": ERROR_ANSWER, "error": str(e)}), 500
+
+
+# -------------------------
+# STREAMING CHAT API ENDPOINT
+# -------------------------
+@app.route('/api/chat/stream', methods=['POST'])
+async def chat_stream():
+    """
+    Same Server-Sent Events protocol as app.py's /api/chat/stream
+    """
+    user_msg, session, user_selection = read_chat_request(await request.get_json() or {})
+    if not user_msg:
+        return jsonify({"error": "Message is required"}), 400
+
+    async def generate():
+        my_take_task = None
+        try:
+            turn = await prepare_turn(user_msg, session, user_selection)
+            if turn["response"]:
+                yield backend.done_event(turn["response"], session)
+                return
+
+            chunks = await search(turn)
+            compiled = backend.compiled_answer(turn, chunks)
+            if compiled:
+                yield backend.done_event(compiled, session)
+                return
+            yield backend.sse_event("meta", {
+                "source": "groq_enhanced" if chunks else "fallback",
+                "correctedQuery": turn["processed_msg"] if turn["corrections"] else None,
+                "sources": [{"id": c["id"], "score": c["score"]} for c in chunks[:3]]
+            })
+
+            if not chunks:
+                payload = no_results_payload(turn)
+                yield backend.sse_event("type", {"type": payload["type"]})
+                yield backend.sse_event("token", {"text": payload["answer"]})
+                yield backend.sse_event("myTake", {"myTake": payload["myTake"]})
+                yield backend.done_event(payload, session)
+                return
+
+            # Start the myTake now so it's ready by the time the answer finishes streaming
+            my_take_task = asyncio.create_task(generate_my_take(chunks[0]["text"]))
+            answer_type = await classify(turn)
+            yield backend.sse_event("type", {"type": answer_type})
+            if turn["correction_note"]:
+                yield backend.sse_event("token", {"text": turn["correction_note"]})
+
+            messages = backend.build_answer_messages(user_msg, chunks, turn["user_context"])
+            try:
+                stream = await groq_upstream.acall(async_client.chat.completions.create, hedge=False,
+                                                   messages=messages, stream=True, **backend.ANSWER_PARAMS)
+            except UpstreamError as e:
+                log.warning("!! Groq unavailable, answering from the database directly: %s", e)
+                payload = fallback_payload(turn, answer_type, chunks)
+                # The correction note already went out as the first token
+                yield backend.sse_event("token", {"text": payload["answer"][len(turn["correction_note"]):]})
+                yield backend.sse_event("myTake", {"myTake": payload["myTake"]})
+                yield backend.done_event(payload, session)
+                return
+
+            pieces = []
+            async for part in stream:
+                x_groq = getattr(part, "x_groq", None)
+                if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                    backend.prompt_stats.record_usage(x_groq.usage)
+                if not part.choices:
+                    continue
+                text = part.choices[0].delta.content
+                if text:
+                    pieces.append(text)
+                    yield backend.sse_event("token", {"text": text})
+            answer = "".join(pieces)
+
+            my_take = await my_take_task
+            yield backend.sse_event("myTake", {"myTake": my_take})
+
+            backend.remember_answer(turn, answer, answer_type, my_take)
+            yield backend.done_event({
+                "answer": turn["correction_note"] + answer,
+                "type": answer_type,
+                "myTake": my_take,
+                "source": "groq_enhanced"
+            }, session)
+        except Exception as e:
+            log.exception("!! ERROR in async /api/chat/stream: %s", e)
+            yield backend.sse_event("error", {"answer": ERROR_ANSWER, "error": str(e)})
+        finally:
+            # Client went away or we failed - don't leave the Groq call running
+            if my_take_task and not my_take_task.done():
+                my_take_task.cancel()
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# -------------------------
+# BATCH CHAT API ENDPOINT
+# -------------------------
+@app.route('/api/chat/batch', methods=['POST'])
+async def chat_batch():
+    """
+    Same NDJSON protocol as app.py's /api/chat/batch. The batch runs its own
+    bounded thread pool (backend.answer_batch); we just hand its lines over.
+    """
+    items, concurrency, error = backend.read_batch_request(await request.get_json(silent=True) or {})
+    if error:
+        return jsonify({"error": error}), 400
+
+    async def generate():
+        # If the client goes away, dropping the generator closes it, which stops
+        # the questions it hasn't started yet
+        results = backend.answer_batch(items, concurrency)
+        while True:
+            result = await run_blocking(io_executor, next, results, None)
+            if result is None:
+                return
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+
+# -------------------------
+# HEALTH AND READINESS PROBES
+# -------------------------
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    return jsonify({"status": "ok"})
+
+
+@app.route('/readyz', methods=['GET'])
+async def readyz():
+    status = backend.readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+# -------------------------
+# PROMETHEUS METRICS
+# -------------------------
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    # app.py's collectors are registered on import - same numbers as its /metrics
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+
+# -------------------------
+# CACHE INVALIDATION HOOK
+# -------------------------
+@app.route('/api/cache/invalidate', methods=['POST'])
+async def invalidate_cache():
+    if CACHE_ADMIN_TOKEN and request.headers.get("X-Admin-Token") != CACHE_ADMIN_TOKEN:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    clear_all = bool((await request.get_json(silent=True) or {}).get("all"))
+    return jsonify(backend.invalidate_answer_cache(clear_all))
+
+
+if __name__ == "__main__":
+    import hypercorn.asyncio
+    from hypercorn.config import Config
+
+    hypercorn_config = Config()
+    hypercorn_config.bind = ["0.0.0.0:5002"]
+    asyncio.run(hypercorn.asyncio.serve(app, hypercorn_config))
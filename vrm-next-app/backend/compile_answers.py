@@ -0,0 +1,169 @@
+"""
+Writes the answer store (see nutrition_bot/answer_store.py): every myth in the
+dataset, asked the way each persona would ask it, answered once by Groq ahead of
+time. /api/chat then serves those without a single LLM call.
+
+    python compile_answers.py build               # the whole dataset, every persona
+    python compile_answers.py build --limit 20    # just the first 20 records, to try it out
+    python compile_answers.py info                # what's there and whether the app will use it
+
+A persona is a button the UI offers ("I'm vegan", "I have diabetes" ...). Personas
+that add up to the same user context, and questions whose top search result is the
+same record, share one answer - so there are far fewer Groq calls than questions.
+
+The app skips a store built from another dataset, answer prompt or embedding model,
+so rebuild after changing any of them.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Everything has to be loaded before the first question, and config.py reads this on import
+os.environ["MODEL_LOADING"] = "eager"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+import app
+
+from answer_store import read_manifest, write_answer_store
+from config import ANSWER_COMPILE_CONCURRENCY, ANSWER_STORE_DIR, DATASET_PATH, EMBEDDING_MODEL_NAME
+from dataset import dataset_version, load_dataset
+
+
+def compile_questions(records, personas):
+    """
+    [(question, turn)] for every record's myth as asked by each persona (and by
+    someone who didn't pick one), skipping ones that would just get buttons back
+    """
+    questions = []
+    for item in records:
+        myth = (item.get("myth") or "").strip()
+        if not myth:
+            continue
+        for persona in [None] + personas:
+            turn = app.build_chat_turn(myth, persona, ())
+            if not turn["response"]:
+                questions.append((myth, turn))
+    return questions
+
+
+def search_all(pool, turns):
+    """
+    The chunks for every turn: one batched search in process, or one search per
+    turn (on the pool) against Pinecone
+    """
+    chunks = app.pinecone_search_batch([t["combined_query"] for t in turns], [t["query_vec"] for t in turns])
+    if chunks is None:
+        chunks = list(pool.map(lambda t: app.pinecone_search(t["combined_query"], t["query_vec"]), turns))
+    return chunks
+
+
+def build_store(out_dir=ANSWER_STORE_DIR, limit=None, concurrency=ANSWER_COMPILE_CONCURRENCY,
+                data_path=DATASET_PATH):
+    # Answer everything fresh, never from a store that may be about to be replaced
+    app.answer_store = None
+
+    records = load_dataset(data_path)[:limit]
+    personas = app.keyword_rules.button_values()
+    started = time.perf_counter()
+
+    questions = compile_questions(records, personas)
+    turns = [turn for _, turn in questions]
+    print(f"📝 {len(questions)} questions from {len(records)} records and {len(personas)} personas")
+
+    vectors = app.embed_many([t["combined_query"] for t in turns])
+    for turn, vector in zip(turns, vectors):
+        # Only to fill in the turn's query_vec and cache partition - a hit is ignored
+        app.check_answer_cache(turn, vector)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="compile") as pool:
+        found = search_all(pool, turns)
+
+        # (top record, user context) -> the questions that share one answer
+        groups: dict[tuple[str, str], list[int]] = {}
+        for position, (turn, chunks) in enumerate(zip(turns, found)):
+            if chunks:
+                groups.setdefault((chunks[0]["id"], turn["user_context"]), []).append(position)
+        print(f"🧩 {len(groups)} answers to write ({len(turns) - sum(map(len, groups.values()))} questions found nothing)")
+
+        keys = list(groups)
+        payloads = pool.map(lambda key: app.answer_turn(turns[groups[key][0]], found[groups[key][0]]), keys)
+
+        contexts, answers, question_answers, question_rows = [], [], [], []
+        context_index = {}
+        skipped = 0
+        for (record_id, context), payload in zip(keys, payloads):
+            if payload["source"] != "groq_enhanced":
+                # Groq was down - a database fallback isn't worth keeping
+                skipped += 1
+                continue
+            turn = turns[groups[(record_id, context)][0]]
+            if context not in context_index:
+                context_index[context] = len(contexts)
+                contexts.append(context)
+            for position in groups[(record_id, context)]:
+                question_answers.append(len(answers))
+                question_rows.append(vectors[position])
+            answers.append({
+                "record": record_id,
+                "context": context_index[context],
+                "type": payload["type"],
+                # The spelling note is for whoever asked, not part of the answer
+                "answer": payload["answer"][len(turn["correction_note"]):],
+                "myTake": payload["myTake"],
+            })
+
+    if skipped:
+        print(f"⚠️ {skipped} answers fell back to the database (Groq unavailable) and were left out")
+    questions_matrix = np.asarray(question_rows, dtype=np.float32).reshape(len(question_rows), -1)
+    return write_answer_store(out_dir, contexts, answers, question_answers, questions_matrix,
+                              app.answer_prompt_version(), data_path=data_path,
+                              records=len(records), personas=len(personas),
+                              build_seconds=round(time.perf_counter() - started, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build / inspect the precompiled answers")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="answer every dataset myth for every persona and write the store")
+    build.add_argument("--out", default=ANSWER_STORE_DIR)
+    build.add_argument("--limit", type=int, default=None, help="only the first N records")
+    build.add_argument("--concurrency", type=int, default=ANSWER_COMPILE_CONCURRENCY,
+                       help="Groq calls in flight")
+    build.add_argument("--data", default=DATASET_PATH)
+
+    info = sub.add_parser("info", help="show the manifest and whether the app will use it")
+    info.add_argument("--dir", default=ANSWER_STORE_DIR)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        manifest = build_store(args.out, args.limit, args.concurrency, args.data)
+        print(json.dumps(manifest, indent=2))
+        print(f"✅ Wrote {manifest['answers']} answers for {manifest['questions']} questions to {args.out}")
+        return
+
+    manifest = read_manifest(args.dir)
+    if manifest is None:
+        print(f"No compiled answers in {args.dir}")
+        return
+    print(json.dumps(manifest, indent=2))
+    problems = [
+        name for name, current in (("dataset", manifest["dataset_version"] == dataset_version()),
+                                   ("answer prompt", manifest["prompt_version"] == app.answer_prompt_version()),
+                                   ("embedding model", manifest["model_name"] == EMBEDDING_MODEL_NAME))
+        if not current
+    ]
+    if problems:
+        print(f"⚠️ Stale - the {', '.join(problems)} changed since this was built")
+    else:
+        print("✅ Current - the app will serve these")
+
+
+if __name__ == "__main__":
+    main()
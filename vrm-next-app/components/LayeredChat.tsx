@@ -35,7 +35,9 @@ export default function LayeredChat({ onTypingChange, onGreeting, onCaloriesDete
     }
   ]);
   const [isWaitingForSelection, setIsWaitingForSelection] = useState(false);
-  const [userPreferences, setUserPreferences] = useState<string[]>([]);
+  // The backend remembers the preferences picked so far under this id (every server
+  // worker has to share the session store for that - see SESSION_BACKEND in config.py)
+  const [sessionId, setSessionId] = useState<string | null>(null);
   const containerRef = useRef<HTMLDivElement>(null);
 
   // Auto-scroll to bottom when new messages arrive
@@ -62,9 +64,6 @@ export default function LayeredChat({ onTypingChange, onGreeting, onCaloriesDete
     };
     setMessages(prev => [...prev, userMessage]);
     setIsWaitingForSelection(false);
-    
-    // Store user preference
-    setUserPreferences(prev => [...prev, buttonValue]);
 
     try {
       // Send selection to backend
@@ -76,7 +75,7 @@ export default function LayeredChat({ onTypingChange, onGreeting, onCaloriesDete
         body: JSON.stringify({ 
           message: originalQuery,
           userSelection: buttonValue,
-          userPreferences: userPreferences
+          sessionId: sessionId
         }),
       });
 
@@ -85,6 +84,9 @@ export default function LayeredChat({ onTypingChange, onGreeting, onCaloriesDete
       }
 
       const data = await response.json();
+      if (data.sessionId) {
+        setSessionId(data.sessionId);
+      }
       const botText = data.answer || data.response || data.message || 'Sorry, I could not process that.';
 
       // Add personalized bot response
@@ -130,7 +132,7 @@ export default function LayeredChat({ onTypingChange, onGreeting, onCaloriesDete
         },
         body: JSON.stringify({ 
           message: text,
-          userPreferences: userPreferences
+          sessionId: sessionId
         }),
       });
 
@@ -139,6 +141,9 @@ export default function LayeredChat({ onTypingChange, onGreeting, onCaloriesDete
       }
 
       const data = await response.json();
+      if (data.sessionId) {
+        setSessionId(data.sessionId);
+      }
       const botText = data.answer || data.response || data.message || 'Sorry, I could not process that.';
       const buttons = data.buttons || null;
       const originalQuery = data.originalQuery || null;